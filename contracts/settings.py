@@ -30,11 +30,13 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'contracts_app.metrics.MetricsMiddleware',  # первым — меряет запрос целиком
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'contracts_app.history.HistoryMiddleware',  # история изменений — одной вставкой на запрос
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -43,7 +45,8 @@ ROOT_URLCONF = 'contracts.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates с замером времени шаблонов для /metrics
+        'BACKEND': 'contracts_app.metrics.InstrumentedTemplates',
         'DIRS': [],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -59,16 +62,89 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'contracts.wsgi.application'
 
+# Метрики запросов (contracts_app/metrics.py): /metrics в формате Prometheus,
+# заголовок Server-Timing и журнал SQL-запросов дольше SLOW_QUERY_MS
+METRICS_ENABLED = config('METRICS_ENABLED', default=True, cast=bool)
+# Доступ к /metrics: Authorization: Bearer METRICS_TOKEN (bearer_token в Prometheus)
+# или вход сотрудником (is_staff). METRICS_ALLOWED_IPS — только без обратного
+# прокси: за nginx все запросы приходят с его адреса, и этот адрес сюда добавлять нельзя.
+METRICS_TOKEN = config('METRICS_TOKEN', default='')
+METRICS_ALLOWED_IPS = config('METRICS_ALLOWED_IPS', default='', cast=Csv())
+SERVER_TIMING = config('SERVER_TIMING', default=DEBUG, cast=bool)
+SLOW_QUERY_MS = config('SLOW_QUERY_MS', default=200, cast=int)
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {'console': {'class': 'logging.StreamHandler'}},
+    'loggers': {'contracts_app.metrics': {'handlers': ['console'], 'level': 'WARNING'}},
+}
+
 CRISPY_ALLOWED_TEMPLATE_PACKS = "bootstrap5"
 CRISPY_TEMPLATE_PACK = "bootstrap5"
 
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
+DATABASE_PATH = BASE_DIR / config('DATABASE_NAME', default='db.sqlite3')
+
+# SQLite под параллельной записью: WAL — читатели не ждут писателя; busy_timeout —
+# ждать блокировку вместо «database is locked»; synchronous=NORMAL в WAL безопасен
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'busy_timeout': config('SQLITE_BUSY_TIMEOUT', default=5000, cast=int),  # мс
+    'synchronous': 'NORMAL',
+    'mmap_size': 128 * 1024 * 1024,
+    'cache_size': -20000,  # ~20 МБ на соединение
+    'temp_store': 'MEMORY',
+}
+
+
+def sqlite_init_command(pragmas):
+    return ';'.join(f'PRAGMA {name}={value}' for name, value in pragmas.items())
+
+
+DATABASE_COMMON = {
+    'ENGINE': 'django.db.backends.sqlite3',
+    'CONN_MAX_AGE': config('CONN_MAX_AGE', default=60, cast=int),
+    'CONN_HEALTH_CHECKS': True,
+}
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / config('DATABASE_NAME', default='db.sqlite3'),
+        **DATABASE_COMMON,
+        'NAME': DATABASE_PATH,
+        # IMMEDIATE: писатель берёт блокировку в начале транзакции и ждёт busy_timeout,
+        # а не получает ошибку при повышении блокировки посреди транзакции
+        'OPTIONS': {'init_command': sqlite_init_command(SQLITE_PRAGMAS), 'transaction_mode': 'IMMEDIATE'},
+    },
+    # Тот же файл только для чтения — для списков, выгрузок и API (contracts_app/routers.py).
+    # При переходе на PostgreSQL здесь будет реплика, роутер не меняется.
+    'replica': {
+        **DATABASE_COMMON,
+        'NAME': f'file:{DATABASE_PATH}?mode=ro',
+        # journal_mode в режиме ro не переключить — WAL хранится в самом файле базы
+        'OPTIONS': {'init_command': sqlite_init_command(
+            {name: value for name, value in SQLITE_PRAGMAS.items() if name != 'journal_mode'}
+        )},
+        'TEST': {'MIRROR': 'default'},
+    },
+}
+DATABASE_ROUTERS = ['contracts_app.routers.ReadReplicaRouter']
+
+
+# Кэш: locmem (по умолчанию), file или redis (Redis или совместимый сервер).
+# Версии для ETag и ключей кэша хранятся в базе (caching.py), так что и с locmem
+# изменения из других воркеров и management-команд видны сразу.
+CACHE_BACKEND = config('CACHE_BACKEND', default='locmem')
+CACHE_BACKENDS = {
+    'locmem': ('django.core.cache.backends.locmem.LocMemCache', 'contracts'),
+    'file': ('django.core.cache.backends.filebased.FileBasedCache', str(BASE_DIR / 'cache')),
+    'redis': ('django.core.cache.backends.redis.RedisCache', 'redis://127.0.0.1:6379/1'),
+}
+CACHES = {
+    'default': {
+        'BACKEND': CACHE_BACKENDS[CACHE_BACKEND][0],
+        'LOCATION': config('CACHE_LOCATION', default=CACHE_BACKENDS[CACHE_BACKEND][1]),
     }
 }
 
@@ -112,9 +188,30 @@ STATIC_URL = 'static/'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Вложения договоров отдаются только после проверки прав (contracts_app/downloads.py):
+# '' — сам Django (FileResponse с Range), 'nginx' — X-Accel-Redirect на internal-location
+# PROTECTED_MEDIA_URL, 'sendfile' — X-Sendfile (Apache mod_xsendfile, lighttpd)
+PROTECTED_MEDIA_SERVER = config('PROTECTED_MEDIA_SERVER', default='')
+PROTECTED_MEDIA_URL = config('PROTECTED_MEDIA_URL', default='/protected-media/')
+LOGIN_URL = 'admin:login'
+
 # Для файлов
-FILE_UPLOAD_MAX_MEMORY_SIZE = 20 * 1024 * 1024  # 20 МБ
+# Загрузки крупнее 2.5 МБ пишутся во временный файл кусками, а не держатся в памяти;
+# лимит размера вложения (20 МБ) проверяет validate_file_size.
+FILE_UPLOAD_MAX_MEMORY_SIZE = 2621440  # 2.5 МБ
 DATA_UPLOAD_MAX_MEMORY_SIZE = 20 * 1024 * 1024
+# Формсет АК до 500 строк по 5 полей — стандартного лимита в 1000 полей не хватает
+DATA_UPLOAD_MAX_NUMBER_FIELDS = 3000
+
+# Уведомления о сроках договоров
+# Для отладки: python -m aiosmtpd -n -l localhost:1025
+EMAIL_HOST = config('EMAIL_HOST', default='localhost')
+EMAIL_PORT = config('EMAIL_PORT', default=1025, cast=int)
+EMAIL_HOST_USER = config('EMAIL_HOST_USER', default='')
+EMAIL_HOST_PASSWORD = config('EMAIL_HOST_PASSWORD', default='')
+EMAIL_USE_TLS = config('EMAIL_USE_TLS', default=False, cast=bool)
+DEFAULT_FROM_EMAIL = config('DEFAULT_FROM_EMAIL', default='contracts@localhost')
+CONTRACT_EXPIRY_LEAD_DAYS = config('CONTRACT_EXPIRY_LEAD_DAYS', default='30,7,1', cast=Csv(int))
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
@@ -1,10 +1,10 @@
 # contracts/urls.py
 from django.contrib import admin
 from django.urls import path, include
-from django.conf import settings
-from django.conf.urls.static import static
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('', include('contracts_app.urls')),  # ← Главная страница
-] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
+]
+# MEDIA_URL намеренно не раздаётся: вложения договоров — только через
+# contracts_app.views.contract_file с проверкой прав
\ No newline at end of file
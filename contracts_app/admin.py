@@ -1,6 +1,12 @@
 #contracts_app/admin.py
 from django.contrib import admin
-from .models import Work, Region, District, Implementator, Contract, AK
+from django.contrib.admin.widgets import AdminFileWidget, AutocompleteSelect
+from django.core.paginator import Paginator
+from django.db.models import Count
+from django.forms.models import BaseInlineFormSet
+from django.urls import reverse
+from . import caching, history, summary
+from .models import Work, Region, District, Implementator, Contract, AK, ChangeRecord
 
 
 @admin.register(Work)
@@ -13,8 +19,13 @@ class WorkAdmin(admin.ModelAdmin):
 class RegionAdmin(admin.ModelAdmin):
     list_display = ('name', 'code', 'district_count')
     search_fields = ('name', 'code')
-    def district_count(self, obj): return obj.districts.count()
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(district_total=Count('districts'))
+
+    def district_count(self, obj): return obj.district_total
     district_count.short_description = "Районов"
+    district_count.admin_order_field = 'district_total'
 
 
 @admin.register(District)
@@ -27,23 +38,97 @@ class DistrictAdmin(admin.ModelAdmin):
 
 @admin.register(Implementator)
 class ImplementatorAdmin(admin.ModelAdmin):
-    list_display = ('name', 'inn')
+    list_display = ('name', 'inn', 'email')
     search_fields = ('name', 'inn')
 
 
-# Инлайн для АК
+# Инлайн для АК: по AK_INLINE_PER_PAGE строк на страницу (?ak_page=N)
+AK_INLINE_PER_PAGE = 50
+
+
+class DistrictAutocompleteSelect(AutocompleteSelect):
+    """Автокомплит района, которому можно отдать уже загруженный район вместо запроса на каждую строку."""
+    selected = None
+
+    def optgroups(self, name, value, attr=None):
+        district = self.selected
+        if district is None or [str(v) for v in value] != [str(district.pk)]:
+            return super().optgroups(name, value, attr)
+        options = [] if self.is_required else [self.create_option(name, '', '', False, 0)]
+        options.append(self.create_option(name, district.pk, str(district), {str(district.pk)}, len(options)))
+        return [(None, options, 0)]
+
+
+class PaginatedAKFormSet(BaseInlineFormSet):
+    page_number = 1
+
+    def get_queryset(self):
+        if not hasattr(self, '_queryset'):
+            paginator = Paginator(super().get_queryset(), AK_INLINE_PER_PAGE)
+            self.page = paginator.get_page(self.page_number)
+            self._queryset = self.page.object_list
+        return self._queryset
+
+    def _construct_form(self, i, **kwargs):
+        form = super()._construct_form(i, **kwargs)
+        if form.instance.pk and form.instance.district_id:
+            widget = form.fields['district'].widget
+            getattr(widget, 'widget', widget).selected = form.instance.district  # под RelatedFieldWidgetWrapper
+        return form
+
+
 class AKInline(admin.TabularInline):
     model = AK
+    formset = PaginatedAKFormSet
+    template = 'admin/contracts_app/ak_inline.html'
+    autocomplete_fields = ('district',)
+    ordering = ('number',)
     extra = 1
     min_num = 0
     max_num = 500
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('district__region')
+
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        if db_field.name == 'district':
+            kwargs['widget'] = DistrictAutocompleteSelect(db_field, self.admin_site, using=kwargs.get('using'))
+        return super().formfield_for_foreignkey(db_field, request, **kwargs)
+
+    def get_formset(self, request, obj=None, **kwargs):
+        formset = super().get_formset(request, obj, **kwargs)
+        formset.page_number = request.GET.get('ak_page') or 1
+        return formset
+
+
+class _DownloadLink(str):
+    """Имя файла, у которого url — защищённая выдача, а не MEDIA_URL."""
+    url = None
+
+
+class ProtectedFileWidget(AdminFileWidget):
+    """Ссылка «На данный момент» ведёт на contract_file с проверкой прав."""
+
+    def __init__(self, download_url, attrs=None):
+        super().__init__(attrs)
+        self.download_url = download_url
+
+    def format_value(self, value):
+        if value and getattr(value, 'url', None):
+            link = _DownloadLink(value)
+            link.url = self.download_url
+            return link
+        return super().format_value(value)
+
 
 @admin.register(Contract)
 class ContractAdmin(admin.ModelAdmin):
     list_display = ('customer_name', 'implementator', 'start_date', 'end_date', 'status', 'file_count', 'ak_count')
     list_filter = ('status', 'implementator', 'start_date', 'end_date')
     search_fields = ('customer_name', 'customer_inn', 'implementator__name')
+    list_select_related = ('implementator',)
+    autocomplete_fields = ('implementator',)
+    readonly_fields = ('status', 'created_at', 'updated_at')
     inlines = [AKInline]
 
     fieldsets = (
@@ -55,10 +140,56 @@ class ContractAdmin(admin.ModelAdmin):
         ("Система", {'fields': ('status', 'created_at', 'updated_at'), 'classes': ('collapse',)}),
     )
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).with_counts()
+
+    def changeform_view(self, request, object_id=None, form_url='', extra_context=None):
+        # Инлайн АК сохраняется построчно — сводки, история и сброс кэша один раз на договор
+        with history.batch(), summary.deferred(), caching.deferred():
+            return super().changeform_view(request, object_id, form_url, extra_context)
+
+    def get_form(self, request, obj=None, **kwargs):
+        # MEDIA_URL не раздаётся (см. downloads.py) — ссылки на файлы ведут на contract_file
+        if obj is not None:
+            kwargs['widgets'] = {
+                f'file{number}': ProtectedFileWidget(reverse('contracts:contract_file', args=[obj.pk, number]))
+                for number in (1, 2, 3)
+            }
+        return super().get_form(request, obj, **kwargs)
+
     def ak_count(self, obj):
-        return obj.aks.count()
+        return obj.ak_count
     ak_count.short_description = "АК"
+    ak_count.admin_order_field = 'ak_count'
 
     def file_count(self, obj):
-        return obj.file_count()
-    file_count.short_description = "Файлов"
\ No newline at end of file
+        return obj.file_total
+    file_count.short_description = "Файлов"
+    file_count.admin_order_field = 'file_total'
+
+
+@admin.register(ChangeRecord)
+class ChangeRecordAdmin(admin.ModelAdmin):
+    """История только для чтения; записи пишет history.py."""
+    list_display = ('changed_at', 'object_type', 'object_id', 'action', 'user', 'changes')
+    list_filter = ('object_type', 'action')
+    list_select_related = ('user',)
+    search_fields = ('=object_id',)
+    search_help_text = "ID договора или АК"
+    ordering = ('-changed_at', '-id')
+    show_full_result_count = False  # COUNT(*) по журналу в десятки миллионов строк — дорого
+
+    def get_search_results(self, request, queryset, search_term):
+        # Поиск — по ID объекта, по индексу (object_type, object_id, changed_at)
+        if search_term.strip().isdigit():
+            return queryset.filter(object_id=int(search_term)), False
+        return queryset, False
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
@@ -0,0 +1,174 @@
+# contracts_app/api.py
+"""
+JSON API только для чтения: договоры, АК, районы, исполнители.
+
+Строки читаются через values()/values_list() только по запрошенным полям
+(?fields=) — экземпляры моделей не создаются.
+Постранично — курсор по ключу ресурса (см. pagination.py), для полной
+выгрузки — поток NDJSON (?format=ndjson) без пагинации. Для инкрементальной
+синхронизации есть фильтр updated_at__gt: договоры сортируются по
+(updated_at, id), так что клиент забирает только изменившееся. История
+изменений (history) отдаётся так же — по (changed_at, id) с changed_at__gt.
+"""
+from dataclasses import dataclass, field
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import Http404
+from django.utils.dateparse import parse_date, parse_datetime
+
+from .models import AK, ChangeRecord, Contract, District, Implementator
+from .pagination import InvalidCursor, paginate_by_cursor
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+NDJSON_CHUNK_SIZE = 2000
+
+
+class APIError(ValueError):
+    """Некорректные параметры запроса (ответ 400)."""
+
+
+@dataclass(frozen=True)
+class Resource:
+    get_queryset: callable
+    fields: dict                  # публичное имя -> выражение для values()
+    key: tuple = ('id',)          # ключ курсора — колонки, совпадающие с публичными именами
+    filters: dict = field(default_factory=dict)  # параметр -> (lookup, разбор значения)
+
+    def select(self, names):
+        unknown = [name for name in names if name not in self.fields]
+        if unknown:
+            raise APIError(f"Неизвестные поля: {', '.join(unknown)}. Доступны: {', '.join(self.fields)}.")
+        return list(names) or list(self.fields)
+
+
+def _int(value):
+    if not value.isdigit():
+        raise ValueError
+    return int(value)
+
+
+def _datetime(value):
+    parsed = parse_datetime(value)
+    if parsed is None:
+        raise ValueError
+    return parsed
+
+
+def _date(value):
+    parsed = parse_date(value)
+    if parsed is None:
+        raise ValueError
+    return parsed
+
+
+RESOURCES = {
+    'contracts': Resource(
+        get_queryset=lambda: Contract.objects.with_live_status(),
+        fields={
+            'id': 'id', 'customer_name': 'customer_name', 'customer_inn': 'customer_inn',
+            'start_date': 'start_date', 'end_date': 'end_date', 'implementator': 'implementator_id',
+            'status': 'live_status', 'gos_services': 'gos_services', 'oko': 'oko', 'spolokh': 'spolokh',
+            'created_at': 'created_at', 'updated_at': 'updated_at',
+        },
+        key=('updated_at', 'id'),
+        filters={
+            'updated_at__gt': ('updated_at__gt', _datetime),
+            'implementator': ('implementator_id', _int),
+            'end_date__gte': ('end_date__gte', _date),
+            'end_date__lte': ('end_date__lte', _date),
+        },
+    ),
+    'aks': Resource(
+        get_queryset=lambda: AK.objects.all(),
+        fields={
+            'id': 'id', 'contract': 'contract_id', 'number': 'number',
+            'district': 'district_id', 'address': 'address',
+        },
+        filters={
+            'contract': ('contract_id', _int),
+            # Изменение АК обновляет updated_at договора (см. signals.py)
+            'updated_at__gt': ('contract__updated_at__gt', _datetime),
+        },
+    ),
+    'districts': Resource(
+        get_queryset=lambda: District.objects.all(),
+        fields={'id': 'id', 'name': 'name', 'region': 'region_id', 'region_name': 'region__name',
+                'population': 'population'},
+        filters={'region': ('region_id', _int)},
+    ),
+    'implementators': Resource(
+        get_queryset=lambda: Implementator.objects.all(),
+        fields={'id': 'id', 'name': 'name', 'inn': 'inn', 'email': 'email'},
+    ),
+    'history': Resource(
+        get_queryset=lambda: ChangeRecord.objects.all(),
+        fields={
+            'id': 'id', 'object_type': 'object_type', 'object_id': 'object_id', 'action': 'action',
+            'changes': 'changes', 'user': 'user_id', 'changed_at': 'changed_at',
+        },
+        key=('changed_at', 'id'),
+        filters={
+            'changed_at__gt': ('changed_at__gt', _datetime),
+            'object_type': ('object_type', _int),  # 1 — договор, 2 — АК
+            'object_id': ('object_id', _int),
+        },
+    ),
+}
+
+
+def get_resource(name):
+    try:
+        return RESOURCES[name]
+    except KeyError:
+        raise Http404(f"Неизвестный ресурс: {name}.")
+
+
+def _parse_fields(params):
+    return [name.strip() for name in params.get('fields', '').split(',') if name.strip()]
+
+
+def build_queryset(resource, params):
+    """(отфильтрованный queryset, выбранные поля) по параметрам запроса."""
+    queryset = resource.get_queryset()
+    for param, (lookup, parse) in resource.filters.items():
+        value = params.get(param)
+        if value:
+            try:
+                queryset = queryset.filter(**{lookup: parse(value)})
+            except ValueError:
+                raise APIError(f"Некорректное значение {param}: «{value}».")
+    return queryset.order_by(*resource.key), resource.select(_parse_fields(params))
+
+
+def page(resource, params):
+    """Страница по курсору: {'results': [...], 'next_cursor', 'previous_cursor'}."""
+    queryset, names = build_queryset(resource, params)
+    try:
+        limit = int(params.get('limit', DEFAULT_LIMIT))
+    except ValueError:
+        raise APIError("limit должен быть числом.")
+    if not 1 <= limit <= MAX_LIMIT:
+        raise APIError(f"limit должен быть от 1 до {MAX_LIMIT}.")
+    # Ключ курсора читается всегда: без него не построить соседние страницы
+    columns = dict.fromkeys([resource.fields[name] for name in names] + list(resource.key))
+    try:
+        rows = paginate_by_cursor(queryset.values(*columns), params.get('cursor'), limit, resource.key)
+    except InvalidCursor as exc:
+        raise APIError(str(exc))
+    return {
+        'results': [{name: row[resource.fields[name]] for name in names} for row in rows],
+        'next_cursor': rows.next_cursor,
+        'previous_cursor': rows.previous_cursor,
+    }
+
+
+def iter_ndjson(resource, params, chunk_size=NDJSON_CHUNK_SIZE):
+    """
+    Все строки по фильтрам, по JSON-объекту на строку; порядок — ключ ресурса.
+    Параметры проверяются сразу (APIError до начала ответа), строки читаются по мере отдачи.
+    """
+    queryset, names = build_queryset(resource, params)
+    rows = queryset.values_list(*(resource.fields[name] for name in names))
+    encoder = DjangoJSONEncoder(ensure_ascii=False, separators=(',', ':'))
+    return (encoder.encode(dict(zip(names, row))) + '\n' for row in rows.iterator(chunk_size=chunk_size))
@@ -1,6 +1,16 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_migrate
 
 
 class ContractsAppConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'contracts_app'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+        from .search import create_search_index, register_functions
+        post_migrate.connect(create_search_index, sender=self)
+        connection_created.connect(register_functions)
+        from .metrics import install_execute_wrapper
+        connection_created.connect(install_execute_wrapper)
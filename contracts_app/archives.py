@@ -0,0 +1,85 @@
+# contracts_app/archives.py
+"""
+Потоковая ZIP-выгрузка прикреплённых файлов договоров.
+
+Архив собирается на лету: zipfile пишет в буфер без seek (с дескрипторами
+данных), а генератор после каждого куска файла отдаёт накопленные байты в
+ответ. В памяти — только текущий кусок, ни файл, ни архив целиком.
+"""
+import os
+import re
+import zipfile
+
+from django.db.models import Q
+
+FILE_FIELDS = ('file1', 'file2', 'file3')
+CHUNK_SIZE = 64 * 1024
+
+
+class ZipPipe:
+    """Несмещаемый поток для ZipFile: копит записанное до следующего drain()."""
+
+    def __init__(self):
+        self._chunks = []
+        self._offset = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._offset += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._offset
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _safe_name(value):
+    return re.sub(r'[\\/:*?"<>|\s]+', '_', value).strip('_')[:80] or 'contract'
+
+
+def contract_folder(contract):
+    return f"{contract.pk}_{_safe_name(contract.customer_name)}"
+
+
+def with_files(queryset):
+    has_file = Q()
+    for name in FILE_FIELDS:
+        has_file |= Q(**{f'{name}__gt': ''})
+    return queryset.filter(has_file).only('pk', 'customer_name', *FILE_FIELDS)
+
+
+def stream_zip(queryset, chunk_size=CHUNK_SIZE):
+    """Генератор байтов ZIP-архива: папка на договор, в ней его файлы."""
+    return (data for data in _zip_parts(queryset, chunk_size) if data)
+
+
+def _zip_parts(queryset, chunk_size):
+    pipe = ZipPipe()
+    with zipfile.ZipFile(pipe, mode='w', compression=zipfile.ZIP_STORED, allowZip64=True) as archive:
+        for contract in with_files(queryset).iterator(chunk_size=500):
+            folder = contract_folder(contract)
+            for name in FILE_FIELDS:
+                field_file = getattr(contract, name)
+                if not field_file:
+                    continue
+                try:
+                    field_file.open('rb')
+                except FileNotFoundError:
+                    continue
+                try:
+                    arcname = f"{folder}/{name}_{os.path.basename(field_file.name)}"
+                    with archive.open(arcname, mode='w', force_zip64=True) as entry:
+                        for chunk in field_file.chunks(chunk_size):
+                            entry.write(chunk)
+                            yield pipe.drain()
+                finally:
+                    field_file.close()
+                yield pipe.drain()
+    yield pipe.drain()
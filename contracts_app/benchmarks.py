@@ -0,0 +1,167 @@
+# contracts_app/benchmarks.py
+"""
+Повторяемые замеры основных страниц на текущей базе (см. seed_data).
+
+Каждый сценарий выполняется тестовым клиентом несколько раз; фиксируются
+медиана и p95 времени ответа, число SQL-запросов (по всем алиасам, включая
+реплику для чтения) и пиковая память (tracemalloc). Перед каждым прогоном
+кэш очищается: замеряется путь через ORM, а не попадание в кэш страниц.
+Все изменения в базе откатываются. Результат сравнивается с сохранённым
+базовым замером (JSON).
+"""
+import json
+import shutil
+import statistics
+import tempfile
+import time
+import tracemalloc
+from contextlib import ExitStack, contextmanager
+from datetime import date, timedelta
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connections, transaction
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from .models import Contract, District, Implementator
+
+FORMSET_ROWS = 500
+
+
+class _Rollback(Exception):
+    pass
+
+
+def _contract_form_data(district_id, implementator_id, rows=FORMSET_ROWS):
+    today = date.today()
+    data = {
+        'customer_name': "ООО «Бенчмарк»",
+        'customer_inn': '7700000000',
+        'start_date': today.isoformat(),
+        'end_date': (today + timedelta(days=365)).isoformat(),
+        'implementator': implementator_id,
+        'file1': SimpleUploadedFile('bench.pdf', b'%PDF-1.4 benchmark'),
+        'aks-TOTAL_FORMS': rows,
+        'aks-INITIAL_FORMS': 0,
+        'aks-MIN_NUM_FORMS': 0,
+        'aks-MAX_NUM_FORMS': FORMSET_ROWS,
+    }
+    for i in range(rows):
+        data[f'aks-{i}-number'] = i + 1
+        data[f'aks-{i}-district'] = district_id
+        data[f'aks-{i}-address'] = f"ул. Тестовая, {i + 1}"
+    return data
+
+
+def scenarios(client, formset_rows=FORMSET_ROWS):
+    """{имя: функция без аргументов, выполняющая запрос}."""
+    contract = Contract.objects.order_by('-start_date', 'id').first()
+    district = District.objects.first()
+    implementator = Implementator.objects.first()
+    if not (contract and district and implementator):
+        raise ValueError("База пуста — сначала выполните seed_data.")
+    sample = contract.customer_name.split()[-1].strip('«»')
+    list_url = reverse('contracts:contract_list')
+
+    def contract_form_save():
+        response = client.post(reverse('contracts:contract_add'),
+                               _contract_form_data(district.pk, implementator.pk, formset_rows))
+        assert response.status_code == 302, response.status_code
+
+    return {
+        'list': lambda: client.get(list_url),
+        'search': lambda: client.get(list_url, {'q': sample}),
+        'status_filter': lambda: client.get(list_url, {'status': 'completed'}),
+        'detail': lambda: client.get(reverse('contracts:contract_detail', args=[contract.pk])),
+        'contract_form_save': contract_form_save,
+        'admin_changelist': lambda: client.get(reverse('admin:contracts_app_contract_changelist')),
+    }
+
+
+@contextmanager
+def capture_queries():
+    """Запросы ко всем соединениям: чтения @read_only-страниц идут в реплику, а не в default."""
+    with ExitStack() as stack:
+        contexts, seen = [], set()
+        for alias in connections:
+            connection = connections[alias]
+            if id(connection) not in seen:  # алиас может быть тем же соединением (тесты)
+                seen.add(id(connection))
+                contexts.append(stack.enter_context(CaptureQueriesContext(connection)))
+        yield contexts
+
+
+def measure(func, repeat):
+    timings, queries = [], 0
+    for _ in range(repeat):
+        cache.clear()  # иначе со второго прогона меряется кэш страниц, а не запросы
+        with capture_queries() as contexts:
+            started = time.perf_counter()
+            func()
+            timings.append((time.perf_counter() - started) * 1000)
+        queries = sum(len(ctx) for ctx in contexts)
+    # Память — отдельным прогоном: tracemalloc заметно замедляет выполнение
+    cache.clear()
+    tracemalloc.start()
+    try:
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    timings.sort()
+    return {
+        'median_ms': round(statistics.median(timings), 2),
+        'p95_ms': round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 2),
+        'queries': queries,
+        'peak_kb': round(peak / 1024, 1),
+    }
+
+
+def run(repeat=5, only=None, formset_rows=FORMSET_ROWS):
+    """Выполняет сценарии и возвращает {сценарий: метрики}. База не меняется."""
+    media = tempfile.mkdtemp()
+    results = {}
+    try:
+        with override_settings(ALLOWED_HOSTS=['testserver'], MEDIA_ROOT=media), transaction.atomic():
+            client = Client()
+            admin = get_user_model().objects.create_superuser('benchmark', 'benchmark@localhost', None)
+            client.force_login(admin)
+            for name, func in scenarios(client, formset_rows).items():
+                if only and name not in only:
+                    continue
+                func()  # прогрев
+                results[name] = measure(func, repeat)
+            raise _Rollback
+    except _Rollback:
+        pass
+    finally:
+        shutil.rmtree(media, ignore_errors=True)
+    return results
+
+
+def compare(results, baseline, tolerance=0.2):
+    """Список регрессий: время или память выросли больше чем на tolerance, запросов стало больше."""
+    regressions = []
+    for name, current in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        for metric in ('median_ms', 'p95_ms', 'peak_kb'):
+            if base[metric] and current[metric] > base[metric] * (1 + tolerance):
+                regressions.append(f"{name}.{metric}: {base[metric]} -> {current[metric]}")
+        if current['queries'] > base['queries']:
+            regressions.append(f"{name}.queries: {base['queries']} -> {current['queries']}")
+    return regressions
+
+
+def load_baseline(path):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_baseline(path, results):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2, sort_keys=True)
@@ -0,0 +1,222 @@
+# contracts_app/caching.py
+"""
+Кэш страниц договоров.
+
+- Карточка договора в списке и таблица АК в карточке договора кэшируются
+  фрагментами с ключом по Contract.updated_at; изменение АК обновляет
+  updated_at своего договора (см. signals.py), так что ключ меняется сам.
+- Отрендеренный список кэшируется ненадолго по параметрам фильтра и «версии
+  списка» — метке времени последнего изменения договоров или АК.
+- Изменение справочников (исполнитель, район, регион) меняет «версию
+  справочников», входящую в ключ фрагментов.
+Те же метки дают ETag/Last-Modified для условных GET-запросов.
+
+Версии хранятся в базе (CacheVersion), а не в кэше: с locmem у каждого
+воркера свой кэш, и изменение, сделанное другим воркером или management-
+командой, иначе осталось бы невидимым. Версии читаются один раз на запрос
+(для карточки — тем же запросом, что и updated_at договора) и меняются
+одним UPSERT после коммита, чтобы не держать блокировку строки версии до
+конца транзакции и не отдать под новой версией незакоммиченные данные.
+
+Массовые сохранения (формсет АК, админка) оборачиваются в deferred(): сброс
+копится, и при выходе — один UPDATE updated_at по всем затронутым договорам
+и одна смена версии списка вместо пары запросов на каждый АК.
+"""
+import hashlib
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from datetime import datetime, timezone as dt_timezone
+
+from django.db import transaction
+from django.db.models import Subquery
+from django.utils import timezone
+from django.views.decorators.http import condition
+
+from .models import CacheVersion, Contract
+
+LIST_CACHE_TIMEOUT = 30
+FRAGMENT_CACHE_TIMEOUT = 60 * 60
+
+LIST_VERSION = 'list'
+REFERENCE_VERSION = 'reference'
+LIST_PARAMS = ('q', 'status', 'cursor', 'page')
+
+# Отложенный сброс внутри deferred(), иначе None
+_pending = ContextVar('contracts_cache_pending', default=None)
+
+
+class _Pending:
+    __slots__ = ('pks', 'list_changed')
+
+    def __init__(self):
+        self.pks = set()
+        self.list_changed = False
+
+    def flush(self):
+        if self.pks:
+            Contract.objects.filter(pk__in=self.pks).update(updated_at=timezone.now())
+        if self.list_changed:
+            bump_list_version()
+
+
+def _versions_queryset():
+    return CacheVersion.objects.filter(name__in=(LIST_VERSION, REFERENCE_VERSION)).values_list('name', 'stamp')
+
+
+def _remember(request, versions, names=(LIST_VERSION, REFERENCE_VERSION)):
+    # Строки версии ещё нет — данные не менялись с установки
+    memo = {name: versions.get(name, 0.0) for name in names}
+    if request is not None:
+        request._cache_versions = memo
+    return memo
+
+
+def _version(request, name):
+    memo = getattr(request, '_cache_versions', None)
+    if memo is None or name not in memo:
+        memo = _remember(request, dict(_versions_queryset()))
+    return memo[name]
+
+
+async def aload_versions(request):
+    """Асинхронно прочитать версии заранее: ETag-функции condition() синхронные."""
+    _remember(request, {name: stamp async for name, stamp in _versions_queryset()})
+
+
+def list_version(request=None):
+    return _version(request, LIST_VERSION)
+
+
+def reference_version(request=None):
+    return _version(request, REFERENCE_VERSION)
+
+
+def _bump(*names):
+    stamp = time.time()
+    CacheVersion.objects.bulk_create(
+        [CacheVersion(name=name, stamp=stamp) for name in names],
+        update_conflicts=True, unique_fields=['name'], update_fields=['stamp'],
+    )
+
+
+def bump_list_version():
+    pending = _pending.get()
+    if pending is not None:
+        pending.list_changed = True
+        return
+    transaction.on_commit(lambda: _bump(LIST_VERSION))
+
+
+def bump_reference_version():
+    transaction.on_commit(lambda: _bump(LIST_VERSION, REFERENCE_VERSION))
+
+
+def invalidate_contracts(pks=()):
+    """После массовых операций в обход save(): обновить updated_at и сбросить список."""
+    pending = _pending.get()
+    if pending is not None:
+        pending.pks.update(pks)
+        pending.list_changed = True
+        return
+    if pks:
+        Contract.objects.filter(pk__in=pks).update(updated_at=timezone.now())
+    bump_list_version()
+
+
+@contextmanager
+def deferred():
+    """Копит сброс кэша договоров и выполняет его один раз при выходе."""
+    if _pending.get() is not None:
+        yield  # вложенный вызов — сбросит внешний
+        return
+    pending = _Pending()
+    token = _pending.set(pending)
+    try:
+        yield
+    finally:
+        # И при ошибке: без транзакции часть изменений уже записана
+        _pending.reset(token)
+        pending.flush()
+
+
+def _params_digest(params):
+    raw = '&'.join(f"{name}={params.get(name, '')}" for name in LIST_PARAMS)
+    return hashlib.md5(raw.encode(), usedforsecurity=False).hexdigest()
+
+
+def list_cache_key(request):
+    params = request.GET
+    return f"contracts:list:{list_version(request)}:{reference_version(request)}:{_params_digest(params)}"
+
+
+# === Условные GET ===
+def _today():
+    # Статус договора зависит от даты — смена дня тоже меняет страницу
+    return timezone.now().date().isoformat()
+
+
+def list_etag(request, *args, **kwargs):
+    return f'"{_params_digest(request.GET)}-{list_version(request)}-{reference_version(request)}-{_today()}"'
+
+
+def list_last_modified(request, *args, **kwargs):
+    return datetime.fromtimestamp(max(list_version(request), reference_version(request)), tz=dt_timezone.utc)
+
+
+def list_condition(view):
+    """condition() для асинхронного списка: версии читаются заранее асинхронно."""
+    conditional = condition(etag_func=list_etag, last_modified_func=list_last_modified)(view)
+
+    @wraps(view)
+    async def inner(request, *args, **kwargs):
+        await aload_versions(request)
+        return await conditional(request, *args, **kwargs)
+    return inner
+
+
+def _contract_updated_at(request, pk):
+    # ETag и Last-Modified спрашивают одно и то же — один запрос на оба
+    if not hasattr(request, '_contract_updated_at'):
+        request._contract_updated_at = Contract.objects.filter(pk=pk).values_list('updated_at', flat=True).first()
+    return request._contract_updated_at
+
+
+def detail_etag(request, pk, *args, **kwargs):
+    updated_at = _contract_updated_at(request, pk)
+    if updated_at is None:
+        return None
+    return f'"{pk}-{updated_at.timestamp()}-{reference_version(request)}-{_today()}"'
+
+
+def detail_last_modified(request, pk, *args, **kwargs):
+    updated_at = _contract_updated_at(request, pk)
+    if updated_at is None:
+        return None
+    return max(updated_at, datetime.fromtimestamp(reference_version(request), tz=dt_timezone.utc))
+
+
+async def aload_contract_updated_at(request, pk):
+    """updated_at договора и версия справочников — одним запросом."""
+    reference = CacheVersion.objects.filter(name=REFERENCE_VERSION).values('stamp')
+    row = await (
+        Contract.objects.filter(pk=pk).values_list('updated_at', Subquery(reference)).afirst()
+    )
+    request._contract_updated_at = row[0] if row else None
+    if row:
+        _remember(request, {} if row[1] is None else {REFERENCE_VERSION: row[1]}, names=(REFERENCE_VERSION,))
+
+
+def detail_condition(view):
+    """
+    condition() для асинхронной карточки договора: ETag и Last-Modified
+    вычисляются синхронно, поэтому updated_at читается заранее асинхронно.
+    """
+    conditional = condition(etag_func=detail_etag, last_modified_func=detail_last_modified)(view)
+
+    @wraps(view)
+    async def inner(request, pk, *args, **kwargs):
+        await aload_contract_updated_at(request, pk)
+        return await conditional(request, *args, pk=pk, **kwargs)
+    return inner
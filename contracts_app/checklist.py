@@ -0,0 +1,81 @@
+# contracts_app/checklist.py
+"""
+Массовое изменение чек-листа договоров (Госуслуги / ОКО / Сполох).
+
+Изменения приходят словарём {pk: {поле: bool}}. Текущие значения читаются
+одним SELECT, изменившиеся договоры группируются по (поле, значение), и
+каждая группа записывается одним UPDATE ... WHERE id IN (...) — не больше
+шести запросов на любой объём. Пишутся только поля чек-листа и updated_at
+(по нему сбрасываются кэшированные карточки), status не пересчитывается.
+UPDATE идёт мимо сигналов, поэтому историю изменений пишем сами.
+"""
+from collections import defaultdict
+
+from asgiref.sync import sync_to_async
+from django.db import transaction
+from django.utils import timezone
+
+from . import history
+from .caching import bump_list_version
+from .models import Contract
+
+CHECKLIST_FIELDS = ('gos_services', 'oko', 'spolokh')
+MAX_BATCH_SIZE = 1000
+
+UPDATED = 'updated'
+UNCHANGED = 'unchanged'
+NOT_FOUND = 'not_found'
+INVALID = 'invalid'
+
+
+class ChecklistError(ValueError):
+    """Запрос целиком непригоден (не словарь, слишком много договоров)."""
+
+
+def parse_changes(data):
+    """
+    Проверяет {pk: {поле: bool}} из JSON. Возвращает (изменения, ошибки):
+    изменения — {int pk: {поле: bool}}, ошибки — {исходный ключ: INVALID}.
+    """
+    if not isinstance(data, dict):
+        raise ChecklistError("Ожидается объект {id договора: {поле: true/false}}.")
+    if len(data) > MAX_BATCH_SIZE:
+        raise ChecklistError(f"Не больше {MAX_BATCH_SIZE} договоров за запрос.")
+    changes, errors = {}, {}
+    for key, values in data.items():
+        pk = str(key)
+        if not pk.isdigit() or not isinstance(values, dict) or not values or any(
+            name not in CHECKLIST_FIELDS or not isinstance(value, bool) for name, value in values.items()
+        ):
+            errors[pk] = INVALID
+            continue
+        changes[int(pk)] = values
+    return changes, errors
+
+
+def apply_changes(changes):
+    """Применяет {pk: {поле: bool}}. Возвращает {pk: UPDATED | UNCHANGED | NOT_FOUND}."""
+    results = dict.fromkeys(changes, NOT_FOUND)
+    groups = defaultdict(list)  # (поле, значение) -> [pk]
+    changed = {}  # pk -> {поле: [было, стало]} для истории
+    with transaction.atomic():
+        current = Contract.objects.filter(pk__in=changes).values_list('pk', *CHECKLIST_FIELDS)
+        for pk, *values in current:
+            row = dict(zip(CHECKLIST_FIELDS, values))
+            diff = [(name, value) for name, value in changes[pk].items() if row[name] != value]
+            results[pk] = UPDATED if diff else UNCHANGED
+            for change in diff:
+                groups[change].append(pk)
+            changed[pk] = {name: [row[name], value] for name, value in diff}
+
+        now = timezone.now()
+        for (name, value), pks in groups.items():
+            Contract.objects.filter(pk__in=pks).update(**{name: value, 'updated_at': now})
+        history.changes_of(Contract, changed)
+    if groups:
+        bump_list_version()
+    return results
+
+
+# Асинхронный ORM не умеет транзакции — чтение и запись выполняются одним блоком в потоке
+aapply_changes = sync_to_async(apply_changes)
@@ -0,0 +1,124 @@
+# contracts_app/downloads.py
+"""
+Отдача вложений договоров (file1–file3) после проверки прав.
+
+Сами байты Django по возможности не читает: при PROTECTED_MEDIA_SERVER =
+'nginx' ответ содержит только заголовок X-Accel-Redirect, и файл отдаёт
+nginx из internal-location, при 'sendfile' — X-Sendfile для Apache
+(mod_xsendfile) или lighttpd. Воркер освобождается сразу, даже если
+клиент качает 20 МБ часами. Пример для nginx:
+
+    location /protected-media/ {
+        internal;
+        alias /srv/contracts/media/;
+    }
+
+Без фронт-сервера файл отдаёт FileResponse: поддерживаются Range (одна часть,
+докачка и перемотка PDF) и If-Modified-Since. Файл до конца передаётся как
+есть — WSGI-сервер с wsgi.file_wrapper (gunicorn) шлёт его sendfile без
+копирования через Python; ограниченный диапазон читается кусками.
+"""
+import os
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, HttpResponseNotModified
+from django.utils.http import content_disposition_header, http_date
+from django.views.static import was_modified_since
+
+_RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class _FileRange:
+    """Файл, читаемый от текущей позиции не дальше length байт."""
+
+    def __init__(self, file, length):
+        self._file = file
+        self._left = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self._left:
+            size = self._left
+        data = self._file.read(size)
+        self._left -= len(data)
+        return data
+
+    def close(self):
+        self._file.close()
+
+
+def parse_range(header, size):
+    """
+    (start, end) включительно для заголовка Range или None — отдать файл целиком.
+    Несколько диапазонов не поддерживаются (ответ целиком допустим по RFC 9110).
+    Недостижимый диапазон — ValueError (ответ 416).
+    """
+    match = _RANGE_RE.match(header.strip()) if header else None
+    if not match or match.groups() == ('', ''):
+        return None
+    first, last = match.groups()
+    if first:
+        start, end = int(first), min(int(last), size - 1) if last else size - 1
+        if last and int(last) < start:
+            return None  # синтаксически неверный диапазон игнорируется
+    else:
+        start, end = max(size - int(last), 0), size - 1  # последние N байт
+    if start >= size or end < start:
+        raise ValueError(f"Диапазон вне файла размером {size}")
+    return start, end
+
+
+def _offloaded(storage, name, filename):
+    response = HttpResponse()
+    if settings.PROTECTED_MEDIA_SERVER == 'nginx':
+        response['X-Accel-Redirect'] = quote(settings.PROTECTED_MEDIA_URL.rstrip('/') + '/' + name)
+    else:
+        response['X-Sendfile'] = storage.path(name)
+    # Тип по расширению определит фронт-сервер; Django не должен подставлять свой text/html
+    del response['Content-Type']
+    response['Content-Disposition'] = content_disposition_header(False, filename)
+    return response
+
+
+def serve(request, storage, name, filename):
+    """Ответ с файлом name из storage; FileNotFoundError, если файла нет."""
+    if settings.PROTECTED_MEDIA_SERVER:
+        if not storage.exists(name):
+            raise FileNotFoundError(name)
+        return _offloaded(storage, name, filename)
+
+    file = storage.open(name, 'rb')
+    stat = os.fstat(file.fileno())
+    if not was_modified_since(request.headers.get('If-Modified-Since'), stat.st_mtime):
+        file.close()
+        return HttpResponseNotModified()
+
+    # If-Range: диапазон действителен, только если файл не менялся с указанной даты
+    if_range = request.headers.get('If-Range')
+    byte_range = None
+    if not if_range or if_range == http_date(stat.st_mtime):
+        try:
+            byte_range = parse_range(request.headers.get('Range'), stat.st_size)
+        except ValueError:
+            file.close()
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{stat.st_size}'
+            return response
+
+    if byte_range is None:
+        response = FileResponse(file, filename=filename)
+    else:
+        start, end = byte_range
+        file.seek(start)
+        length = end - start + 1
+        if end == stat.st_size - 1:
+            response = FileResponse(file, status=206, filename=filename)  # до конца — без обёртки, sendfile
+        else:
+            response = FileResponse(_FileRange(file, length), status=206, filename=filename)
+            response['Content-Length'] = length
+        response['Content-Range'] = f'bytes {start}-{end}/{stat.st_size}'
+    response['Accept-Ranges'] = 'bytes'
+    response['Last-Modified'] = http_date(stat.st_mtime)
+    response['Content-Disposition'] = content_disposition_header(False, filename)
+    return response
@@ -0,0 +1,156 @@
+# contracts_app/exports.py
+"""
+Потоковый экспорт реестра договоров с АК в CSV и XLSX.
+
+Договоры читаются QuerySet.iterator(chunk_size=...) с подгрузкой АК
+пачками, строки отдаются по мере чтения — память воркера не зависит
+от размера выгрузки.
+
+XLSX — тот же ZIP, что и архив вложений (archives.ZipPipe): служебные части
+книги постоянные, а лист пишется строками с встроенными строками
+(inlineStr, без общей таблицы строк) прямо в сжатый поток ответа.
+openpyxl так не умеет: даже write_only-книга собирается целиком перед save().
+"""
+import csv
+import re
+import zipfile
+from xml.sax.saxutils import escape
+
+from django.db.models import Prefetch
+
+from .archives import ZipPipe
+from .models import AK
+
+CHUNK_SIZE = 2000
+
+HEADER = [
+    "ID договора", "Заказчик", "ИНН заказчика", "Исполнитель", "ИНН исполнителя",
+    "Дата начала", "Дата окончания", "Статус", "Госуслуги", "ОКО", "Сполох",
+    "Номер АК", "Район", "Регион", "Адрес АК",
+]
+
+_STATUS = {'active': "Действует", 'completed': "Завершён"}
+
+
+def _yes_no(value):
+    return "Да" if value else "Нет"
+
+
+def export_queryset(queryset):
+    return queryset.select_related('implementator').with_live_status().prefetch_related(
+        Prefetch('aks', queryset=AK.objects.select_related('district__region').order_by('number'))
+    )
+
+
+def iter_rows(queryset, chunk_size=CHUNK_SIZE):
+    """Строка на каждый АК; договор без АК — одна строка с пустыми колонками АК."""
+    for contract in export_queryset(queryset).iterator(chunk_size=chunk_size):
+        base = [
+            contract.pk, contract.customer_name, contract.customer_inn,
+            contract.implementator.name, contract.implementator.inn,
+            contract.start_date.isoformat(), contract.end_date.isoformat(),
+            _STATUS.get(contract.live_status, contract.live_status),
+            _yes_no(contract.gos_services), _yes_no(contract.oko), _yes_no(contract.spolokh),
+        ]
+        aks = contract.aks.all()
+        if not aks:
+            yield base + ['', '', '', '']
+        for ak in aks:
+            yield base + [ak.number, ak.district.name, ak.district.region.name, ak.address]
+
+
+class _Echo:
+    """Псевдофайл для csv.writer: write() возвращает строку, а не пишет её."""
+
+    def write(self, value):
+        return value
+
+
+def stream_csv(queryset):
+    writer = csv.writer(_Echo(), delimiter=';')
+    yield '\ufeff'  # BOM — чтобы Excel открыл UTF-8 с кириллицей
+    yield writer.writerow(HEADER)
+    for row in iter_rows(queryset):
+        yield writer.writerow(row)
+
+
+XLSX_ROWS_PER_CHUNK = 500
+
+_XLSX_PARTS = {
+    '[Content_Types].xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>'
+    ),
+    '_rels/.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Target="xl/workbook.xml" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument"/>'
+        '</Relationships>'
+    ),
+    'xl/workbook.xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="Договоры" sheetId="1" r:id="rId1"/></sheets>'
+        '</workbook>'
+    ),
+    'xl/_rels/workbook.xml.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Target="worksheets/sheet1.xml" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet"/>'
+        '</Relationships>'
+    ),
+}
+
+_SHEET_HEAD = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+)
+_SHEET_TAIL = '</sheetData></worksheet>'
+
+# Управляющие символы недопустимы в XML — Excel не откроет такой файл
+_ILLEGAL_XML = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+
+def _xlsx_cell(value):
+    if isinstance(value, int) and not isinstance(value, bool):
+        return f'<c><v>{value}</v></c>'
+    text = escape(_ILLEGAL_XML.sub('', str(value)))
+    return f'<c t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>'
+
+
+def _xlsx_row(row):
+    return '<row>' + ''.join(_xlsx_cell(value) for value in row) + '</row>'
+
+
+def stream_xlsx(queryset, rows_per_chunk=XLSX_ROWS_PER_CHUNK):
+    """Генератор байтов XLSX: лист уходит в ответ пачками строк по мере чтения."""
+    return (data for data in _xlsx_parts(queryset, rows_per_chunk) if data)
+
+
+def _xlsx_parts(queryset, rows_per_chunk):
+    pipe = ZipPipe()
+    with zipfile.ZipFile(pipe, mode='w', compression=zipfile.ZIP_DEFLATED) as book:
+        for name, content in _XLSX_PARTS.items():
+            book.writestr(name, content)
+        with book.open('xl/worksheets/sheet1.xml', mode='w', force_zip64=True) as sheet:
+            rows = [_SHEET_HEAD, _xlsx_row(HEADER)]
+            for row in iter_rows(queryset):
+                rows.append(_xlsx_row(row))
+                if len(rows) >= rows_per_chunk:
+                    sheet.write(''.join(rows).encode())
+                    rows = []
+                    yield pipe.drain()
+            rows.append(_SHEET_TAIL)
+            sheet.write(''.join(rows).encode())
+        yield pipe.drain()
+    yield pipe.drain()
@@ -1,8 +1,10 @@
 # contracts_app/forms.py
 from django import forms
 from django.core.exceptions import ValidationError
-from .models import Contract, AK
-from django.forms import inlineformset_factory
+from django.core.validators import FileExtensionValidator
+from django.utils.functional import cached_property
+from .models import Contract, AK, District
+from django.forms import BaseInlineFormSet, inlineformset_factory
 
 
 class ContractForm(forms.ModelForm):
@@ -33,15 +35,83 @@ class ContractForm(forms.ModelForm):
         return cleaned_data
 
 
+class DistrictChoiceField(forms.ModelChoiceField):
+    """Район берётся из заранее прочитанных (known), без запроса на каждую строку."""
+    known = None
+
+    def to_python(self, value):
+        if self.known is not None and str(value).isdigit() and int(value) in self.known:
+            return self.known[int(value)]
+        return super().to_python(value)
+
+
 class AKForm(forms.ModelForm):
     class Meta:
         model = AK
         fields = ['number', 'district', 'address']
+        field_classes = {'district': DistrictChoiceField}
+
+    def __init__(self, *args, districts=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        # {pk: District} выбранных районов всего формсета (BaseAKFormSet), иначе None
+        self.districts = districts
+        self.fields['district'].known = districts
+        # В <select> попадает только выбранный район, остальные подгружает
+        # автодополнение — иначе каждая строка формсета выводит весь справочник.
+        widget = self.fields['district'].widget
+        widget.attrs['data-autocomplete'] = 'district'
+        widget.choices = [('', '---------')]
+        district = self._selected_district()
+        if district:
+            widget.choices.append((district.pk, str(district)))
+
+    def _selected_district(self):
+        value = self['district'].value()
+        if not value:
+            return None
+        if self.instance.district_id and str(value) == str(self.instance.district_id):
+            return self.instance.district
+        if not str(value).isdigit():
+            return None
+        if self.districts is not None:
+            return self.districts.get(int(value))
+        return District.objects.select_related('region').filter(pk=value).first()
+
+    def validate_contract_unique(self, contract):
+        """Проверка unique_together ('contract', 'number') для формы вне формсета."""
+        number = self.cleaned_data.get('number')
+        if number and AK.objects.filter(contract=contract, number=number).exclude(pk=self.instance.pk).exists():
+            self.add_error('number', "АК с таким номером уже есть в договоре.")
+
+
+class AKImportForm(forms.Form):
+    file = forms.FileField(
+        label="Файл CSV или XLSX",
+        validators=[FileExtensionValidator(allowed_extensions=['csv', 'xlsx'])],
+        help_text="Колонки: номер, район, регион, адрес",
+    )
+    strict = forms.BooleanField(required=False, label="Отменить импорт при любой ошибке")
+
+
+class BaseAKFormSet(BaseInlineFormSet):
+    def get_form_kwargs(self, index):
+        kwargs = super().get_form_kwargs(index)
+        kwargs['districts'] = self.posted_districts
+        return kwargs
+
+    @cached_property
+    def posted_districts(self):
+        """Районы всех присланных строк одним запросом, а не по запросу на строку."""
+        if not self.is_bound:
+            return None  # несвязанные формы берут район из своего АК
+        ids = {str(self.data.get(f'{self.add_prefix(i)}-district', '')) for i in range(self.total_form_count())}
+        return District.objects.select_related('region').in_bulk([pk for pk in ids if pk.isdigit()])
 
 
 AKFormSet = inlineformset_factory(
     Contract, AK,
     form=AKForm,
+    formset=BaseAKFormSet,
     extra=1,
     can_delete=True,
     min_num=0,
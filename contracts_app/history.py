@@ -0,0 +1,237 @@
+# contracts_app/history.py
+"""
+История изменений договоров и АК: кто, когда и какие поля поменял.
+
+Запись компактная — только изменившиеся поля {поле: [было, стало]}; при
+создании и удалении — все непустые отслеживаемые поля. Значения «до»
+(только отслеживаемые поля) запоминаются при загрузке объекта в пишущем
+запросе (не GET) и в batch(), так что сохранение не делает лишнего SELECT;
+выгрузки, API и прочие читающие пути объекты не копируют. Объект,
+загруженный вне этих путей, перед сохранением читает свои «до» одним
+SELECT отслеживаемых полей (load_before). Массовые пути, идущие мимо
+save(), пишут историю сами: чек-листы (checklist.apply_changes) и импорт
+АК. Статус и updated_at не отслеживаются — их меняет система, а не
+пользователь.
+
+Записи не вставляются по одной: record() откладывает их до коммита
+транзакции (откаченные изменения в историю не попадают), после коммита они
+копятся в буфере запроса (HistoryMiddleware) или batch() и уходят в базу
+одним bulk_create в конце. Вне буфера — одной вставкой на транзакцию.
+
+Таблица только пополняется, внешних ключей в базе у неё нет. На PostgreSQL
+её можно секционировать по времени и отсоединять старые секции целиком:
+
+    CREATE TABLE contracts_app_changerecord (...) PARTITION BY RANGE (changed_at);
+    -- первичный ключ секционированной таблицы — (id, changed_at)
+
+Оба индекса ведут по времени: история объекта — (object_type, object_id,
+changed_at), изменения после T — (changed_at, id), он же ключ курсора API.
+"""
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import partial
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.db import transaction
+from django.db.models.fields.files import FieldFile
+from django.utils import timezone
+
+from .models import AK, ChangeRecord, Contract
+
+logger = logging.getLogger(__name__)
+
+FLUSH_BATCH_SIZE = 1000
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS', 'TRACE')
+
+# Модель -> (тип объекта, отслеживаемые поля по attname)
+TRACKED = {
+    Contract: (ChangeRecord.CONTRACT, (
+        'customer_name', 'customer_inn', 'start_date', 'end_date', 'implementator_id',
+        'gos_services', 'oko', 'spolokh', 'file1', 'file2', 'file3',
+    )),
+    AK: (ChangeRecord.AK, ('contract_id', 'number', 'district_id', 'address')),
+}
+
+# Буфер текущего запроса или batch(), иначе None
+_pending = ContextVar('contracts_history_pending', default=None)
+
+
+class _Pending:
+    __slots__ = ('records', 'request', 'track')
+
+    def __init__(self, request=None):
+        self.records = []
+        self.request = request
+        # Снимки при загрузке — только там, где объекты сохраняют
+        self.track = request is None or request.method not in SAFE_METHODS
+
+    def flush(self):
+        if not self.records:
+            return
+        user = getattr(self.request, 'user', None)
+        user_id = user.pk if user is not None and user.is_authenticated else None
+        for change in self.records:
+            if change.user_id is None:
+                change.user_id = user_id
+        _insert(self.records)
+        self.records = []
+
+
+def _insert(records):
+    ChangeRecord.objects.bulk_create(records, batch_size=FLUSH_BATCH_SIZE)
+
+
+# === Снимки и разница ===
+def _plain(value):
+    if isinstance(value, FieldFile):
+        value = value.name
+    return None if value == '' else value  # пустой файл хранится как '' или NULL
+
+
+def snapshot(instance, values=None):
+    """{поле: значение} загруженных отслеживаемых полей (отложенные поля пропускаются)."""
+    values = instance.__dict__ if values is None else values
+    return {name: _plain(values[name]) for name in TRACKED[type(instance)][1] if name in values}
+
+
+def remember(instance):
+    """post_init: в пишущем запросе или batch() загруженные значения станут «до» при сохранении."""
+    pending = _pending.get()
+    if pending is not None and pending.track:
+        instance._history_before = snapshot(instance)
+
+
+def load_before(instance, using=None):
+    """pre_save: «до» объекта, загруженного без снимка, — SELECT только отслеживаемых полей."""
+    if instance.pk is None or hasattr(instance, '_history_before'):
+        return
+    model = type(instance)
+    row = model._base_manager.using(using).filter(pk=instance.pk).values(*TRACKED[model][1]).first()
+    instance._history_before = snapshot(instance, row) if row else {}
+
+
+def _saved(instance):
+    instance._history_before = snapshot(instance)
+
+
+def _non_empty(values):
+    return {name: value for name, value in values.items() if value is not None}
+
+
+def _change(model, object_id, action, changes):
+    return ChangeRecord(object_type=TRACKED[model][0], object_id=object_id, action=action,
+                        changes=changes, changed_at=timezone.now())
+
+
+def created(instance):
+    _saved(instance)
+    record([_change(type(instance), instance.pk, ChangeRecord.CREATED,
+                    {name: [None, value] for name, value in _non_empty(snapshot(instance)).items()})])
+
+
+def updated(instance):
+    before, after = getattr(instance, '_history_before', {}), snapshot(instance)
+    _saved(instance)
+    changes = {name: [before[name], value] for name, value in after.items()
+               if name in before and before[name] != value}
+    if changes:
+        record([_change(type(instance), instance.pk, ChangeRecord.UPDATED, changes)])
+
+
+def deleted(instance):
+    record([_change(type(instance), instance.pk, ChangeRecord.DELETED,
+                    {name: [value, None] for name, value in _non_empty(snapshot(instance)).items()})])
+
+
+def changes_of(model, changes):
+    """Записи об изменениях, сделанных мимо save(): {pk: {поле: [было, стало]}}."""
+    record([_change(model, pk, ChangeRecord.UPDATED, diff) for pk, diff in changes.items() if diff])
+
+
+def created_in_bulk(instances):
+    """Записи о создании объектов после bulk_create (объекты без pk пропускаются)."""
+    record([_change(type(instance), instance.pk, ChangeRecord.CREATED,
+                    {name: [None, value] for name, value in _non_empty(snapshot(instance)).items()})
+            for instance in instances if instance.pk])
+
+
+# === Отложенная запись ===
+def record(records):
+    """Записи попадут в историю, только если текущая транзакция закоммитится."""
+    if records:
+        transaction.on_commit(partial(_committed, records))
+
+
+def _committed(records):
+    pending = _pending.get()
+    if pending is None:
+        _insert(records)
+    else:
+        pending.records.extend(records)
+
+
+@contextmanager
+def batch():
+    """Копит записи закоммиченных изменений и вставляет их разом при выходе (вне транзакции)."""
+    if _pending.get() is not None:
+        yield  # вложенный вызов — запишет внешний
+        return
+    pending = _Pending()
+    token = _pending.set(pending)
+    try:
+        yield
+    finally:
+        _pending.reset(token)
+        pending.flush()
+
+
+class HistoryMiddleware:
+    """После AuthenticationMiddleware: одна вставка истории на запрос, автор — request.user."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        pending = _Pending(request)
+        token = _pending.set(pending)
+        try:
+            return self.get_response(request)
+        finally:
+            _pending.reset(token)
+            self._flush(pending)
+
+    async def __acall__(self, request):
+        pending = _Pending(request)
+        token = _pending.set(pending)
+        try:
+            return await self.get_response(request)
+        finally:
+            _pending.reset(token)
+            if pending.records:
+                await sync_to_async(self._flush)(pending)
+
+    def _flush(self, pending):
+        # Изменения уже закоммичены: сбой записи истории не должен превращать ответ в 500
+        try:
+            pending.flush()
+        except Exception:
+            logger.exception("Не удалось записать историю изменений (%d записей)", len(pending.records))
+
+
+# === Чтение ===
+def for_object(model, pk):
+    """История объекта, новые записи первыми."""
+    return ChangeRecord.objects.filter(object_type=TRACKED[model][0], object_id=pk).order_by('-changed_at', '-id')
+
+
+def since(moment):
+    """Все изменения после moment по порядку записи."""
+    return ChangeRecord.objects.filter(changed_at__gt=moment).order_by('changed_at', 'id')
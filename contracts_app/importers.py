@@ -0,0 +1,192 @@
+# contracts_app/importers.py
+"""
+Потоковый импорт АК из CSV/XLSX.
+
+Строки читаются лениво, районы ищутся по (название, регион) в словаре,
+загруженном одним запросом, уникальность номера в договоре проверяется
+по множеству уже занятых номеров. Запись — bulk_create пачками в одной
+транзакции. В памяти держатся только текущая пачка и ошибки.
+
+CSV принимается в UTF-8 и в Windows-1251 (так сохраняет русский Excel):
+кодировка определяется по началу файла.
+"""
+import codecs
+import csv
+import io
+import zipfile
+from dataclasses import dataclass, field
+
+from django.db import transaction
+
+from . import history, summary
+from .caching import invalidate_contracts
+from .models import AK, District
+
+DEFAULT_BATCH_SIZE = 1000
+MAX_REPORTED_ERRORS = 1000
+ENCODING_SAMPLE_SIZE = 64 * 1024
+
+# Допустимые заголовки колонок -> поле
+COLUMNS = {
+    'number': 'number', 'номер': 'number', 'номер ак': 'number',
+    'district': 'district', 'район': 'district',
+    'region': 'region', 'регион': 'region',
+    'address': 'address', 'адрес': 'address',
+}
+REQUIRED_COLUMNS = ('number', 'district', 'region', 'address')
+
+
+class ImportFormatError(ValueError):
+    """Файл целиком непригоден для импорта (формат, заголовок)."""
+
+
+@dataclass
+class ImportResult:
+    created: int = 0
+    rows: int = 0
+    error_count: int = 0
+    errors: list = field(default_factory=list)  # [(номер строки, сообщение)], не больше MAX_REPORTED_ERRORS
+
+    def add_error(self, line, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((line, message))
+
+
+def _detect_encoding(fileobj):
+    sample = fileobj.read(ENCODING_SAMPLE_SIZE)
+    fileobj.seek(0)
+    try:
+        # Без final: символ, разрезанный границей выборки, ошибкой не считается
+        codecs.getincrementaldecoder('utf-8')().decode(sample)
+    except UnicodeDecodeError:
+        return 'cp1251'
+    return 'utf-8-sig'
+
+
+def _iter_csv(fileobj):
+    text = io.TextIOWrapper(fileobj, encoding=_detect_encoding(fileobj), newline='')
+    try:
+        sample = text.read(4096)
+        text.seek(0)
+        try:
+            dialect = csv.Sniffer().sniff(sample, delimiters=',;\t')
+        except csv.Error:
+            dialect = csv.excel
+        yield from csv.reader(text, dialect)
+    except UnicodeDecodeError:
+        raise ImportFormatError("Не удалось прочитать CSV: неизвестная кодировка. Сохраните файл в UTF-8.")
+    finally:
+        text.detach()
+
+
+def _iter_xlsx(fileobj):
+    try:
+        from openpyxl import load_workbook
+        from openpyxl.utils.exceptions import InvalidFileException
+    except ImportError:
+        raise ImportFormatError("Для импорта XLSX установите пакет openpyxl.")
+    try:
+        workbook = load_workbook(fileobj, read_only=True, data_only=True)
+    except (zipfile.BadZipFile, InvalidFileException, KeyError, OSError) as exc:
+        raise ImportFormatError(f"Файл XLSX повреждён или не является книгой Excel ({exc}).")
+    try:
+        for row in workbook.active.iter_rows(values_only=True):
+            yield ['' if value is None else str(value) for value in row]
+    finally:
+        workbook.close()
+
+
+def iter_rows(fileobj, filename):
+    """Лениво отдаёт строки файла списками строк, включая заголовок."""
+    name = filename.lower()
+    if name.endswith('.csv'):
+        return _iter_csv(fileobj)
+    if name.endswith('.xlsx'):
+        return _iter_xlsx(fileobj)
+    raise ImportFormatError("Поддерживаются только файлы CSV и XLSX.")
+
+
+def _read_header(header):
+    positions = {}
+    for index, title in enumerate(header):
+        column = COLUMNS.get(str(title).strip().lower())
+        if column:
+            positions[column] = index
+    missing = [c for c in REQUIRED_COLUMNS if c not in positions]
+    if missing:
+        raise ImportFormatError(f"В заголовке нет колонок: {', '.join(missing)}.")
+    return positions
+
+
+def _district_cache():
+    return {
+        (name.casefold(), region.casefold()): pk
+        for pk, name, region in District.objects.values_list('pk', 'name', 'region__name').iterator()
+    }
+
+
+def _parse_number(value):
+    value = value.strip()
+    if value.endswith('.0'):  # числа из Excel
+        value = value[:-2]
+    if not value.isdigit() or not 1 <= int(value) <= 99999999:
+        raise ValueError(f"Номер АК должен быть числом от 1 до 99999999: «{value}».")
+    return int(value)
+
+
+def import_aks(contract, rows, batch_size=DEFAULT_BATCH_SIZE, strict=False):
+    """
+    Импортирует АК в договор из итератора строк (первая — заголовок).
+    Ошибочные строки пропускаются и попадают в отчёт; при strict=True
+    любая ошибка откатывает весь импорт.
+    """
+    rows = iter(rows)
+    try:
+        positions = _read_header(next(rows))
+    except StopIteration:
+        raise ImportFormatError("Файл пуст.")
+
+    result = ImportResult()
+    districts = _district_cache()
+    taken = set(contract.aks.values_list('number', flat=True))
+    batch = []
+
+    # Сводки и история — после транзакции: при strict откаченный импорт ничего не запишет
+    with history.batch(), summary.deferred(), transaction.atomic():
+        summary.track([contract.pk])  # bulk_create не шлёт сигналов
+        for line, row in enumerate(rows, start=2):
+            if not any(str(cell).strip() for cell in row):
+                continue
+            result.rows += 1
+            try:
+                values = {c: str(row[i]).strip() if i < len(row) else '' for c, i in positions.items()}
+                number = _parse_number(values['number'])
+                if number in taken:
+                    raise ValueError(f"АК с номером {number} уже есть в договоре.")
+                district_id = districts.get((values['district'].casefold(), values['region'].casefold()))
+                if district_id is None:
+                    raise ValueError(f"Район «{values['district']}» ({values['region']}) не найден.")
+                address = values['address']
+                if not address or len(address) > 500:
+                    raise ValueError("Адрес обязателен, не длиннее 500 символов.")
+            except ValueError as exc:
+                result.add_error(line, str(exc))
+                continue
+
+            taken.add(number)
+            batch.append(AK(contract=contract, number=number, district_id=district_id, address=address))
+            if len(batch) >= batch_size:
+                history.created_in_bulk(AK.objects.bulk_create(batch))
+                result.created += len(batch)
+                batch = []
+
+        if batch:
+            history.created_in_bulk(AK.objects.bulk_create(batch))
+            result.created += len(batch)
+        if strict and result.error_count:
+            transaction.set_rollback(True)
+            result.created = 0
+    if result.created:
+        invalidate_contracts([contract.pk])
+    return result
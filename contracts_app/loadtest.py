@@ -0,0 +1,129 @@
+# contracts_app/loadtest.py
+"""
+Нагрузочное сравнение точек входа WSGI и ASGI в одном процессе.
+
+Запросы подаются прямо в application, без сети: WSGI — пулом из `threads`
+потоков, как у многопоточного сервера (gunicorn gthread, mod_wsgi); ASGI —
+корутинами одного цикла событий, до `clients` одновременно. Медленный клиент
+моделируется задержкой при получении ответа: в WSGI она держит поток
+сервера, в ASGI — только корутину. Результат — пропускная способность и
+задержки для каждой точки входа на текущей базе (см. seed_data).
+"""
+import asyncio
+import io
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from django.core.asgi import get_asgi_application
+from django.core.wsgi import get_wsgi_application
+from django.test import override_settings
+from django.urls import reverse
+
+from .models import Contract
+
+HOST = 'testserver'
+
+
+def default_urls():
+    contract = Contract.objects.order_by('-start_date', 'id').first()
+    if not contract:
+        raise ValueError("База пуста — сначала выполните seed_data.")
+    return [reverse('contracts:contract_list'), reverse('contracts:contract_detail', args=[contract.pk])]
+
+
+def _wsgi_environ(url):
+    parts = urlsplit(url)
+    return {
+        'REQUEST_METHOD': 'GET', 'PATH_INFO': parts.path, 'QUERY_STRING': parts.query,
+        'SERVER_NAME': HOST, 'SERVER_PORT': '80', 'HTTP_HOST': HOST, 'SERVER_PROTOCOL': 'HTTP/1.1',
+        'wsgi.version': (1, 0), 'wsgi.url_scheme': 'http', 'wsgi.input': io.BytesIO(), 'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True, 'wsgi.multiprocess': False, 'wsgi.run_once': False,
+    }
+
+
+def _asgi_scope(url):
+    parts = urlsplit(url)
+    return {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+        'path': parts.path, 'raw_path': parts.path.encode(), 'query_string': parts.query.encode(),
+        'headers': [(b'host', HOST.encode())], 'server': (HOST, 80), 'client': ('127.0.0.1', 0),
+    }
+
+
+def _summary(latencies, errors, elapsed):
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'rps': round(len(latencies) / elapsed, 1),
+        'median_ms': round(statistics.median(latencies), 2),
+        'p95_ms': round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 2),
+    }
+
+
+def run_wsgi(urls, requests, threads, client_delay=0.0):
+    application = get_wsgi_application()
+
+    def one(url):
+        status = []
+        started = time.perf_counter()
+        result = application(_wsgi_environ(url), lambda s, headers, exc_info=None: status.append(s))
+        try:
+            for _ in result:
+                pass
+            time.sleep(client_delay)  # медленный клиент: поток сервера ждёт вместе с ним
+        finally:
+            result.close()  # request_finished: закрыть соединение с базой этого потока
+        return (time.perf_counter() - started) * 1000, status[0].startswith('200')
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(threads) as pool:
+        results = list(pool.map(one, (urls[i % len(urls)] for i in range(requests))))
+    return _summary([ms for ms, _ in results], sum(not ok for _, ok in results), time.perf_counter() - started)
+
+
+async def _run_asgi(urls, requests, clients, client_delay):
+    application = get_asgi_application()
+    slots = asyncio.Semaphore(clients)
+
+    async def one(url):
+        status = []
+        body_sent = asyncio.Event()
+
+        async def receive():
+            if not body_sent.is_set():
+                body_sent.set()
+                return {'type': 'http.request', 'body': b'', 'more_body': False}
+            await asyncio.Event().wait()  # клиент не отключается; Django отменит ожидание сам
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                status.append(message['status'])
+            elif not message.get('more_body'):
+                await asyncio.sleep(client_delay)  # медленный клиент: ждёт только корутина
+
+        async with slots:
+            started = time.perf_counter()
+            await application(_asgi_scope(url), receive, send)
+            return (time.perf_counter() - started) * 1000, status[0] == 200
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*(one(urls[i % len(urls)]) for i in range(requests)))
+    return _summary([ms for ms, _ in results], sum(not ok for _, ok in results), time.perf_counter() - started)
+
+
+def run_asgi(urls, requests, clients, client_delay=0.0):
+    return asyncio.run(_run_asgi(urls, requests, clients, client_delay))
+
+
+def run(urls=None, requests=200, threads=8, clients=100, client_delay=0.0):
+    """Прогоняет одинаковую нагрузку через обе точки входа: {'wsgi': метрики, 'asgi': метрики}."""
+    urls = urls or default_urls()
+    with override_settings(ALLOWED_HOSTS=[HOST]):
+        return {
+            'wsgi': run_wsgi(urls, requests, threads, client_delay),
+            'asgi': run_asgi(urls, requests, clients, client_delay),
+        }
@@ -0,0 +1,46 @@
+# contracts_app/management/commands/benchmark.py
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from contracts_app import benchmarks
+
+
+class Command(BaseCommand):
+    help = "Замеряет время, число запросов и память основных страниц и сравнивает с базовым замером"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=5, help="Повторов каждого сценария")
+        parser.add_argument('--only', nargs='+', help="Только указанные сценарии")
+        parser.add_argument('--formset-rows', type=int, default=benchmarks.FORMSET_ROWS,
+                            help="Строк АК при сохранении формы договора")
+        parser.add_argument('--baseline', default='benchmarks/baseline.json', help="Файл базового замера")
+        parser.add_argument('--save-baseline', action='store_true', help="Сохранить результат как базовый")
+        parser.add_argument('--tolerance', type=float, default=0.2, help="Допустимый рост времени/памяти (доля)")
+
+    def handle(self, *args, **options):
+        try:
+            results = benchmarks.run(
+                repeat=options['repeat'], only=options['only'], formset_rows=options['formset_rows']
+            )
+        except ValueError as exc:
+            raise CommandError(str(exc))
+
+        self.stdout.write(f"{'сценарий':<20}{'медиана, мс':>14}{'p95, мс':>10}{'запросов':>10}{'пик, КБ':>10}")
+        for name, m in results.items():
+            self.stdout.write(f"{name:<20}{m['median_ms']:>14}{m['p95_ms']:>10}{m['queries']:>10}{m['peak_kb']:>10}")
+
+        path = options['baseline']
+        if options['save_baseline']:
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            benchmarks.save_baseline(path, results)
+            self.stdout.write(self.style.SUCCESS(f"Базовый замер сохранён: {path}"))
+            return
+        if not os.path.exists(path):
+            self.stdout.write(f"Базового замера нет ({path}); сохраните его с --save-baseline")
+            return
+
+        regressions = benchmarks.compare(results, benchmarks.load_baseline(path), options['tolerance'])
+        if regressions:
+            raise CommandError("Регрессии относительно базового замера:\n" + "\n".join(regressions))
+        self.stdout.write(self.style.SUCCESS("Регрессий нет"))
@@ -0,0 +1,38 @@
+# contracts_app/management/commands/import_aks.py
+from django.core.management.base import BaseCommand, CommandError
+
+from contracts_app.importers import import_aks, iter_rows, ImportFormatError, DEFAULT_BATCH_SIZE
+from contracts_app.models import Contract
+
+
+class Command(BaseCommand):
+    help = "Импортирует АК в договор из CSV/XLSX (колонки: номер, район, регион, адрес)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('contract_id', type=int, help="ID договора")
+        parser.add_argument('path', help="Путь к файлу .csv или .xlsx")
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help="Строк в одном INSERT")
+        parser.add_argument('--strict', action='store_true', help="Откатить импорт при любой ошибке")
+
+    def handle(self, *args, **options):
+        try:
+            contract = Contract.objects.get(pk=options['contract_id'])
+        except Contract.DoesNotExist:
+            raise CommandError(f"Договор {options['contract_id']} не найден.")
+
+        try:
+            with open(options['path'], 'rb') as fileobj:
+                result = import_aks(
+                    contract, iter_rows(fileobj, options['path']),
+                    batch_size=options['batch_size'], strict=options['strict'],
+                )
+        except (OSError, ImportFormatError) as exc:
+            raise CommandError(str(exc))
+
+        for line, message in result.errors:
+            self.stderr.write(f"Строка {line}: {message}")
+        if result.error_count > len(result.errors):
+            self.stderr.write(f"... и ещё {result.error_count - len(result.errors)} ошибок")
+        self.stdout.write(self.style.SUCCESS(
+            f"Строк: {result.rows}, добавлено АК: {result.created}, ошибок: {result.error_count}"
+        ))
@@ -0,0 +1,31 @@
+# contracts_app/management/commands/loadtest.py
+from django.core.management.base import BaseCommand, CommandError
+
+from contracts_app import loadtest
+
+
+class Command(BaseCommand):
+    help = "Сравнивает пропускную способность точек входа WSGI и ASGI под одинаковой нагрузкой"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', action='append', dest='urls', help="Адрес страницы (можно несколько)")
+        parser.add_argument('--requests', type=int, default=200, help="Всего запросов на каждую точку входа")
+        parser.add_argument('--threads', type=int, default=8, help="Потоков WSGI-сервера")
+        parser.add_argument('--clients', type=int, default=100, help="Одновременных клиентов ASGI")
+        parser.add_argument('--client-delay', type=float, default=0.0,
+                            help="Сколько секунд медленный клиент получает ответ")
+
+    def handle(self, *args, **options):
+        try:
+            results = loadtest.run(
+                urls=options['urls'], requests=options['requests'], threads=options['threads'],
+                clients=options['clients'], client_delay=options['client_delay'],
+            )
+        except ValueError as exc:
+            raise CommandError(str(exc))
+
+        self.stdout.write(f"{'точка входа':<14}{'запросов':>10}{'ошибок':>8}{'запр/с':>10}{'медиана, мс':>14}{'p95, мс':>10}")
+        for name, m in results.items():
+            self.stdout.write(
+                f"{name:<14}{m['requests']:>10}{m['errors']:>8}{m['rps']:>10}{m['median_ms']:>14}{m['p95_ms']:>10}"
+            )
@@ -0,0 +1,19 @@
+# contracts_app/management/commands/rebuild_search_index.py
+from django.core.management.base import BaseCommand, CommandError
+
+from contracts_app import search
+
+
+class Command(BaseCommand):
+    help = "Перестраивает полнотекстовые индексы договоров и адресов АК (SQLite FTS5)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default='default', help="Алиас базы данных")
+
+    def handle(self, *args, **options):
+        using = options['database']
+        if not search.is_supported(using):
+            raise CommandError("Полнотекстовый индекс поддерживается только для SQLite.")
+        rows = search.rebuild_search_index(using)
+        aks = search.rebuild_ak_search_index(using)
+        self.stdout.write(self.style.SUCCESS(f"Индекс перестроен: {rows} договоров, {aks} АК"))
@@ -0,0 +1,13 @@
+# contracts_app/management/commands/rebuild_summaries.py
+from django.core.management.base import BaseCommand
+
+from contracts_app import summary
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает сводки дашборда (регионы, районы, исполнители, месяцы окончания) с нуля"
+
+    def handle(self, *args, **options):
+        for name, rows in summary.rebuild().items():
+            self.stdout.write(f"{name}: {rows}")
+        self.stdout.write(self.style.SUCCESS("Сводки пересчитаны"))
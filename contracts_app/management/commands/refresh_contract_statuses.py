@@ -0,0 +1,18 @@
+# contracts_app/management/commands/refresh_contract_statuses.py
+from django.core.management.base import BaseCommand
+
+from contracts_app.status import refresh_statuses, DEFAULT_BATCH_SIZE
+
+
+class Command(BaseCommand):
+    help = "Переводит договоры с истёкшим сроком в «Завершён» (и обратно) пачками UPDATE"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help="Строк в одном UPDATE")
+        parser.add_argument('--database', default='default', help="Алиас базы данных")
+
+    def handle(self, *args, **options):
+        updated = refresh_statuses(batch_size=options['batch_size'], using=options['database'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Завершено: {updated['completed']}, возвращено в действующие: {updated['active']}"
+        ))
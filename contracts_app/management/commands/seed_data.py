@@ -0,0 +1,121 @@
+# contracts_app/management/commands/seed_data.py
+import random
+import time
+from datetime import date, timedelta
+from itertools import islice
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from contracts_app import summary
+from contracts_app.models import Region, District, Implementator, Contract, AK
+
+CUSTOMER_KINDS = ("ООО", "АО", "МУП", "ГБУ", "ИП", "ПАО")
+CUSTOMER_WORDS = ("Ромашка", "Север", "Восток", "Гарант", "Альфа", "Связь", "Энерго", "Строй", "Сервис", "Транс")
+STREETS = ("ул. Ленина", "ул. Мира", "пр. Победы", "ул. Садовая", "ул. Советская", "пер. Школьный", "ул. Гагарина")
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+class Command(BaseCommand):
+    help = "Заполняет базу синтетическими данными для нагрузочных замеров (bulk-вставками)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--regions', type=int, default=85)
+        parser.add_argument('--districts-per-region', type=int, default=40)
+        parser.add_argument('--implementators', type=int, default=2000)
+        parser.add_argument('--contracts', type=int, default=1_000_000)
+        parser.add_argument('--aks-per-contract', type=int, default=10, help="Среднее число АК на договор")
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=1, help="Зерно генератора — для повторяемых наборов")
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        started = time.perf_counter()
+
+        with transaction.atomic():
+            regions = self.seed_regions(options['regions'])
+            districts = self.seed_districts(regions, options['districts_per_region'])
+            implementators = self.seed_implementators(options['implementators'])
+        self.stdout.write(f"Справочники: {len(regions)} регионов, {len(districts)} районов, "
+                          f"{len(implementators)} исполнителей")
+
+        contracts = aks = 0
+        for batch in batched(self.contract_rows(options['contracts'], implementators), self.batch_size):
+            with transaction.atomic():
+                Contract.objects.bulk_create(batch)
+                aks += self.seed_aks(batch, districts, options['aks_per_contract'])
+            contracts += len(batch)
+            self.stdout.write(f"  договоров: {contracts}, АК: {aks}")
+
+        summary.rebuild()  # bulk_create идёт мимо сигналов, которые ведут сводки
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Готово за {time.perf_counter() - started:.1f} с: договоров {contracts}, АК {aks}"
+        ))
+
+    def seed_regions(self, count):
+        offset = Region.objects.count()
+        return Region.objects.bulk_create(
+            Region(name=f"Регион №{offset + i}", code=f"S{offset + i}") for i in range(1, count + 1)
+        )
+
+    def seed_districts(self, regions, per_region):
+        rows = (
+            District(name=f"Район №{i}", region=region, population=self.rng.randint(5_000, 500_000))
+            for region in regions for i in range(1, per_region + 1)
+        )
+        return [pk for batch in batched(rows, self.batch_size)
+                for pk in (d.pk for d in District.objects.bulk_create(batch))]
+
+    def seed_implementators(self, count):
+        offset = Implementator.objects.count()
+        rows = (
+            Implementator(
+                name=f"{self.rng.choice(CUSTOMER_KINDS)} «{self.rng.choice(CUSTOMER_WORDS)}-{offset + i}»",
+                inn=f"{9000000000 + offset + i}",
+            )
+            for i in range(1, count + 1)
+        )
+        return [pk for batch in batched(rows, self.batch_size)
+                for pk in (i.pk for i in Implementator.objects.bulk_create(batch))]
+
+    def contract_rows(self, count, implementators):
+        today = date.today()
+        for _ in range(count):
+            start = today - timedelta(days=self.rng.randint(0, 3650))
+            end = start + timedelta(days=self.rng.randint(30, 1825))
+            yield Contract(
+                customer_name=f"{self.rng.choice(CUSTOMER_KINDS)} «{self.rng.choice(CUSTOMER_WORDS)} "
+                              f"{self.rng.choice(CUSTOMER_WORDS)}»",
+                customer_inn=str(self.rng.randint(1_000_000_000, 9_999_999_999)),
+                start_date=start,
+                end_date=end,
+                status='completed' if today > end else 'active',
+                implementator_id=self.rng.choice(implementators),
+                gos_services=self.rng.random() < 0.5,
+                oko=self.rng.random() < 0.3,
+                spolokh=self.rng.random() < 0.2,
+            )
+
+    def seed_aks(self, contracts, districts, average):
+        rows = (
+            AK(
+                contract=contract,
+                number=number,
+                district_id=self.rng.choice(districts),
+                address=f"{self.rng.choice(STREETS)}, д. {self.rng.randint(1, 200)}, кв. {self.rng.randint(1, 300)}",
+            )
+            for contract in contracts
+            for number in range(1, self.rng.randint(0, average * 2) + 1)
+        )
+        created = 0
+        for batch in batched(rows, self.batch_size):
+            AK.objects.bulk_create(batch)
+            created += len(batch)
+        return created
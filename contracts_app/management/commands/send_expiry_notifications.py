@@ -0,0 +1,17 @@
+# contracts_app/management/commands/send_expiry_notifications.py
+from django.core.management.base import BaseCommand
+
+from contracts_app.notifications import send_expiry_notifications
+
+
+class Command(BaseCommand):
+    help = "Рассылает исполнителям уведомления о скором окончании договоров (запускать раз в день)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lead-days', type=int, nargs='+', help="Сроки упреждения, дней (по умолчанию из настроек)")
+        parser.add_argument('--dry-run', action='store_true', help="Только посчитать, не отправлять")
+
+    def handle(self, *args, **options):
+        messages, contracts = send_expiry_notifications(lead_days=options['lead_days'], dry_run=options['dry_run'])
+        verb = "К отправке" if options['dry_run'] else "Отправлено"
+        self.stdout.write(self.style.SUCCESS(f"{verb}: писем {messages}, договоров {contracts}"))
@@ -0,0 +1,41 @@
+# contracts_app/management/commands/sync_reference.py
+from django.core.management.base import BaseCommand, CommandError
+
+from contracts_app.importers import ImportFormatError, iter_rows
+from contracts_app.reference_sync import DEFAULT_BATCH_SIZE, REFERENCES, SyncError, sync_reference
+
+
+class Command(BaseCommand):
+    help = "Синхронизирует справочник с реестром из CSV/XLSX: добавляет и обновляет только изменившиеся строки"
+
+    def add_arguments(self, parser):
+        parser.add_argument('reference', choices=sorted(REFERENCES), help="Справочник")
+        parser.add_argument('path', help="Путь к файлу .csv или .xlsx")
+        parser.add_argument('--dry-run', action='store_true', help="Только показать изменения, ничего не записывая")
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help="Строк в одном INSERT/UPDATE")
+
+    def handle(self, *args, **options):
+        try:
+            with open(options['path'], 'rb') as fileobj:
+                result = sync_reference(
+                    options['reference'], iter_rows(fileobj, options['path']),
+                    batch_size=options['batch_size'], dry_run=options['dry_run'],
+                )
+        except (OSError, ImportFormatError, SyncError) as exc:
+            raise CommandError(str(exc))
+
+        for line, message in result.errors:
+            self.stderr.write(f"Строка {line}: {message}")
+        if result.error_count > len(result.errors):
+            self.stderr.write(f"... и ещё {result.error_count - len(result.errors)} ошибок")
+        for sample in result.samples:
+            self.stdout.write(f"  {sample}")
+        if result.created + result.updated > len(result.samples):
+            self.stdout.write(f"  ... и ещё {result.created + result.updated - len(result.samples)} изменений")
+
+        summary = (f"Строк: {result.rows}, новых: {result.created}, изменённых: {result.updated}, "
+                   f"без изменений: {result.unchanged}, нет в файле: {result.missing}, ошибок: {result.error_count}")
+        if options['dry_run']:
+            self.stdout.write(self.style.WARNING(f"Пробный запуск, ничего не записано. {summary}"))
+        else:
+            self.stdout.write(self.style.SUCCESS(summary))
@@ -0,0 +1,269 @@
+# contracts_app/metrics.py
+"""
+Метрики запросов: время представления, число и время SQL-запросов, время
+рендеринга шаблонов, журнал медленных запросов.
+
+MetricsMiddleware кладёт в contextvar счётчики текущего запроса, обёртка
+execute (ставится на каждое соединение при подключении) и шаблонный бэкенд
+InstrumentedTemplates дописывают в них свои замеры — contextvar виден и в
+потоках sync_to_async асинхронных представлений. По завершении запроса всё
+разом, под одной блокировкой, попадает в гистограммы реестра; /metrics
+отдаёт их в текстовом формате Prometheus. Время шаблона считается без
+вложенных шаблонов, поэтому поля формсета АК, которые рисует crispy-forms
+(bootstrap5/field.html), видны отдельно от страницы, куда они вставлены.
+
+На запрос — два perf_counter на SQL-запрос и на шаблон и одна блокировка
+в конце, так что метрики можно не выключать. Реестр свой у каждого
+процесса: при нескольких воркерах Prometheus опрашивает каждый.
+"""
+import hmac
+import logging
+import os
+import sys
+import threading
+import time
+from collections import defaultdict
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.template.backends.django import DjangoTemplates
+
+logger = logging.getLogger(__name__)
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+_APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+_current = ContextVar('contracts_request_metrics', default=None)
+
+
+# === Реестр ===
+class Histogram:
+    def __init__(self, name, help_text, labels, buckets=DURATION_BUCKETS):
+        self.name, self.help_text, self.labels, self.buckets = name, help_text, labels, buckets
+        self.series = defaultdict(lambda: [0] * (len(buckets) + 2))  # по корзинам, сумма, количество
+
+    def observe(self, label_values, value):
+        series = self.series[label_values]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[i] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def render(self):
+        yield f'# HELP {self.name} {self.help_text}'
+        yield f'# TYPE {self.name} histogram'
+        for label_values, series in sorted(self.series.items()):
+            labels = _labels(self.labels, label_values)
+            for bound, count in zip(self.buckets, series):
+                yield f'{self.name}_bucket{{{labels},le="{bound}"}} {count}'
+            yield f'{self.name}_bucket{{{labels},le="+Inf"}} {series[-1]}'
+            yield f'{self.name}_sum{{{labels}}} {series[-2]:.6f}'
+            yield f'{self.name}_count{{{labels}}} {series[-1]}'
+
+
+class Counter:
+    def __init__(self, name, help_text, labels):
+        self.name, self.help_text, self.labels = name, help_text, labels
+        self.series = defaultdict(int)
+
+    def inc(self, label_values, value=1):
+        self.series[label_values] += value
+
+    def render(self):
+        yield f'# HELP {self.name} {self.help_text}'
+        yield f'# TYPE {self.name} counter'
+        for label_values, value in sorted(self.series.items()):
+            yield f'{self.name}{{{_labels(self.labels, label_values)}}} {value}'
+
+
+def _labels(names, values):
+    escaped = (str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n') for value in values)
+    return ','.join(f'{name}="{value}"' for name, value in zip(names, escaped))
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = Counter('contracts_http_requests_total', "Запросы по представлению и классу статуса",
+                                ('view', 'method', 'status'))
+        self.duration = Histogram('contracts_http_request_duration_seconds', "Время обработки запроса",
+                                  ('view', 'method'))
+        self.db_queries = Histogram('contracts_db_queries_per_request', "SQL-запросов за HTTP-запрос",
+                                    ('view',), QUERY_COUNT_BUCKETS)
+        self.db_duration = Histogram('contracts_db_duration_seconds', "Время SQL за HTTP-запрос", ('view',))
+        self.slow_queries = Counter('contracts_db_slow_queries_total', "SQL-запросы дольше SLOW_QUERY_MS",
+                                    ('view',))
+        self.template_duration = Histogram('contracts_template_render_seconds',
+                                           "Время шаблона за HTTP-запрос, без вложенных шаблонов", ('template',))
+
+    def record(self, request_metrics, view, method, status, elapsed):
+        with self._lock:
+            self.requests.inc((view, method, f'{status // 100}xx'))
+            self.duration.observe((view, method), elapsed)
+            self.db_queries.observe((view,), request_metrics.queries)
+            self.db_duration.observe((view,), request_metrics.db_time)
+            if request_metrics.slow_queries:
+                self.slow_queries.inc((view,), request_metrics.slow_queries)
+            for name, seconds in request_metrics.templates.items():
+                self.template_duration.observe((name,), seconds)
+
+    def render(self):
+        with self._lock:
+            lines = [line for metric in (self.requests, self.duration, self.db_queries, self.db_duration,
+                                         self.slow_queries, self.template_duration) for line in metric.render()]
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+# === Замеры текущего запроса ===
+class RequestMetrics:
+    __slots__ = ('queries', 'db_time', 'slow_queries', 'templates', 'nested')
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.slow_queries = 0
+        self.templates = defaultdict(float)
+        self.nested = 0.0  # время вложенных шаблонов текущего рендеринга
+
+    @property
+    def template_time(self):
+        return sum(self.templates.values())
+
+
+def _call_site():
+    """Ближайший к запросу кадр кода приложения (не Django и не этот модуль)."""
+    frame = sys._getframe(2)
+    while frame:
+        filename = frame.f_code.co_filename
+        if filename.startswith(_APP_DIR) and filename != __file__:
+            return f'{os.path.relpath(filename, os.path.dirname(_APP_DIR))}:{frame.f_lineno} in {frame.f_code.co_name}'
+        frame = frame.f_back
+    return '?'
+
+
+def record_query(execute, sql, params, many, context):
+    """Обёртка execute: время и число запросов, журнал медленных."""
+    request_metrics = _current.get()
+    if request_metrics is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - started
+        request_metrics.queries += 1
+        request_metrics.db_time += elapsed
+        if elapsed * 1000 >= settings.SLOW_QUERY_MS:
+            request_metrics.slow_queries += 1
+            logger.warning("Медленный SQL-запрос %.1f мс (%s, %s): %s",
+                           elapsed * 1000, context['connection'].alias, _call_site(), sql)
+
+
+def install_execute_wrapper(sender, connection, **kwargs):
+    """connection_created: обёртка ставится один раз на объект соединения."""
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+# === Шаблоны ===
+class _TimedTemplate:
+    def __init__(self, template):
+        self._template = template
+
+    def __getattr__(self, name):
+        return getattr(self._template, name)
+
+    def render(self, context=None, request=None):
+        request_metrics = _current.get()
+        if request_metrics is None:
+            return self._template.render(context, request)
+        outer_nested, request_metrics.nested = request_metrics.nested, 0.0
+        started = time.perf_counter()
+        try:
+            return self._template.render(context, request)
+        finally:
+            elapsed = time.perf_counter() - started
+            request_metrics.templates[self._template.template.name or '<string>'] += elapsed - request_metrics.nested
+            request_metrics.nested = outer_nested + elapsed
+
+
+class InstrumentedTemplates(DjangoTemplates):
+    """DjangoTemplates, замеряющий время каждого шаблона (TEMPLATES['BACKEND'])."""
+
+    def from_string(self, template_code):
+        return _TimedTemplate(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return _TimedTemplate(super().get_template(template_name))
+
+
+# === Middleware ===
+def _server_timing(request_metrics, elapsed):
+    return ', '.join((
+        f'db;dur={request_metrics.db_time * 1000:.1f};desc="{request_metrics.queries} SQL"',
+        f'tpl;dur={request_metrics.template_time * 1000:.1f}',
+        f'total;dur={elapsed * 1000:.1f}',
+    ))
+
+
+class MetricsMiddleware:
+    """Первым в MIDDLEWARE: меряет запрос целиком. METRICS_ENABLED = False — отключает."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.METRICS_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        request_metrics, started = RequestMetrics(), time.perf_counter()
+        token = _current.set(request_metrics)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self._finish(request, response, request_metrics, started)
+
+    async def __acall__(self, request):
+        request_metrics, started = RequestMetrics(), time.perf_counter()
+        token = _current.set(request_metrics)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self._finish(request, response, request_metrics, started)
+
+    def _finish(self, request, response, request_metrics, started):
+        elapsed = time.perf_counter() - started
+        match = request.resolver_match
+        view = match.view_name if match else '<unresolved>'
+        registry.record(request_metrics, view, request.method, response.status_code, elapsed)
+        if settings.SERVER_TIMING:
+            response['Server-Timing'] = _server_timing(request_metrics, elapsed)
+        return response
+
+
+def allowed(request):
+    """Токен из METRICS_TOKEN, сотрудник или адрес из METRICS_ALLOWED_IPS."""
+    token = settings.METRICS_TOKEN
+    scheme, _, credentials = request.headers.get('Authorization', '').partition(' ')
+    if token and scheme.lower() == 'bearer' and hmac.compare_digest(credentials.encode(), token.encode()):
+        return True
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_active and user.is_staff:
+        return True
+    return request.META.get('REMOTE_ADDR') in settings.METRICS_ALLOWED_IPS
@@ -1,9 +1,14 @@
 #contracts_app/models.py
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
 from django.core.validators import RegexValidator, MinValueValidator, MaxValueValidator, FileExtensionValidator
+from django.db.models.functions import Coalesce
 from django.utils import timezone
 from django.core.exceptions import ValidationError
 
+from .storage import contract_storage
+
 
 # === СПРАВОЧНИКИ ===
 class Work(models.Model):
@@ -44,6 +49,7 @@ class Implementator(models.Model):
         validators=[RegexValidator(regex=r'^\d{10}$|^\d{12}$', message="ИНН: 10 или 12 цифр.")],
         help_text="10 цифр — юр.лицо, 12 — физ.лицо"
     )
+    email = models.EmailField(blank=True, verbose_name="E-mail для уведомлений")
     class Meta:
         verbose_name = "Исполнитель"
         verbose_name_plural = "Исполнители"
@@ -51,12 +57,81 @@ class Implementator(models.Model):
     def __str__(self): return f"{self.name} (ИНН: {self.inn})"
 
 
+# === ВЕРСИИ КЭША (см. caching.py) ===
+class CacheVersion(models.Model):
+    """Метка времени последнего изменения списка или справочников — общая для всех процессов."""
+    name = models.CharField(max_length=20, primary_key=True, verbose_name="Версия")
+    stamp = models.FloatField(verbose_name="Метка времени")
+
+    class Meta:
+        verbose_name = "Версия кэша"
+        verbose_name_plural = "Версии кэша"
+
+    def __str__(self):
+        return f"{self.name}: {self.stamp}"
+
+
+# === ФАЙЛЫ ===
+class StoredFile(models.Model):
+    """Учёт ссылок на файл в хранилище по содержимому (см. storage.py)."""
+    name = models.CharField(max_length=255, unique=True, verbose_name="Путь в хранилище")
+    size = models.PositiveBigIntegerField(default=0, verbose_name="Размер")
+    ref_count = models.PositiveIntegerField(default=0, verbose_name="Ссылок")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Создан")
+
+    class Meta:
+        verbose_name = "Файл хранилища"
+        verbose_name_plural = "Файлы хранилища"
+
+    def __str__(self):
+        return f"{self.name} ({self.ref_count})"
+
+
 # === ДОГОВОР ===
 def validate_file_size(value):
     if value.size > 20 * 1024 * 1024:  # 20 МБ
         raise ValidationError("Файл не должен превышать 20 МБ.")
 
 
+def _file_attached(name):
+    # FileField хранит пустую строку или NULL, если файла нет
+    return models.Case(
+        models.When(models.Q(**{f'{name}__isnull': False}) & ~models.Q(**{name: ''}), then=1),
+        default=0,
+        output_field=models.IntegerField(),
+    )
+
+
+class ContractQuerySet(models.QuerySet):
+    def with_counts(self):
+        """Исполнитель через JOIN, число АК и файлов — в том же SQL-запросе."""
+        # Коррелированный подзапрос вместо JOIN + GROUP BY: считается только для
+        # строк страницы, и список читается по индексу сортировки с LIMIT.
+        aks = AK.objects.filter(contract=models.OuterRef('pk')).order_by().values('contract')
+        return self.select_related('implementator').annotate(
+            ak_count=Coalesce(models.Subquery(aks.annotate(n=models.Count('pk')).values('n')), 0),
+            file_total=_file_attached('file1') + _file_attached('file2') + _file_attached('file3'),
+        )
+
+    def with_live_status(self, today=None):
+        """Статус на текущую дату, даже если поле status ещё не обновлено."""
+        today = today or timezone.now().date()
+        return self.annotate(live_status=models.Case(
+            models.When(end_date__lt=today, then=models.Value('completed')),
+            default=models.Value('active'),
+            output_field=models.CharField(),
+        ))
+
+    def filter_status(self, status, today=None):
+        """Фильтр по фактическому статусу: условие на end_date, а не на сохранённый status."""
+        today = today or timezone.now().date()
+        if status == 'completed':
+            return self.filter(end_date__lt=today)
+        if status == 'active':
+            return self.filter(end_date__gte=today)
+        return self.none()
+
+
 class Contract(models.Model):
     STATUS_CHOICES = (
         ('active', 'Действует'),
@@ -80,12 +155,12 @@ class Contract(models.Model):
 
     # Файлы (1–3)
     file1 = models.FileField(
-        upload_to='contracts/files/', blank=True, null=True,
+        upload_to='contracts/files/', storage=contract_storage, blank=True, null=True,
         validators=[FileExtensionValidator(allowed_extensions=['pdf', 'doc', 'docx', 'jpg', 'png', 'jpeg']), validate_file_size],
         verbose_name="Файл 1"
     )
-    file2 = models.FileField(upload_to='contracts/files/', blank=True, null=True, validators=[validate_file_size], verbose_name="Файл 2")
-    file3 = models.FileField(upload_to='contracts/files/', blank=True, null=True, validators=[validate_file_size], verbose_name="Файл 3")
+    file2 = models.FileField(upload_to='contracts/files/', storage=contract_storage, blank=True, null=True, validators=[validate_file_size], verbose_name="Файл 2")
+    file3 = models.FileField(upload_to='contracts/files/', storage=contract_storage, blank=True, null=True, validators=[validate_file_size], verbose_name="Файл 3")
 
     # Автостатус
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, editable=False, verbose_name="Статус")
@@ -93,10 +168,22 @@ class Contract(models.Model):
     created_at = models.DateTimeField(auto_now_add=True, verbose_name="Создан")
     updated_at = models.DateTimeField(auto_now=True, verbose_name="Обновлён")
 
+    objects = ContractQuerySet.as_manager()
+
     class Meta:
         verbose_name = "Долгосрочный договор"
         verbose_name_plural = "Долгосрочные договоры"
         ordering = ['-start_date']
+        # Индексы под реальные пути доступа; планы проверяет QueryPlanTests
+        indexes = [
+            models.Index(fields=['-start_date', 'id'], name='contract_start_id_idx'),              # список
+            models.Index(fields=['status', '-start_date'], name='contract_status_start_idx'),      # админка: статус
+            models.Index(fields=['implementator', '-start_date'], name='contract_impl_start_idx'), # админка: исполнитель
+            models.Index(fields=['status', 'end_date'], name='contract_status_end_idx'),          # refresh_statuses
+            models.Index(fields=['end_date'], name='contract_end_idx'),                          # статус, уведомления
+            models.Index(fields=['customer_inn'], name='contract_customer_inn_idx'),             # поиск по ИНН
+            models.Index(fields=['updated_at', 'id'], name='contract_updated_id_idx'),           # API: updated_at__gt
+        ]
 
     def __str__(self):
         return f"Договор с {self.customer_name} ({self.start_date} — {self.end_date})"
@@ -112,7 +199,11 @@ class Contract(models.Model):
             self.status = 'completed'
         else:
             self.status = 'active'
-        super().save(*args, **kwargs)
+        try:
+            super().save(*args, **kwargs)
+        finally:
+            # Загрузки, записанные в pre_save, не должны жить в потоке после неудачного сохранения
+            contract_storage.forget_saved()
 
     def file_count(self):
         return sum(bool(getattr(self, f'file{i}')) for i in range(1, 4))
@@ -135,6 +226,111 @@ class AK(models.Model):
         verbose_name_plural = "Абонентские комплекты (АК)"
         unique_together = ('contract', 'number')  # Уникальный номер в договоре
         ordering = ['number']
+        indexes = [
+            models.Index(fields=['number'], name='ak_number_idx'),  # глобальный поиск АК по номеру
+        ]
+
+    def __str__(self):
+        return f"АК {self.number} — {self.address}"
+
+
+# === УВЕДОМЛЕНИЯ ===
+class ExpiryNotification(models.Model):
+    """Отправленное уведомление о сроке: повторный запуск рассылки его пропустит."""
+    contract = models.ForeignKey(Contract, on_delete=models.CASCADE, related_name='expiry_notifications', verbose_name="Договор")
+    lead_days = models.PositiveSmallIntegerField(verbose_name="За сколько дней")
+    end_date = models.DateField(verbose_name="Дата окончания на момент отправки")
+    recipient = models.EmailField(verbose_name="Получатель")
+    sent_at = models.DateTimeField(auto_now_add=True, verbose_name="Отправлено")
+
+    class Meta:
+        verbose_name = "Уведомление о сроке"
+        verbose_name_plural = "Уведомления о сроках"
+        unique_together = ('contract', 'lead_days', 'end_date')
+
+    def __str__(self):
+        return f"{self.contract_id}: за {self.lead_days} дн. ({self.sent_at:%d.%m.%Y})"
+
+
+# === СВОДКИ ДЛЯ ДАШБОРДА (поддерживаются в summary.py) ===
+class SummaryCounters(models.Model):
+    """Действующие договоры и их АК; для ExpirySummary — все договоры с окончанием в месяце."""
+    contracts = models.IntegerField(default=0, verbose_name="Договоров")
+    aks = models.IntegerField(default=0, verbose_name="АК")
+
+    class Meta:
+        abstract = True
+
+
+class RegionSummary(SummaryCounters):
+    region = models.OneToOneField(Region, on_delete=models.CASCADE, primary_key=True, related_name='summary', verbose_name="Регион")
+
+    class Meta:
+        verbose_name = "Сводка по региону"
+        verbose_name_plural = "Сводки по регионам"
+
+
+class DistrictSummary(SummaryCounters):
+    district = models.OneToOneField(District, on_delete=models.CASCADE, primary_key=True, related_name='summary', verbose_name="Район")
+
+    class Meta:
+        verbose_name = "Сводка по району"
+        verbose_name_plural = "Сводки по районам"
+
+
+class ImplementatorSummary(SummaryCounters):
+    implementator = models.OneToOneField(Implementator, on_delete=models.CASCADE, primary_key=True, related_name='summary', verbose_name="Исполнитель")
+
+    class Meta:
+        verbose_name = "Сводка по исполнителю"
+        verbose_name_plural = "Сводки по исполнителям"
+
+
+class ExpirySummary(SummaryCounters):
+    month = models.DateField(primary_key=True, verbose_name="Месяц окончания")  # первое число месяца
+
+    class Meta:
+        verbose_name = "Сводка по месяцу окончания"
+        verbose_name_plural = "Сводки по месяцам окончания"
+        ordering = ['month']
+
+
+# === ИСТОРИЯ ИЗМЕНЕНИЙ (пишется пачками в history.py) ===
+class ChangeRecord(models.Model):
+    """
+    Изменение договора или АК: только изменившиеся поля, {поле: [было, стало]}.
+    Таблица только пополняется; ссылки без внешних ключей в базе, чтобы её
+    можно было секционировать по changed_at (см. history.py).
+    """
+    CONTRACT, AK = 1, 2
+    OBJECT_TYPES = (
+        (CONTRACT, 'Договор'),
+        (AK, 'АК'),
+    )
+    CREATED, UPDATED, DELETED = 1, 2, 3
+    ACTIONS = (
+        (CREATED, 'Создание'),
+        (UPDATED, 'Изменение'),
+        (DELETED, 'Удаление'),
+    )
+
+    object_type = models.PositiveSmallIntegerField(choices=OBJECT_TYPES, verbose_name="Объект")
+    object_id = models.BigIntegerField(verbose_name="ID объекта")
+    action = models.PositiveSmallIntegerField(choices=ACTIONS, verbose_name="Действие")
+    changes = models.JSONField(encoder=DjangoJSONEncoder, default=dict, verbose_name="Изменения")
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL, null=True, blank=True, on_delete=models.DO_NOTHING, db_constraint=False,
+        related_name='+', verbose_name="Пользователь"
+    )
+    changed_at = models.DateTimeField(verbose_name="Время")
+
+    class Meta:
+        verbose_name = "Изменение"
+        verbose_name_plural = "История изменений"
+        indexes = [
+            models.Index(fields=['object_type', 'object_id', 'changed_at'], name='change_object_time_idx'),  # история объекта
+            models.Index(fields=['changed_at', 'id'], name='change_time_id_idx'),                           # изменения после T
+        ]
 
     def __str__(self):
-        return f"АК {self.number} — {self.address}"
\ No newline at end of file
+        return f"{self.get_object_type_display()} {self.object_id}: {self.get_action_display()} ({self.changed_at:%d.%m.%Y %H:%M})"
@@ -0,0 +1,104 @@
+# contracts_app/notifications.py
+"""
+Уведомления об окончании договоров.
+
+Для каждого срока упреждения (settings.CONTRACT_EXPIRY_LEAD_DAYS, по
+умолчанию 30/7/1 дней) выбираются договоры, у которых end_date попадает в
+свой интервал: (сегодня + меньший срок, сегодня + срок]. Договор попадает
+ровно в один интервал, так что пропущенный запуск планировщика не теряет
+уведомлений и не шлёт сразу несколько. Договоры группируются по исполнителю
+в одно письмо; все письма уходят через одно SMTP-соединение. Отправленное
+записывается в ExpiryNotification — повторный запуск ничего не дублирует.
+"""
+from dataclasses import dataclass, field
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db.models import Exists, OuterRef
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+from .models import Contract, ExpiryNotification
+
+
+@dataclass
+class Digest:
+    implementator: object
+    contracts: list = field(default_factory=list)  # [(договор, срок упреждения)]
+
+
+def lead_windows(lead_days, today):
+    """[(срок, дата от, дата до)] — от включительно только для самого короткого срока."""
+    leads = sorted(set(lead_days))
+    windows = []
+    for i, lead in enumerate(leads):
+        start = today + timedelta(days=leads[i - 1] + 1) if i else today
+        windows.append((lead, start, today + timedelta(days=lead)))
+    return windows
+
+
+def due_contracts(lead, start, end):
+    already_sent = ExpiryNotification.objects.filter(
+        contract=OuterRef('pk'), lead_days=lead, end_date=OuterRef('end_date')
+    )
+    return (Contract.objects
+            .filter(end_date__range=(start, end))
+            .filter(~Exists(already_sent))
+            .select_related('implementator')
+            .order_by('end_date', 'pk'))
+
+
+def collect_digests(today=None, lead_days=None):
+    """Письма по исполнителям; исполнители без e-mail пропускаются до его появления."""
+    today = today or timezone.now().date()
+    lead_days = lead_days or settings.CONTRACT_EXPIRY_LEAD_DAYS
+    digests = {}
+    for lead, start, end in lead_windows(lead_days, today):
+        rows = due_contracts(lead, start, end).filter(implementator__email__gt='')
+        for contract in rows.iterator(chunk_size=2000):
+            digest = digests.setdefault(contract.implementator_id, Digest(contract.implementator))
+            digest.contracts.append((contract, lead))
+    return list(digests.values())
+
+
+def build_message(digest, connection):
+    contracts = sorted(digest.contracts, key=lambda item: item[0].end_date)
+    body = render_to_string('contracts/emails/expiry_digest.txt', {
+        'implementator': digest.implementator,
+        'contracts': contracts,
+    })
+    return EmailMessage(
+        subject=f"Окончание договоров: {len(contracts)}",
+        body=body,
+        to=[digest.implementator.email],
+        connection=connection,
+    )
+
+
+def send_expiry_notifications(today=None, lead_days=None, dry_run=False):
+    """Отправляет дайджесты. Возвращает (писем, договоров)."""
+    digests = collect_digests(today, lead_days)
+    if dry_run:
+        return len(digests), sum(len(d.contracts) for d in digests)
+
+    sent_messages = sent_contracts = 0
+    with get_connection() as connection:
+        for digest in digests:
+            if not build_message(digest, connection).send():
+                continue
+            ExpiryNotification.objects.bulk_create([
+                ExpiryNotification(
+                    contract=contract, lead_days=lead, end_date=contract.end_date,
+                    recipient=digest.implementator.email,
+                )
+                for contract, lead in digest.contracts
+            ], ignore_conflicts=True)
+            sent_messages += 1
+            sent_contracts += len(digest.contracts)
+    return sent_messages, sent_contracts
+
+
+def scheduled_notify():
+    """Точка входа для планировщика (cron, APScheduler, Celery beat)."""
+    return send_expiry_notifications()
@@ -0,0 +1,189 @@
+# contracts_app/pagination.py
+"""
+Keyset-пагинация (по курсору).
+
+Вместо OFFSET и COUNT(*) следующая страница выбирается условием «после
+последней строки предыдущей» по ключу сортировки, поэтому страница N стоит
+столько же, сколько первая. Курсор — непрозрачный токен (base64 от JSON).
+"""
+import base64
+import datetime
+import json
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from django.http import Http404
+
+CONTRACT_KEY = ('-start_date', 'id')
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+class _CursorEncoder(DjangoJSONEncoder):
+    def default(self, o):
+        # DjangoJSONEncoder обрезает время до миллисекунд — курсору нужна точность до микросекунд
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+def encode_cursor(values, backwards=False):
+    payload = json.dumps({'k': values, 'b': backwards}, cls=_CursorEncoder, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+        return list(payload['k']), bool(payload['b'])
+    except (ValueError, TypeError, KeyError):
+        raise InvalidCursor("Некорректный курсор")
+
+
+def _field(spec):
+    return spec.lstrip('-'), spec.startswith('-')
+
+
+def _clean_values(model, key, values):
+    """Значения курсора, приведённые к типам полей ключа; чужой или подделанный токен — InvalidCursor."""
+    if len(values) != len(key):
+        raise InvalidCursor("Некорректный курсор")
+    cleaned = []
+    for spec, value in zip(key, values):
+        if value is None or isinstance(value, (dict, list, bool)):
+            raise InvalidCursor("Некорректный курсор")
+        try:
+            value = model._meta.get_field(_field(spec)[0]).to_python(value)
+        except FieldDoesNotExist:
+            pass
+        except (ValidationError, ValueError, TypeError):
+            raise InvalidCursor("Некорректный курсор")
+        if value is None:
+            raise InvalidCursor("Некорректный курсор")
+        cleaned.append(value)
+    return cleaned
+
+
+def _seek(key, values, backwards):
+    """(a, b) после (x, y): a < x OR (a = x AND b > y) — с учётом направлений."""
+    condition = Q()
+    for i, spec in enumerate(key):
+        name, descending = _field(spec)
+        lookup = 'lt' if descending != backwards else 'gt'
+        step = Q(**{f'{name}__{lookup}': values[i]})
+        for prev_spec, prev_value in zip(key[:i], values[:i]):
+            step &= Q(**{_field(prev_spec)[0]: prev_value})
+        condition |= step
+    return condition
+
+
+def _reverse(spec):
+    return spec[1:] if spec.startswith('-') else f'-{spec}'
+
+
+class CursorPage:
+    """Страница с курсорами соседних страниц; общего числа строк нет намеренно."""
+
+    def __init__(self, object_list, key, has_next, has_previous):
+        self.object_list = object_list
+        self.key = key
+        self._has_next = has_next
+        self._has_previous = has_previous
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def _values(self, obj):
+        # Строки могут быть и моделями, и словарями из values()
+        if isinstance(obj, dict):
+            return [obj[_field(spec)[0]] for spec in self.key]
+        return [getattr(obj, _field(spec)[0]) for spec in self.key]
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self._has_next or self._has_previous
+
+    @property
+    def next_cursor(self):
+        if self._has_next and self.object_list:
+            return encode_cursor(self._values(self.object_list[-1]))
+        return None
+
+    @property
+    def previous_cursor(self):
+        if self._has_previous and self.object_list:
+            return encode_cursor(self._values(self.object_list[0]), backwards=True)
+        return None
+
+
+def _cursor_queryset(queryset, cursor, per_page, key):
+    backwards = False
+    if cursor:
+        values, backwards = decode_cursor(cursor)
+        queryset = queryset.filter(_seek(key, _clean_values(queryset.model, key, values), backwards))
+    ordering = [_reverse(spec) for spec in key] if backwards else list(key)
+    return queryset.order_by(*ordering)[:per_page + 1], backwards
+
+
+def _cursor_page(rows, cursor, per_page, key, backwards):
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    if backwards:
+        rows.reverse()
+        return CursorPage(rows, key, has_next=True, has_previous=has_more)
+    return CursorPage(rows, key, has_next=has_more, has_previous=bool(cursor))
+
+
+def paginate_by_cursor(queryset, cursor, per_page, key=CONTRACT_KEY):
+    """Возвращает CursorPage; некорректный курсор — InvalidCursor."""
+    queryset, backwards = _cursor_queryset(queryset, cursor, per_page, key)
+    return _cursor_page(list(queryset), cursor, per_page, key, backwards)
+
+
+async def apaginate_by_cursor(queryset, cursor, per_page, key=CONTRACT_KEY):
+    """То же для асинхронных представлений: строки читаются асинхронной итерацией."""
+    queryset, backwards = _cursor_queryset(queryset, cursor, per_page, key)
+    return _cursor_page([obj async for obj in queryset], cursor, per_page, key, backwards)
+
+
+def paginate_chain_by_cursor(querysets, cursor, per_page, key=CONTRACT_KEY):
+    """
+    paginate_by_cursor для объединения querysets, которые по ключу идут один за
+    другим и не пересекаются (например, диапазоны номеров). Каждая часть читается
+    своим запросом по индексу, пока страница не наберётся, — без сортировки
+    объединения целиком.
+    """
+    querysets = list(querysets)
+    backwards = decode_cursor(cursor)[1] if cursor else False
+    rows = []
+    for queryset in reversed(querysets) if backwards else querysets:
+        part, backwards = _cursor_queryset(queryset, cursor, per_page - len(rows), key)
+        rows += part
+        if len(rows) > per_page:
+            break
+    return _cursor_page(rows, cursor, per_page, key, backwards)
+
+
+def paginate_by_cursor_or_404(queryset, cursor, per_page, key=CONTRACT_KEY):
+    try:
+        return paginate_by_cursor(queryset, cursor, per_page, key)
+    except InvalidCursor as exc:
+        raise Http404(str(exc))
+
+
+async def apaginate_by_cursor_or_404(queryset, cursor, per_page, key=CONTRACT_KEY):
+    try:
+        return await apaginate_by_cursor(queryset, cursor, per_page, key)
+    except InvalidCursor as exc:
+        raise Http404(str(exc))
@@ -0,0 +1,233 @@
+# contracts_app/reference_sync.py
+"""
+Синхронизация справочников (регионы, районы, исполнители, работы) с внешним
+реестром в CSV/XLSX.
+
+Файл читается потоково (importers.iter_rows), существующие строки справочника
+загружаются одним запросом в словарь по естественному ключу: регион — код,
+а без кода — название; район — (название, регион); исполнитель — ИНН;
+работа — название. Названия сравниваются без учёта регистра. Сравнение идёт
+в памяти, в базу пишутся только новые и изменившиеся строки — bulk_create и
+bulk_update пачками в одной транзакции. Синхронизируются только колонки,
+которые есть в файле. Строки, которых нет в файле, не удаляются, а
+считаются (missing): справочники защищены ссылками из договоров и АК.
+"""
+import re
+from dataclasses import dataclass, field
+
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
+
+from .caching import bump_reference_version
+from .importers import MAX_REPORTED_ERRORS, ImportFormatError
+from .models import District, Implementator, Region, Work
+
+DEFAULT_BATCH_SIZE = 500
+MAX_SAMPLES = 20
+
+_EXCEL_INT_RE = re.compile(r'^\d+\.0$')  # ИНН и коды из числовых ячеек Excel
+
+
+class SyncError(ValueError):
+    """Изменения нельзя применить (например, конфликт уникальности)."""
+
+
+@dataclass(frozen=True)
+class Reference:
+    model: type
+    columns: dict       # заголовок (нижний регистр) -> поле
+    required: tuple
+    fields: tuple       # синхронизируемые поля, кроме ключевого FK
+    keys: tuple         # функции values -> ключ (или None), по порядку приоритета
+
+
+def _casefold(value):
+    return value.casefold() if value else None
+
+
+REFERENCES = {
+    'regions': Reference(
+        model=Region,
+        columns={'name': 'name', 'название': 'name', 'регион': 'name', 'code': 'code', 'код': 'code'},
+        required=('name',),
+        fields=('name', 'code'),
+        keys=(lambda v: v.get('code'), lambda v: _casefold(v['name'])),
+    ),
+    'districts': Reference(
+        model=District,
+        columns={'name': 'name', 'название': 'name', 'район': 'name', 'region': 'region', 'регион': 'region',
+                 'population': 'population', 'население': 'population'},
+        required=('name', 'region'),
+        fields=('name', 'population'),
+        keys=(lambda v: (_casefold(v['name']), v['region_id']),),
+    ),
+    'implementators': Reference(
+        model=Implementator,
+        columns={'inn': 'inn', 'инн': 'inn', 'name': 'name', 'наименование': 'name', 'название': 'name',
+                 'email': 'email', 'e-mail': 'email', 'почта': 'email'},
+        required=('inn', 'name'),
+        fields=('name', 'inn', 'email'),
+        keys=(lambda v: v['inn'],),
+    ),
+    'works': Reference(
+        model=Work,
+        columns={'name': 'name', 'название': 'name', 'работа': 'name'},
+        required=('name',),
+        fields=('name',),
+        keys=(lambda v: _casefold(v['name']),),
+    ),
+}
+
+
+@dataclass
+class SyncResult:
+    rows: int = 0
+    created: int = 0
+    updated: int = 0
+    unchanged: int = 0
+    missing: int = 0    # есть в базе, нет в файле
+    error_count: int = 0
+    errors: list = field(default_factory=list)   # [(номер строки, сообщение)]
+    samples: list = field(default_factory=list)  # первые изменения для отчёта dry-run
+
+    def add_error(self, line, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((line, message))
+
+    def add_sample(self, text):
+        if len(self.samples) < MAX_SAMPLES:
+            self.samples.append(text)
+
+
+def _read_header(reference, header):
+    positions = {}
+    for index, title in enumerate(header):
+        column = reference.columns.get(str(title).strip().lower())
+        if column and column not in positions:
+            positions[column] = index
+    missing = [c for c in reference.required if c not in positions]
+    if missing:
+        raise ImportFormatError(f"В заголовке нет колонок: {', '.join(missing)}.")
+    return positions
+
+
+def _regions_by_name_or_code():
+    regions = {}
+    for pk, name, code in Region.objects.order_by().values_list('pk', 'name', 'code').iterator():
+        regions[name.casefold()] = pk
+        if code:
+            regions[code.casefold()] = pk
+    return regions
+
+
+def _clean_row(reference, positions, row, regions):
+    """{поле: значение} строки файла; ValidationError — строка пропускается."""
+    values = {}
+    for name, index in positions.items():
+        raw = row[index].strip() if index < len(row) and row[index] is not None else ''
+        if _EXCEL_INT_RE.match(raw):
+            raw = raw[:-2]
+        if name == 'region':
+            region_id = regions.get(raw.casefold())
+            if region_id is None:
+                raise ValidationError(f"Регион «{raw}» не найден — сначала синхронизируйте регионы.")
+            values['region_id'] = region_id
+            continue
+        model_field = reference.model._meta.get_field(name)
+        if raw == '' and model_field.null:
+            values[name] = None
+        else:
+            values[name] = model_field.clean(raw, None)
+    return values
+
+
+def _describe(reference, values, changes=None):
+    key = next(filter(None, (key(values) for key in reference.keys)), '')
+    if changes is None:
+        return f"+ {key}: " + ', '.join(f"{name}={value!r}" for name, value in values.items())
+    return f"~ {key}: " + ', '.join(f"{name}: {old!r} → {new!r}" for name, (old, new) in changes.items())
+
+
+def diff(reference, rows, result):
+    """(объекты для bulk_create, объекты для bulk_update, поля для bulk_update) по строкам файла."""
+    rows = iter(rows)
+    try:
+        header = next(rows)
+    except StopIteration:
+        raise ImportFormatError("Файл пуст.")
+    positions = _read_header(reference, header)
+    fields = [name for name in reference.fields if name in positions]
+    regions = _regions_by_name_or_code() if 'region' in positions else {}
+
+    load = ['pk', *fields, *(['region_id'] if 'region' in positions else [])]
+    existing = list(reference.model.objects.order_by().values(*load).iterator())
+    indexes = [{} for _ in reference.keys]
+    for current in existing:
+        for key, index in zip(reference.keys, indexes):
+            value = key(current)
+            if value is not None:
+                index[value] = current
+
+    to_create, to_update, seen = [], [], set()
+    for line, row in enumerate(rows, start=2):
+        if not any(str(cell).strip() for cell in row if cell is not None):
+            continue
+        result.rows += 1
+        try:
+            values = _clean_row(reference, positions, row, regions)
+        except ValidationError as exc:
+            result.add_error(line, ' '.join(exc.messages))
+            continue
+
+        current = None
+        for key, index in zip(reference.keys, indexes):
+            value = key(values)
+            if value is not None and value in index:
+                current = index[value]
+                break
+        if current:
+            identity = ('pk', current['pk'])
+        else:
+            identity = ('new', next(filter(None, (key(values) for key in reference.keys))))
+        if identity in seen:
+            result.add_error(line, "Повтор строки с тем же ключом — пропущена.")
+            continue
+        seen.add(identity)
+
+        if current is None:
+            to_create.append(reference.model(**values))
+            result.created += 1
+            result.add_sample(_describe(reference, values))
+            continue
+        changes = {name: (current[name], values[name]) for name in fields if current[name] != values[name]}
+        if changes:
+            to_update.append(reference.model(pk=current['pk'], **{name: values[name] for name in fields}))
+            result.updated += 1
+            result.add_sample(_describe(reference, values, changes))
+        else:
+            result.unchanged += 1
+    result.missing = sum(1 for current in existing if ('pk', current['pk']) not in seen)
+    return to_create, to_update, fields
+
+
+def sync_reference(name, rows, batch_size=DEFAULT_BATCH_SIZE, dry_run=False):
+    """
+    Приводит справочник name (ключ REFERENCES) к строкам файла (первая — заголовок).
+    dry_run — только посчитать изменения. Возвращает SyncResult.
+    """
+    reference = REFERENCES[name]
+    result = SyncResult()
+    to_create, to_update, fields = diff(reference, rows, result)
+    if dry_run or not (to_create or to_update):
+        return result
+    try:
+        with transaction.atomic():
+            reference.model.objects.bulk_create(to_create, batch_size=batch_size)
+            if to_update:
+                reference.model.objects.bulk_update(to_update, fields, batch_size=batch_size)
+    except IntegrityError as exc:
+        raise SyncError(f"Изменения не применены — конфликт уникальности: {exc}")
+    # bulk-операции идут мимо сигналов: названия в кэше страниц устарели
+    bump_reference_version()
+    return result
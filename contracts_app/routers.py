@@ -0,0 +1,92 @@
+# contracts_app/routers.py
+"""
+Маршрутизация чтения на соединение только для чтения.
+
+Представления, помеченные @read_only (списки, карточка, выгрузки, API),
+читают из алиаса REPLICA_ALIAS, если он настроен; всё остальное, и любая
+запись, идёт в default. Роутер знает только алиасы, поэтому одинаково
+работает с SQLite (тот же файл, открытый в режиме ro) и с PostgreSQL
+(реплика). Флаг хранится в contextvar — работает и в потоках WSGI,
+и в корутинах ASGI.
+
+method_decorator оборачивает асинхронный dispatch синхронной функцией,
+которая возвращает корутину: такой результат read_only не отдаёт сразу,
+а оборачивает в корутину, ставящую флаг на время её выполнения.
+"""
+import asyncio
+from contextvars import ContextVar
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+REPLICA_ALIAS = 'replica'
+
+_read_only = ContextVar('contracts_read_only', default=False)
+
+
+class ReadReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if _read_only.get() and REPLICA_ALIAS in settings.DATABASES:
+            return REPLICA_ALIAS
+        return None
+
+    def db_for_write(self, model, **hints):
+        # Явно: иначе объект, прочитанный из реплики, сохранялся бы туда же
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True  # в обоих алиасах одни и те же данные
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db != REPLICA_ALIAS
+
+
+def _iter_read_only(iterable):
+    previous = _read_only.get()
+    _read_only.set(True)
+    try:
+        yield from iterable
+    finally:
+        _read_only.set(previous)
+
+
+def _streaming_read_only(response):
+    # Потоковый ответ читает базу уже после выхода из представления
+    if getattr(response, 'streaming', False) and not response.is_async:
+        response.streaming_content = _iter_read_only(response.streaming_content)
+    return response
+
+
+async def _await_read_only(coroutine):
+    token = _read_only.set(True)
+    try:
+        return _streaming_read_only(await coroutine)
+    finally:
+        _read_only.reset(token)
+
+
+def read_only(view):
+    """Все чтения представления, включая потоковый ответ, — из реплики."""
+    if iscoroutinefunction(view):
+        @wraps(view)
+        async def inner(*args, **kwargs):
+            token = _read_only.set(True)
+            try:
+                return _streaming_read_only(await view(*args, **kwargs))
+            finally:
+                _read_only.reset(token)
+    else:
+        @wraps(view)
+        def inner(*args, **kwargs):
+            token = _read_only.set(True)
+            try:
+                response = view(*args, **kwargs)
+                if asyncio.iscoroutine(response):
+                    # Флаг снимется в finally раньше, чем корутина выполнится
+                    return _await_read_only(response)
+                return _streaming_read_only(response)
+            finally:
+                _read_only.reset(token)
+    return inner
@@ -0,0 +1,233 @@
+# contracts_app/search.py
+"""
+Полнотекстовый поиск договоров и АК.
+
+На SQLite рядом с таблицей договоров живёт FTS5-таблица (заказчик, ИНН,
+исполнитель), которую синхронизируют триггеры — они срабатывают и на
+bulk-операции, минуя сигналы Django. ИНН ищется по префиксу через
+префиксные индексы FTS5. На других СУБД остаётся прежний поиск icontains.
+
+Адреса АК индексируются отдельной FTS5-таблицей с токенизатором trigram:
+она находит любую подстроку от трёх символов без учёта регистра. Номер АК
+ищется по индексу ak_number_idx: префикс «12» — это диапазоны 12, 120–129,
+1200–1299 и т. д., каждый читается поиском по индексу.
+
+LIKE и lower() в SQLite сворачивают регистр только у латиницы, поэтому для
+названий (автодополнение района) на каждом соединении регистрируется
+функция CASEFOLD — Python str.casefold; на других СУБД Casefold — LOWER.
+"""
+import re
+
+from django.db import connections
+from django.db.models import CharField, Func, Q
+from django.db.models.expressions import RawSQL
+
+from .models import AK, Contract, Implementator
+
+FTS_TABLE = 'contracts_app_contract_fts'
+AK_FTS_TABLE = 'contracts_app_ak_fts'
+
+_CONTRACT = Contract._meta.db_table
+_IMPLEMENTATOR = Implementator._meta.db_table
+_AK = AK._meta.db_table
+
+AK_NUMBER_DIGITS = 8  # см. валидатор AK.number
+TRIGRAM = 3
+
+
+class Casefold(Func):
+    """Строка без учёта регистра, включая кириллицу: сравнивать с value.casefold()."""
+    function = 'LOWER'
+    output_field = CharField()
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        return super().as_sql(compiler, connection, function='CASEFOLD', **extra_context)
+
+
+def _casefold(value):
+    return value.casefold() if isinstance(value, str) else value
+
+
+def register_functions(sender, connection, **kwargs):
+    """connection_created: CASEFOLD для SQLite."""
+    if connection.vendor == 'sqlite':
+        connection.connection.create_function('CASEFOLD', 1, _casefold, deterministic=True)
+
+_INSERT_ROW = f"""
+    INSERT INTO {FTS_TABLE}(rowid, customer_name, customer_inn, implementator)
+    VALUES (new.id, new.customer_name, new.customer_inn,
+            (SELECT name FROM {_IMPLEMENTATOR} WHERE id = new.implementator_id));
+"""
+
+SCHEMA = [
+    f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        customer_name, customer_inn, implementator,
+        tokenize = 'unicode61 remove_diacritics 2',
+        prefix = '2 3 4 6'
+    )
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON {_CONTRACT} BEGIN
+        {_INSERT_ROW}
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au
+    AFTER UPDATE OF customer_name, customer_inn, implementator_id ON {_CONTRACT} BEGIN
+        DELETE FROM {FTS_TABLE} WHERE rowid = old.id;
+        {_INSERT_ROW}
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON {_CONTRACT} BEGIN
+        DELETE FROM {FTS_TABLE} WHERE rowid = old.id;
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_impl_au AFTER UPDATE OF name ON {_IMPLEMENTATOR} BEGIN
+        UPDATE {FTS_TABLE} SET implementator = new.name
+        WHERE rowid IN (SELECT id FROM {_CONTRACT} WHERE implementator_id = new.id);
+    END
+    """,
+    # Адреса АК: внешний контент — текст хранится только в таблице АК
+    f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS {AK_FTS_TABLE} USING fts5(
+        address, content = '{_AK}', content_rowid = 'id', tokenize = 'trigram'
+    )
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {AK_FTS_TABLE}_ai AFTER INSERT ON {_AK} BEGIN
+        INSERT INTO {AK_FTS_TABLE}(rowid, address) VALUES (new.id, new.address);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {AK_FTS_TABLE}_au AFTER UPDATE OF address ON {_AK} BEGIN
+        INSERT INTO {AK_FTS_TABLE}({AK_FTS_TABLE}, rowid, address) VALUES ('delete', old.id, old.address);
+        INSERT INTO {AK_FTS_TABLE}(rowid, address) VALUES (new.id, new.address);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {AK_FTS_TABLE}_ad AFTER DELETE ON {_AK} BEGIN
+        INSERT INTO {AK_FTS_TABLE}({AK_FTS_TABLE}, rowid, address) VALUES ('delete', old.id, old.address);
+    END
+    """,
+]
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def is_supported(using='default'):
+    return connections[using].vendor == 'sqlite'
+
+
+def create_search_index(using='default', **kwargs):
+    """Создаёт FTS-таблицу и триггеры (идемпотентно). Вызывается после migrate."""
+    if not is_supported(using):
+        return
+    with connections[using].cursor() as cursor:
+        for statement in SCHEMA:
+            cursor.execute(statement)
+
+
+def rebuild_search_index(using='default'):
+    """Полностью перестраивает индекс по текущим данным. Возвращает число строк."""
+    create_search_index(using)
+    with connections[using].cursor() as cursor:
+        cursor.execute(f"DELETE FROM {FTS_TABLE}")
+        cursor.execute(f"""
+            INSERT INTO {FTS_TABLE}(rowid, customer_name, customer_inn, implementator)
+            SELECT c.id, c.customer_name, c.customer_inn, i.name
+            FROM {_CONTRACT} c JOIN {_IMPLEMENTATOR} i ON i.id = c.implementator_id
+        """)
+        cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('optimize')")
+        cursor.execute(f"SELECT count(*) FROM {FTS_TABLE}")
+        return cursor.fetchone()[0]
+
+
+def rebuild_ak_search_index(using='default'):
+    """Перестраивает индекс адресов АК по таблице АК. Возвращает число АК."""
+    create_search_index(using)
+    with connections[using].cursor() as cursor:
+        cursor.execute(f"INSERT INTO {AK_FTS_TABLE}({AK_FTS_TABLE}) VALUES ('rebuild')")
+        cursor.execute(f"INSERT INTO {AK_FTS_TABLE}({AK_FTS_TABLE}) VALUES ('optimize')")
+        cursor.execute(f"SELECT count(*) FROM {_AK}")
+        return cursor.fetchone()[0]
+
+
+def build_match_query(query):
+    """'ромашка 7701' -> '"ромашка"* "7701"*' : все слова, каждое — по префиксу."""
+    return ' '.join(f'"{token}"*' for token in _TOKEN_RE.findall(query))
+
+
+def search_contracts(queryset, query):
+    """Фильтрует договоры по строке поиска; на SQLite — с ранжированием bm25."""
+    if not is_supported(queryset.db):
+        return queryset.filter(
+            Q(customer_name__icontains=query) |
+            Q(customer_inn__icontains=query) |
+            Q(implementator__name__icontains=query)
+        )
+
+    match = build_match_query(query)
+    if not match:
+        return queryset
+    ordering = queryset.query.order_by or Contract._meta.ordering
+    return queryset.filter(
+        pk__in=RawSQL(f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s", (match,))
+    ).annotate(
+        search_rank=RawSQL(
+            f"SELECT rank FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s AND rowid = {_CONTRACT}.id",
+            (match,),
+        )
+    ).order_by('search_rank', *ordering)
+
+
+def number_prefix_ranges(prefix):
+    """
+    '12' -> [(12, 12), (120, 129), (1200, 1299), ...] до AK_NUMBER_DIGITS цифр:
+    диапазоны идут по возрастанию и не пересекаются. Не число — None.
+    """
+    if not prefix.isdigit() or prefix.startswith('0') or len(prefix) > AK_NUMBER_DIGITS:
+        return None
+    value = int(prefix)
+    return [
+        (value * 10 ** extra, (value + 1) * 10 ** extra - 1)
+        for extra in range(AK_NUMBER_DIGITS - len(prefix) + 1)
+    ]
+
+
+def has_trigram(address):
+    """Есть ли в строке слово, которое можно искать по индексу адресов."""
+    return any(len(token) >= TRIGRAM for token in _TOKEN_RE.findall(address))
+
+
+def search_ak_addresses(queryset, address):
+    """
+    АК, в адресе которых есть все слова запроса (подстрокой, без учёта регистра).
+    Слова короче трёх символов (номер дома, «д.») индекс trigram не ищет — они
+    проверяются LIKE по строкам, уже найденным по длинным словам.
+    """
+    tokens = _TOKEN_RE.findall(address)
+    short = [token for token in tokens if len(token) < TRIGRAM]
+    if not is_supported(queryset.db) or len(short) == len(tokens):
+        short = tokens
+    else:
+        match = ' '.join(f'"{token}"' for token in tokens if len(token) >= TRIGRAM)
+        queryset = queryset.filter(
+            pk__in=RawSQL(f"SELECT rowid FROM {AK_FTS_TABLE} WHERE {AK_FTS_TABLE} MATCH %s", (match,))
+        )
+    for token in short:
+        queryset = queryset.filter(address__icontains=token)
+    return queryset
+
+
+def filter_contracts(queryset, params):
+    """Фильтры списка договоров (?q=&status=) — общие для списка, экспорта и API."""
+    query = params.get('q')
+    status = params.get('status')
+    if query:
+        queryset = search_contracts(queryset, query)
+    if status:
+        queryset = queryset.filter_status(status)
+    return queryset
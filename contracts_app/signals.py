@@ -0,0 +1,180 @@
+# contracts_app/signals.py
+from collections import Counter
+from functools import partial
+
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import post_init, pre_save, post_save, pre_delete, post_delete
+from django.dispatch import receiver
+
+from . import caching, history, summary
+from .models import Contract, AK, Implementator, District, Region, StoredFile
+from .storage import contract_storage
+
+FILE_FIELDS = ('file1', 'file2', 'file3')
+
+
+# === Счётчики ссылок на файлы договоров ===
+def _file_names(values):
+    return Counter(name for name in values if name)
+
+
+def _release(names):
+    """Уменьшает счётчики; файлы без ссылок удаляются после коммита (_delete_orphans)."""
+    for name, count in names.items():
+        StoredFile.objects.filter(name=name, ref_count__gte=count).update(ref_count=F('ref_count') - count)
+    orphans = list(StoredFile.objects.filter(name__in=list(names), ref_count=0).values_list('name', flat=True))
+    if orphans:
+        transaction.on_commit(partial(_delete_orphans, orphans))
+
+
+def _delete_orphans(names):
+    # Параллельная загрузка того же документа могла снова сослаться на файл:
+    # ссылки перепроверяются под блокировкой строки, которую ждёт и _acquire
+    for name in names:
+        with transaction.atomic():
+            stored = StoredFile.objects.select_for_update().filter(name=name).first()
+            if stored is None or stored.ref_count:
+                continue
+            stored.delete()
+            contract_storage.delete(name)
+
+
+def _size(name):
+    return contract_storage.size(name) if contract_storage.exists(name) else 0
+
+
+def _acquire(names):
+    for name, count in names.items():
+        stored, created = StoredFile.objects.get_or_create(name=name, defaults={'size': _size(name), 'ref_count': count})
+        if not created and not StoredFile.objects.filter(pk=stored.pk).update(ref_count=F('ref_count') + count):
+            # Строку только что удалила очистка — файл создаётся заново
+            StoredFile.objects.create(name=name, size=_size(name), ref_count=count)
+        # Ссылка учтена, очистка файл больше не тронет; если успела раньше — записать заново
+        contract_storage.ensure_exists(name)
+
+
+@receiver(pre_save, sender=Contract)
+def remember_contract_files(sender, instance, raw=False, **kwargs):
+    old = None
+    if instance.pk and not raw:
+        old = Contract.objects.filter(pk=instance.pk).values_list(*FILE_FIELDS).first()
+    instance._files_before = _file_names(old or ())
+
+
+@receiver(post_save, sender=Contract)
+def count_contract_files(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    before = getattr(instance, '_files_before', Counter())
+    after = _file_names(getattr(instance, name).name for name in FILE_FIELDS)
+    _acquire(after - before)
+    _release(before - after)
+    instance._files_before = after
+
+
+@receiver(post_delete, sender=Contract)
+def release_contract_files(sender, instance, **kwargs):
+    _release(_file_names(getattr(instance, name).name for name in FILE_FIELDS))
+
+
+# === Сброс кэша страниц (см. caching.py) ===
+@receiver(post_save, sender=Contract)
+@receiver(post_delete, sender=Contract)
+def contract_changed(sender, **kwargs):
+    caching.bump_list_version()
+
+
+@receiver(post_save, sender=AK)
+@receiver(post_delete, sender=AK)
+def ak_changed(sender, instance, origin=None, **kwargs):
+    if isinstance(origin, Contract):
+        return  # каскадное удаление вместе с договором — его сигнал уже сбросит кэш
+    caching.invalidate_contracts([instance.contract_id])
+
+
+# === Сводки для дашборда (см. summary.py) ===
+@receiver(pre_save, sender=Contract)
+@receiver(pre_delete, sender=Contract)
+def contract_summary_before(sender, instance, raw=False, **kwargs):
+    instance._summary_before = summary.before_change([instance.pk]) if instance.pk and not raw else None
+
+
+@receiver(post_save, sender=Contract)
+@receiver(post_delete, sender=Contract)
+def contract_summary_after(sender, instance, created=False, raw=False, **kwargs):
+    if not raw:
+        summary.after_change([instance.pk], instance._summary_before, created=created)
+
+
+@receiver(pre_save, sender=AK)
+@receiver(pre_delete, sender=AK)
+def ak_summary_before(sender, instance, raw=False, origin=None, **kwargs):
+    if raw or isinstance(origin, Contract):
+        return  # при каскадном удалении договор уже учтён своим сигналом
+    instance._summary_before = summary.before_change([instance.contract_id])
+
+
+@receiver(post_save, sender=AK)
+@receiver(post_delete, sender=AK)
+def ak_summary_after(sender, instance, raw=False, origin=None, **kwargs):
+    if raw or isinstance(origin, Contract):
+        return
+    summary.after_change([instance.contract_id], instance._summary_before)
+
+
+@receiver(pre_save, sender=District)
+def district_region_before(sender, instance, raw=False, **kwargs):
+    instance._region_before = None
+    if instance.pk and not raw:
+        instance._region_before = District.objects.filter(pk=instance.pk).values_list('region_id', flat=True).first()
+
+
+@receiver(post_save, sender=District)
+def district_region_after(sender, instance, created=False, raw=False, **kwargs):
+    # Перенос района в другой регион (редкая правка справочника) — пересчитать сводки целиком
+    if not (created or raw) and instance._region_before != instance.region_id:
+        transaction.on_commit(summary.rebuild)
+
+
+@receiver(post_save, sender=Implementator)
+@receiver(post_delete, sender=Implementator)
+@receiver(post_save, sender=District)
+@receiver(post_delete, sender=District)
+@receiver(post_save, sender=Region)
+@receiver(post_delete, sender=Region)
+def reference_changed(sender, **kwargs):
+    caching.bump_reference_version()
+
+
+# === История изменений (см. history.py) ===
+@receiver(post_init, sender=Contract)
+@receiver(post_init, sender=AK)
+def history_remember(sender, instance, **kwargs):
+    history.remember(instance)
+
+
+@receiver(pre_save, sender=Contract)
+@receiver(pre_save, sender=AK)
+def history_before(sender, instance, raw=False, using=None, **kwargs):
+    if not raw:
+        history.load_before(instance, using)
+
+
+@receiver(post_save, sender=Contract)
+@receiver(post_save, sender=AK)
+def history_saved(sender, instance, created=False, raw=False, **kwargs):
+    if raw:
+        return
+    if created:
+        history.created(instance)
+    else:
+        history.updated(instance)
+
+
+@receiver(post_delete, sender=Contract)
+@receiver(post_delete, sender=AK)
+def history_deleted(sender, instance, origin=None, **kwargs):
+    if sender is AK and isinstance(origin, Contract):
+        return  # АК, удалённые вместе с договором, — в записи об удалении договора
+    history.deleted(instance)
@@ -0,0 +1,48 @@
+# contracts_app/status.py
+"""
+Массовое обновление Contract.status.
+
+Статус вычисляется в Contract.save(), поэтому у договора, срок которого
+истёк, он остаётся «Действует», пока договор не пересохранят. Здесь статус
+переключается пачками: id пачки выбираются по индексу (status, end_date),
+затем один UPDATE ... WHERE id IN (...) на пачку, без загрузки моделей.
+Сводки дашборда (summary.py) обновляются разницей по той же пачке.
+Вызывается командой refresh_contract_statuses (cron) или из планировщика.
+"""
+from django.db import transaction
+from django.utils import timezone
+
+from . import summary
+from .caching import bump_list_version
+from .models import Contract
+
+DEFAULT_BATCH_SIZE = 5000
+
+
+def refresh_statuses(batch_size=DEFAULT_BATCH_SIZE, today=None, using='default'):
+    """Приводит status в соответствие с end_date. Возвращает {статус: число строк}."""
+    today = today or timezone.now().date()
+    now = timezone.now()
+    updated = {}
+    for status, stale in (
+        ('completed', {'status': 'active', 'end_date__lt': today}),
+        ('active', {'status': 'completed', 'end_date__gte': today}),
+    ):
+        total = 0
+        while True:
+            batch = list(Contract.objects.using(using).filter(**stale).order_by().values_list('pk', flat=True)[:batch_size])
+            with transaction.atomic(using=using), summary.deferred():
+                summary.track(batch)  # статус входит в сводки дашборда
+                rows = Contract.objects.using(using).filter(pk__in=batch).update(status=status, updated_at=now)
+            total += rows
+            if rows < batch_size:
+                break
+        updated[status] = total
+    if any(updated.values()):
+        bump_list_version()
+    return updated
+
+
+def scheduled_refresh():
+    """Точка входа для планировщика (cron, APScheduler, Celery beat)."""
+    return refresh_statuses()
@@ -0,0 +1,107 @@
+# contracts_app/storage.py
+"""
+Хранилище файлов договоров с адресацией по содержимому.
+
+Файл сохраняется под именем из своего SHA-256 (contracts/files/ab/<hash>.pdf):
+при записи он потоково копируется кусками и одновременно хешируется, а
+загрузка, уже лежащая во временном файле, хешируется чтением и переносится
+без копирования. Одинаковые документы хранятся один раз; сколько договоров
+ссылается на файл, учитывает StoredFile.ref_count (см. signals.py).
+
+Файл без ссылок удаляется после коммита, а параллельная загрузка того же
+документа могла уже получить его имя. Поэтому storage помнит содержимое
+своих записей в потоке, и после учёта ссылки ensure_exists() записывает
+файл заново, если его успели удалить. Содержимое помнится только на время
+Contract.save(): forget_saved() в finally отпускает его и при ошибке.
+"""
+import hashlib
+import os
+import tempfile
+import threading
+
+from django.core.files.move import file_move_safe
+from django.core.files.storage import FileSystemStorage
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+class ContentAddressedStorage(FileSystemStorage):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._local = threading.local()
+
+    def _saved(self):
+        """{имя: содержимое} записей этого потока, ещё не подтверждённых ensure_exists()."""
+        if not hasattr(self._local, 'saved'):
+            self._local.saved = {}
+        return self._local.saved
+
+    def get_available_name(self, name, max_length=None):
+        # Итоговое имя определяет содержимое, а не свободные имена в каталоге
+        return name
+
+    def _hashed_name(self, name, digest):
+        directory = os.path.dirname(name)
+        extension = os.path.splitext(name)[1].lower()
+        return os.path.join(directory, digest[:2], f"{digest}{extension}").replace('\\', '/')
+
+    def _save(self, name, content):
+        directory = os.path.dirname(self.path(name))
+        os.makedirs(directory, exist_ok=True)
+        digest = hashlib.sha256()
+
+        if hasattr(content, 'temporary_file_path'):
+            source = content.temporary_file_path()
+            with open(source, 'rb') as f:
+                for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+                    digest.update(chunk)
+            move = True
+        else:
+            fd, source = tempfile.mkstemp(dir=directory, prefix='.upload-')
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in content.chunks(HASH_CHUNK_SIZE):
+                    digest.update(chunk)
+                    f.write(chunk)
+            move = False
+
+        final_name = self._hashed_name(name, digest.hexdigest())
+        final_path = self.path(final_name)
+        self._saved()[final_name] = content
+        if os.path.exists(final_path):
+            # Такой документ уже есть — второй экземпляр не нужен
+            if not move:
+                os.remove(source)
+            return final_name
+
+        os.makedirs(os.path.dirname(final_path), exist_ok=True)
+        if move:
+            file_move_safe(source, final_path)
+        else:
+            os.replace(source, final_path)
+        if self.file_permissions_mode is not None:
+            os.chmod(final_path, self.file_permissions_mode)
+        return final_name
+
+    def ensure_exists(self, name):
+        """
+        После учёта ссылки на name: если файл удалила очистка без ссылок
+        (signals._delete_orphans), записать его заново из содержимого _save.
+        """
+        content = self._saved().pop(name, None)
+        if content is None or self.exists(name):
+            return
+        path = self.path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            for chunk in content.chunks(HASH_CHUNK_SIZE):
+                f.write(chunk)
+        if self.file_permissions_mode is not None:
+            os.chmod(path, self.file_permissions_mode)
+
+    def forget_saved(self):
+        """Отпустить содержимое записей потока (сохранение модели завершилось или упало)."""
+        self._saved().clear()
+
+
+contract_storage = ContentAddressedStorage()
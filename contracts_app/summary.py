@@ -0,0 +1,169 @@
+# contracts_app/summary.py
+"""
+Сводки для дашборда: действующие договоры и АК по регионам, районам и
+исполнителям, все договоры по месяцу окончания.
+
+Сводные таблицы обновляются по разнице: перед изменением договора или его
+АК снимается «вклад» договора (статус, исполнитель, месяц окончания, число
+АК по районам), после — ещё раз, и к затронутым строкам сводок прибавляется
+разница одним UPDATE ... SET x = x + d на строку. Снимок — два запроса по
+индексам договора, без GROUP BY по всей таблице АК.
+
+Массовые операции (формсет, импорт, refresh_statuses) оборачиваются в
+deferred(): снимки «до» берутся один раз на договор, разница применяется
+в конце. «Действующий» — по сохранённому полю status, которое ежедневно
+обновляет refresh_statuses. rebuild() пересчитывает всё с нуля.
+"""
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+
+from django.db import transaction
+from django.db.models import Count, F
+from django.db.models.functions import TruncMonth
+
+from .models import AK, Contract, DistrictSummary, ExpirySummary, ImplementatorSummary, RegionSummary
+
+SUMMARY_MODELS = (RegionSummary, DistrictSummary, ImplementatorSummary, ExpirySummary)
+
+# {pk договора: снимок до изменений или None} внутри deferred(), иначе None
+_pending = ContextVar('contracts_summary_pending', default=None)
+
+
+@dataclass
+class Snapshot:
+    active: bool
+    implementator_id: int
+    month: object
+    districts: Counter = field(default_factory=Counter)  # (district_id, region_id) -> число АК
+
+
+def snapshots(pks):
+    """{pk: Snapshot} для существующих договоров из pks."""
+    result = {
+        pk: Snapshot(status == 'active', implementator_id, end_date.replace(day=1))
+        for pk, status, implementator_id, end_date in Contract.objects.filter(pk__in=pks).order_by()
+        .values_list('pk', 'status', 'implementator_id', 'end_date')
+    }
+    aks = (AK.objects.filter(contract_id__in=pks).order_by()
+           .values('contract_id', 'district_id', 'district__region_id').annotate(n=Count('id'))
+           .values_list('contract_id', 'district_id', 'district__region_id', 'n'))
+    for contract_id, district_id, region_id, count in aks:
+        result[contract_id].districts[(district_id, region_id)] = count
+    return result
+
+
+def _add(deltas, snapshot, sign):
+    total = sum(snapshot.districts.values())
+    deltas[ExpirySummary, snapshot.month] += (sign, sign * total)
+    if not snapshot.active:
+        return
+    deltas[ImplementatorSummary, snapshot.implementator_id] += (sign, sign * total)
+    regions = Counter()
+    for (district_id, region_id), count in snapshot.districts.items():
+        deltas[DistrictSummary, district_id] += (sign, sign * count)
+        regions[region_id] += count
+    for region_id, count in regions.items():
+        deltas[RegionSummary, region_id] += (sign, sign * count)
+
+
+class _Delta:
+    __slots__ = ('contracts', 'aks')
+
+    def __init__(self):
+        self.contracts = self.aks = 0
+
+    def __iadd__(self, pair):
+        self.contracts += pair[0]
+        self.aks += pair[1]
+        return self
+
+
+def apply(before, after):
+    """Прибавляет к сводкам разницу между снимками {pk: Snapshot | None}."""
+    deltas = defaultdict(_Delta)
+    for snapshot in before.values():
+        if snapshot:
+            _add(deltas, snapshot, -1)
+    for snapshot in after.values():
+        _add(deltas, snapshot, 1)
+    with transaction.atomic():
+        for (model, key), delta in deltas.items():
+            if not (delta.contracts or delta.aks):
+                continue
+            updated = model.objects.filter(pk=key).update(
+                contracts=F('contracts') + delta.contracts, aks=F('aks') + delta.aks
+            )
+            if not updated:
+                model.objects.create(pk=key, contracts=delta.contracts, aks=delta.aks)
+
+
+def track(pks, created=False):
+    """Внутри deferred(): запомнить состояние договоров до изменений (один раз на договор)."""
+    pending = _pending.get()
+    new = [pk for pk in pks if pk not in pending]
+    if created:
+        pending.update(dict.fromkeys(new))
+    elif new:
+        taken = snapshots(new)
+        pending.update({pk: taken.get(pk) for pk in new})
+
+
+@contextmanager
+def deferred():
+    """Копит изменения договоров и применяет разницу сводок один раз при выходе."""
+    if _pending.get() is not None:
+        yield  # вложенный вызов — применит внешний
+        return
+    token = _pending.set({})
+    try:
+        yield
+        pending = _pending.get()
+        if pending:
+            apply(pending, snapshots(list(pending)))
+    finally:
+        _pending.reset(token)
+
+
+# === Точки входа для сигналов ===
+def before_change(pks):
+    """pre_save/pre_delete: снимок «до» (вне deferred() — для after_change)."""
+    if _pending.get() is not None:
+        track(pks)
+        return None
+    return snapshots(pks)
+
+
+def after_change(pks, before, created=False):
+    """post_save/post_delete: вне deferred() — сразу применить разницу."""
+    if _pending.get() is not None:
+        track(pks, created=created)
+        return
+    apply(before or {}, snapshots(pks))
+
+
+# === Полный пересчёт ===
+def rebuild():
+    """Пересчитывает все сводки GROUP BY-запросами. Возвращает {модель: строк}."""
+    active_aks = AK.objects.filter(contract__status='active').order_by()
+    active_contracts = Contract.objects.filter(status='active').order_by()
+    sources = {
+        DistrictSummary: active_aks.values(key=F('district_id')).annotate(
+            c=Count('contract_id', distinct=True), a=Count('id')),
+        RegionSummary: active_aks.values(key=F('district__region_id')).annotate(
+            c=Count('contract_id', distinct=True), a=Count('id')),
+        ImplementatorSummary: active_contracts.values(key=F('implementator_id')).annotate(
+            c=Count('id', distinct=True), a=Count('aks')),
+        ExpirySummary: Contract.objects.order_by().values(key=TruncMonth('end_date')).annotate(
+            c=Count('id', distinct=True), a=Count('aks')),
+    }
+    counts = {}
+    with transaction.atomic():
+        for model, rows in sources.items():
+            model.objects.all().delete()
+            created = model.objects.bulk_create(
+                model(pk=row['key'], contracts=row['c'], aks=row['a']) for row in rows.iterator()
+            )
+            counts[model._meta.verbose_name_plural] = len(created)
+    return counts
@@ -1,3 +1,1551 @@
-from django.test import TestCase
+import json
+import os
+import shutil
+import tempfile
+import zipfile
+from datetime import date, timedelta
+from unittest import mock
+from io import BytesIO, StringIO
+from urllib.parse import urlencode
+
+from asgiref.sync import async_to_sync
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Permission
+from django.core.cache import cache
+from django.core import mail
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connection, connections, transaction
+from django.db.models import Q
+from django.test import AsyncClient, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.http import StreamingHttpResponse
+from django.urls import reverse
+from openpyxl import Workbook, load_workbook
+
+from . import benchmarks, exports, history, loadtest, metrics, summary, views
+from .models import (
+    Region, District, Implementator, Work, Contract, AK, StoredFile, ExpiryNotification, RegionSummary, ChangeRecord,
+)
+from .downloads import parse_range
+from .forms import AKFormSet
+from .pagination import encode_cursor
+from .importers import import_aks
+from .reference_sync import SyncError, sync_reference
+from .notifications import send_expiry_notifications, due_contracts
+from .storage import contract_storage
+from .routers import REPLICA_ALIAS, ReadReplicaRouter, read_only
+from .search import number_prefix_ranges, search_ak_addresses, search_contracts
+from .status import refresh_statuses
+
+
+def make_contracts(count, aks_per_contract=3):
+    region = Region.objects.create(name="Тестовый регион", code="99")
+    district = District.objects.create(name="Тестовый район", region=region)
+    implementator = Implementator.objects.create(name="ООО Исполнитель", inn="1234567890")
+    today = date.today()
+    contracts = []
+    for i in range(count):
+        contract = Contract.objects.create(
+            customer_name=f"Заказчик {i}",
+            customer_inn=f"{7700000000 + i}",
+            start_date=today - timedelta(days=i),
+            end_date=today + timedelta(days=365),
+            implementator=implementator,
+            file1=f"contracts/files/scan{i}.pdf",
+        )
+        AK.objects.bulk_create(
+            AK(contract=contract, number=n, district=district, address=f"ул. Ленина, {n}")
+            for n in range(1, aks_per_contract + 1)
+        )
+        contracts.append(contract)
+    return contracts
+
+
+def make_viewer(username='viewer'):
+    """Пользователь с правом просмотра договоров — ему доступны вложения."""
+    user = get_user_model().objects.create_user(username)
+    user.user_permissions.add(Permission.objects.get(codename='view_contract', content_type__app_label='contracts_app'))
+    return user
+
+
+class ContractsTestCase(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # replica — зеркало default, но отдельное соединение не видит данных из
+        # транзакции теста: на время теста оба алиаса работают через одно соединение
+        cls._replica_connection = connections[REPLICA_ALIAS]
+        connections[REPLICA_ALIAS] = connections[DEFAULT_DB_ALIAS]
+
+    @classmethod
+    def tearDownClass(cls):
+        connections[REPLICA_ALIAS] = cls._replica_connection
+        super().tearDownClass()
+
+    def setUp(self):
+        # Кэш страниц не откатывается вместе с транзакцией теста
+        cache.clear()
+
+
+class QueryBudgetMixin:
+    def assertMaxQueries(self, budget, func, *args, **kwargs):
+        with CaptureQueriesContext(connection) as ctx:
+            result = func(*args, **kwargs)
+        self.assertLessEqual(
+            len(ctx), budget,
+            f"Превышен бюджет запросов: {len(ctx)} > {budget}\n"
+            + "\n".join(q['sql'] for q in ctx.captured_queries),
+        )
+        return result
+
+
+class QueryBudgetTests(QueryBudgetMixin, ContractsTestCase):
+    """Число запросов на страницу не должно зависеть от числа договоров и АК."""
+
+    LIST_BUDGET = 4      # версии кэша + count (только при поиске) + договоры + АК
+    DETAIL_BUDGET = 3    # updated_at для ETag + договор + АК
+    ADMIN_BUDGET = 6    # сессия, пользователь, фильтр исполнителей, 2 count, строки
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.contracts = make_contracts(10)
+        cls.admin = get_user_model().objects.create_superuser('admin', 'admin@example.com', 'pass')
+
+    def test_contract_list(self):
+        response = self.assertMaxQueries(self.LIST_BUDGET, self.client.get, reverse('contracts:contract_list'))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "3 АК")
+
+    def test_contract_list_search(self):
+        response = self.assertMaxQueries(
+            self.LIST_BUDGET, self.client.get, reverse('contracts:contract_list'), {'q': 'Заказчик', 'status': 'active'}
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_contract_detail(self):
+        url = reverse('contracts:contract_detail', args=[self.contracts[0].pk])
+        response = self.assertMaxQueries(self.DETAIL_BUDGET, self.client.get, url)
+        self.assertContains(response, "Абонентские комплекты (3)")
+
+    def test_admin_changelist(self):
+        self.client.force_login(self.admin)
+        url = reverse('admin:contracts_app_contract_changelist')
+        response = self.assertMaxQueries(self.ADMIN_BUDGET, self.client.get, url)
+        self.assertEqual(response.status_code, 200)
+
+    def test_admin_changelist_sorted_by_counts(self):
+        self.client.force_login(self.admin)
+        url = reverse('admin:contracts_app_contract_changelist')
+        for column in (6, 7):  # file_count, ak_count
+            response = self.assertMaxQueries(self.ADMIN_BUDGET, self.client.get, url, {'o': f'-{column}'})
+            self.assertEqual(response.status_code, 200)
+
+    def test_admin_region_changelist(self):
+        self.client.force_login(self.admin)
+        url = reverse('admin:contracts_app_region_changelist')
+        response = self.assertMaxQueries(5, self.client.get, url, {'o': '-3'})
+        self.assertContains(response, '<td class="field-district_count">1</td>', html=True)
+
+    def test_admin_change_form_paginates_aks(self):
+        contract = self.contracts[0]
+        Contract.objects.filter(pk=contract.pk).update(file1='')  # файла-заглушки нет на диске
+        district = District.objects.get()
+        AK.objects.bulk_create(AK(contract=contract, number=n, district=district, address="ул. Мира")
+                               for n in range(100, 220))
+        self.client.force_login(self.admin)
+        url = reverse('admin:contracts_app_contract_change', args=[contract.pk])
+        # сессия, пользователь, договор, count и страница АК, автокомплиты — не по запросу на строку
+        response = self.assertMaxQueries(10, self.client.get, url, {'ak_page': 3})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['inline_admin_formsets'][0].formset.initial_form_count(), 23)
+        self.assertContains(response, 'АК 101–123 из 123')
+        self.assertNotContains(response, '<option value="%d">' % district.pk)
+
+        data = {
+            'customer_name': contract.customer_name, 'customer_inn': contract.customer_inn,
+            'start_date': contract.start_date, 'end_date': contract.end_date,
+            'implementator': contract.implementator_id,
+            'aks-TOTAL_FORMS': 23, 'aks-INITIAL_FORMS': 23, 'aks-MIN_NUM_FORMS': 0, 'aks-MAX_NUM_FORMS': 500,
+        }
+        for i, ak in enumerate(AK.objects.filter(contract=contract).order_by('number')[100:]):
+            data.update({f'aks-{i}-id': ak.pk, f'aks-{i}-contract': contract.pk, f'aks-{i}-number': ak.number,
+                         f'aks-{i}-district': district.pk, f'aks-{i}-address': "ул. Мира"})
+        data['aks-0-DELETE'] = 'on'
+        response = self.client.post(f'{url}?ak_page=3', data)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(contract.aks.count(), 122)
+
+
+class ContractSearchTests(ContractsTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.contracts = make_contracts(3, aks_per_contract=0)
+        cls.romashka = cls.contracts[0]
+        cls.romashka.customer_name = "ООО Ромашка и партнёры"
+        cls.romashka.save()
+
+    def search(self, query):
+        response = self.client.get(reverse('contracts:contract_list'), {'q': query})
+        return list(response.context['contracts'])
+
+    def test_matches_name_prefix_case_insensitive(self):
+        self.assertEqual(self.search("ромаш"), [self.romashka])
+
+    def test_matches_inn_prefix(self):
+        self.assertEqual(self.search("7700000002"), [self.contracts[2]])
+        self.assertEqual(len(self.search("770")), 3)
+
+    def test_tracks_implementator_rename(self):
+        Implementator.objects.update(name="АО Василёк")
+        self.assertEqual(len(self.search("Василёк")), 3)
+
+    def test_deleted_contract_is_not_found(self):
+        self.contracts[1].delete()
+        self.assertEqual(len(self.search("Заказчик")), 1)
+
+    def test_rebuild_command(self):
+        out = StringIO()
+        call_command('rebuild_search_index', stdout=out)
+        self.assertIn("3", out.getvalue())
+        self.assertEqual(self.search("ромашка"), [self.romashka])
+
+
+class AKSearchTests(QueryBudgetMixin, ContractsTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.contracts = make_contracts(2, aks_per_contract=0)
+        cls.district = District.objects.get()
+        cls.other = District.objects.create(name="Северный", region=Region.objects.create(name="Другой регион"))
+        AK.objects.bulk_create([
+            AK(contract=cls.contracts[0], number=12, district=cls.district, address="ул. Ленина, д. 5"),
+            AK(contract=cls.contracts[0], number=125, district=cls.district, address="ул. Садовая, д. 15"),
+            AK(contract=cls.contracts[1], number=12, district=cls.other, address="пр. Мира, д. 7"),
+            AK(contract=cls.contracts[1], number=1300, district=cls.other, address="ул. Ленина, д. 15"),
+            AK(contract=cls.contracts[1], number=3, district=cls.other, address="ул. Набережная, д. 12"),
+        ])
+
+    def search(self, **params):
+        response = self.client.get(reverse('contracts:ak_search'), {**params, 'format': 'json'})
+        self.assertEqual(response.status_code, 200, response.content)
+        return [(ak['number'], ak['address']) for ak in response.json()['results']]
+
+    def test_number_prefix_ranges(self):
+        self.assertEqual(number_prefix_ranges('1234567')[:2], [(1234567, 1234567), (12345670, 12345679)])
+        self.assertEqual(len(number_prefix_ranges('1')), 8)
+        for invalid in ('012', 'abc', '123456789'):
+            self.assertIsNone(number_prefix_ranges(invalid))
+
+    def test_number_exact_and_prefix_across_contracts(self):
+        self.assertEqual([n for n, _ in self.search(number='12')], [12, 12, 125])
+        self.assertEqual([n for n, _ in self.search(number='1')], [12, 12, 125, 1300])
+        self.assertEqual(self.search(number='1300'), [(1300, "ул. Ленина, д. 15")])
+
+    def test_address_substring_case_insensitive(self):
+        self.assertEqual(len(self.search(address="ленин")), 2)
+        self.assertEqual(self.search(address="ЛЕНИНА 15"), [(1300, "ул. Ленина, д. 15")])
+        self.assertEqual(self.search(address="бережн"), [(3, "ул. Набережная, д. 12")])
+
+    def test_index_follows_address_changes(self):
+        ak = AK.objects.get(number=3)
+        ak.address = "ул. Лесная, д. 1"
+        ak.save()
+        self.assertEqual(self.search(address="набережная"), [])
+        self.assertEqual(self.search(address="лесная"), [(3, "ул. Лесная, д. 1")])
+        ak.delete()
+        self.assertEqual(self.search(address="лесная"), [])
+
+    def test_district_and_region_filters(self):
+        self.assertEqual(self.search(number='12', district=self.other.pk), [(12, "пр. Мира, д. 7")])
+        self.assertEqual(len(self.search(address="ленина", region=self.other.region_id)), 1)
+
+    def test_cursor_pages_follow_number_ranges(self):
+        per_page, views.AK_SEARCH_PER_PAGE = views.AK_SEARCH_PER_PAGE, 2
+        self.addCleanup(setattr, views, 'AK_SEARCH_PER_PAGE', per_page)
+        url = reverse('contracts:ak_search')
+        first = self.client.get(url, {'number': '1', 'format': 'json'}).json()
+        second = self.client.get(url, {'number': '1', 'format': 'json', 'cursor': first['next_cursor']}).json()
+        self.assertEqual([ak['number'] for ak in first['results'] + second['results']], [12, 12, 125, 1300])
+        self.assertIsNone(second['next_cursor'])
+        back = self.client.get(url, {'number': '1', 'format': 'json', 'cursor': second['previous_cursor']}).json()
+        self.assertEqual(back['results'], first['results'])
+
+    def test_validation(self):
+        url = reverse('contracts:ak_search')
+        self.assertEqual(self.client.get(url, {'number': '01', 'format': 'json'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'address': 'д 5', 'format': 'json'}).status_code, 400)
+        self.assertEqual(self.search(), [])
+
+    def test_page(self):
+        response = self.assertMaxQueries(3, self.client.get, reverse('contracts:ak_search'), {'address': "ленина"})
+        self.assertContains(response, "ул. Ленина, д. 5")
+        self.assertContains(response, reverse('contracts:contract_detail', args=[self.contracts[1].pk]))
+
+
+class ReferenceSyncTests(QueryBudgetMixin, ContractsTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.moscow = Region.objects.create(name="Москва", code="77")
+        cls.tver = Region.objects.create(name="Тверская область")
+        cls.district = District.objects.create(name="Центральный", region=cls.moscow, population=100)
+        cls.implementator = Implementator.objects.create(name="ООО Старое", inn="7700000001", email="old@example.com")
+
+    def test_regions_by_code_then_name(self):
+        rows = [['Код', 'Название'], ['77', 'г. Москва'], ['69', 'тверская область'], ['50', 'Московская область']]
+        result = sync_reference('regions', rows)
+        self.assertEqual((result.created, result.updated, result.unchanged, result.missing), (1, 2, 0, 0))
+        self.moscow.refresh_from_db()
+        self.tver.refresh_from_db()
+        self.assertEqual(self.moscow.name, "г. Москва")
+        self.assertEqual((self.tver.name, self.tver.code), ("тверская область", "69"))
+        self.assertTrue(Region.objects.filter(code='50').exists())
+
+    def test_districts_diff_in_few_queries(self):
+        rows = [['район', 'регион', 'население'], ['центральный', '77', '120']]
+        rows += [[f'Район {i}', 'Тверская область', str(i)] for i in range(300)]
+        rows += [['Лишний', 'Атлантида', '1']]
+        # регионы, районы, транзакция: INSERT пачками и один UPDATE
+        result = self.assertMaxQueries(6, sync_reference, 'districts', rows)
+        self.assertEqual((result.rows, result.created, result.updated, result.error_count), (302, 300, 1, 1))
+        self.assertIn("Атлантида", result.errors[0][1])
+        self.district.refresh_from_db()
+        self.assertEqual((self.district.name, self.district.population), ("центральный", 120))
+        self.assertEqual(sync_reference('districts', rows).unchanged, 301)
+
+    def test_implementators_by_inn(self):
+        rows = [['ИНН', 'Наименование'], ['7700000001.0', 'ООО Новое'], ['7700000002', 'АО Второе'],
+                ['7700000002', 'АО Повтор'], ['123', 'Неверный ИНН']]
+        result = sync_reference('implementators', rows)
+        self.assertEqual((result.created, result.updated, result.error_count), (1, 1, 2))
+        self.implementator.refresh_from_db()
+        # колонки email в файле нет — поле не трогаем
+        self.assertEqual((self.implementator.name, self.implementator.email), ("ООО Новое", "old@example.com"))
+
+    def test_dry_run_writes_nothing(self):
+        out = StringIO()
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', encoding='utf-8', delete=False) as f:
+            f.write("name\nМонтаж\nНаладка\n")
+        self.addCleanup(os.remove, f.name)
+        call_command('sync_reference', 'works', f.name, '--dry-run', stdout=out)
+        self.assertIn("новых: 2", out.getvalue())
+        self.assertIn("+ монтаж", out.getvalue())
+        self.assertFalse(Work.objects.exists())
+        call_command('sync_reference', 'works', f.name, stdout=StringIO())
+        self.assertEqual(Work.objects.count(), 2)
+
+    def test_unique_conflict_is_rolled_back(self):
+        rows = [['code', 'name'], ['77', 'Тверская область']]  # имя уже занято другим регионом
+        with self.assertRaises(SyncError):
+            sync_reference('regions', rows)
+        self.moscow.refresh_from_db()
+        self.assertEqual(self.moscow.name, "Москва")
+
+
+class StatusRefreshTests(ContractsTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.contracts = make_contracts(5, aks_per_contract=0)
+        # Срок истёк «вчера», но save() с тех пор не вызывался
+        Contract.objects.filter(pk__in=[c.pk for c in cls.contracts[:3]]).update(
+            end_date=date.today() - timedelta(days=1)
+        )
+
+    def test_refresh_in_batches(self):
+        self.assertEqual(refresh_statuses(batch_size=2), {'completed': 3, 'active': 0})
+        self.assertEqual(Contract.objects.filter(status='completed').count(), 3)
+        self.assertEqual(refresh_statuses(batch_size=2), {'completed': 0, 'active': 0})
+
+    def test_refresh_reactivates_prolonged(self):
+        refresh_statuses()
+        Contract.objects.filter(pk=self.contracts[0].pk).update(end_date=date.today())
+        self.assertEqual(refresh_statuses(), {'completed': 0, 'active': 1})
+
+    def test_list_filter_uses_live_status(self):
+        response = self.client.get(reverse('contracts:contract_list'), {'status': 'completed'})
+        self.assertEqual(len(response.context['contracts']), 3)
+        self.assertTrue(all(c.live_status == 'completed' for c in response.context['contracts']))
+
+    def test_command(self):
+        out = StringIO()
+        call_command('refresh_contract_statuses', '--batch-size', '1', stdout=out)
+        self.assertIn("Завершено: 3", out.getvalue())
+
+
+class CursorPaginationTests(QueryBudgetMixin, ContractsTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        contracts = make_contracts(25, aks_per_contract=0)
+        # Одинаковые даты начала — порядок внутри них задаёт id
+        Contract.objects.filter(pk__in=[c.pk for c in contracts[5:15]]).update(start_date=date(2024, 1, 1))
+        cls.expected = list(Contract.objects.order_by('-start_date', 'id').values_list('pk', flat=True))
+
+    def get_page(self, cursor=None):
+        params = {'cursor': cursor} if cursor else {}
+        return self.client.get(reverse('contracts:contract_list'), params).context['page_obj']
+
+    def test_walk_forward_and_back(self):
+        pages, page = [], self.get_page()
+        while True:
+            pages.append([c.pk for c in page])
+            if not page.has_next():
+                break
+            page = self.get_page(page.next_cursor)
+        self.assertEqual(sum(pages, []), self.expected)
+        self.assertEqual([len(p) for p in pages], [10, 10, 5])
+
+        page = self.get_page(page.previous_cursor)
+        self.assertEqual([c.pk for c in page], pages[1])
+        page = self.get_page(page.previous_cursor)
+        self.assertEqual([c.pk for c in page], pages[0])
+        self.assertFalse(page.has_previous())
+
+    def test_no_count_query(self):
+        with CaptureQueriesContext(connection) as ctx:
+            self.get_page()
+        self.assertFalse(any(q['sql'].startswith('SELECT COUNT(*)') for q in ctx.captured_queries))
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse('contracts:contract_list'), {'cursor': 'мусор'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_cursor_with_wrong_types(self):
+        bad_values = (["abc", 1], [None, 1], [{"a": 1}, "x"], ["2024-01-01", "x"], ["2024-01-01"])
+        # Ключ (дата, id) — список договоров
+        for values in bad_values:
+            response = self.client.get(reverse('contracts:contract_list'), {'cursor': encode_cursor(values)})
+            self.assertEqual(response.status_code, 404, values)
+        # Ключ (дата и время, id) — API
+        for values in (["вчера", 1], [None, 1], [[1], 1]):
+            response = self.client.get(reverse('contracts:api_list', args=['contracts']),
+                                       {'cursor': encode_cursor(values)})
+            self.assertEqual(response.status_code, 400, values)
+        # Ключ (число, id) — поиск АК по номеру
+        for values in (["abc", 1], [None, 1], [{"a": 1}, "x"]):
+            response = self.client.get(reverse('contracts:ak_search'),
+                                       {'number': '1', 'format': 'json', 'cursor': encode_cursor(values)})
+            self.assertEqual(response.status_code, 400, values)
+
+
+class AKImportTests(ContractsTestCase):
+    CSV = (
+        "Номер;Район;Регион;Адрес\n"
+        "10;Тестовый район;Тестовый регион;ул. Мира, 1\n"
+        "11;тестовый район;ТЕСТОВЫЙ РЕГИОН;ул. Мира, 2\n"
+        "1;Тестовый район;Тестовый регион;дубль существующего\n"
+        "11;Тестовый район;Тестовый регион;дубль в файле\n"
+        "12;Нет такого;Тестовый регион;ул. Мира, 3\n"
+        "абв;Тестовый район;Тестовый регион;ул. Мира, 4\n"
+    )
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.contract = make_contracts(1, aks_per_contract=1)[0]
+
+    def upload(self, content, name='aks.csv', **data):
+        url = reverse('contracts:ak_import', args=[self.contract.pk])
+        return self.client.post(url, {'file': SimpleUploadedFile(name, content), **data})
+
+    def test_import_csv_reports_bad_rows(self):
+        result = self.upload(self.CSV.encode()).context['result']
+        self.assertEqual((result.rows, result.created, result.error_count), (6, 2, 4))
+        self.assertEqual([line for line, _ in result.errors], [4, 5, 6, 7])
+        self.assertEqual(sorted(self.contract.aks.values_list('number', flat=True)), [1, 10, 11])
+
+    def test_strict_rolls_back(self):
+        result = self.upload(self.CSV.encode(), strict='on').context['result']
+        self.assertEqual(result.created, 0)
+        self.assertEqual(self.contract.aks.count(), 1)
+
+    def test_import_xlsx(self):
+        workbook = Workbook()
+        for row in [("number", "district", "region", "address")] + [
+            (n, "Тестовый район", "Тестовый регион", f"дом {n}") for n in range(2, 2002)
+        ]:
+            workbook.active.append(row)
+        buffer = BytesIO()
+        workbook.save(buffer)
+        result = self.upload(buffer.getvalue(), name='aks.xlsx').context['result']
+        self.assertEqual((result.created, result.error_count), (2000, 0))
+
+    def test_import_cp1251_csv(self):
+        result = self.upload(self.CSV.encode('cp1251')).context['result']
+        self.assertEqual((result.rows, result.created), (6, 2))
+        self.assertTrue(self.contract.aks.filter(address="ул. Мира, 1").exists())
+
+    def test_corrupt_xlsx_is_form_error(self):
+        workbook = Workbook()
+        workbook.active.append(("number", "district", "region", "address"))
+        buffer = BytesIO()
+        workbook.save(buffer)
+        for content in (buffer.getvalue()[:200], b'not a zip'):
+            response = self.upload(content, name='aks.xlsx')
+            self.assertEqual(response.status_code, 200)
+            self.assertIn("XLSX повреждён", ' '.join(response.context['form'].errors['file']))
+        self.assertEqual(self.contract.aks.count(), 1)
+
+    def test_command(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', encoding='utf-8', delete=False) as f:
+            f.write(self.CSV)
+        self.addCleanup(os.unlink, f.name)
+        out, err = StringIO(), StringIO()
+        call_command('import_aks', self.contract.pk, f.name, '--batch-size', '1', stdout=out, stderr=err)
+        self.assertIn("добавлено АК: 2", out.getvalue())
+        self.assertIn("Строка 7", err.getvalue())
+
+
+class AKEditingTests(QueryBudgetMixin, ContractsTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.contract = make_contracts(1, aks_per_contract=30)[0]
+        cls.district = District.objects.get()
+        other = Region.objects.create(name="Другой регион")
+        District.objects.create(name="Тестовая слобода", region=other)
+
+    def test_district_autocomplete(self):
+        url = reverse('contracts:district_autocomplete')
+        results = self.client.get(url, {'q': 'тест'}).json()['results']
+        self.assertEqual(len(results), 2)
+        results = self.client.get(url, {'q': 'тест', 'region': self.district.region_id}).json()['results']
+        self.assertEqual(results, [{'id': self.district.pk, 'text': str(self.district)}])
+        for query in ('ТЕСТОВЫЙ Р', 'тЕсТоВыЙ р', 'Тестовая'):
+            results = self.client.get(url, {'q': query}).json()['results']
+            self.assertEqual(len(results), 1, query)
+
+    def test_edit_form_does_not_render_district_list(self):
+        url = reverse('contracts:contract_edit', args=[self.contract.pk])
+        response = self.assertMaxQueries(6, self.client.get, url)
+        self.assertNotContains(response, "Тестовая слобода")
+
+    def test_formset_reads_districts_once(self):
+        data = {'aks-TOTAL_FORMS': 20, 'aks-INITIAL_FORMS': 0, 'aks-MIN_NUM_FORMS': 0, 'aks-MAX_NUM_FORMS': 500}
+        for i in range(20):
+            data.update({f'aks-{i}-number': 100 + i, f'aks-{i}-district': self.district.pk,
+                         f'aks-{i}-address': "ул. Новая"})
+        formset = AKFormSet(data, instance=self.contract)
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertTrue(formset.is_valid())
+            html = str(formset)
+        # Строки районов — одним запросом на формсет (проверка внешнего ключа моделью — отдельно)
+        district_queries = [q['sql'] for q in ctx.captured_queries if '"contracts_app_district"."name"' in q['sql']]
+        self.assertEqual(len(district_queries), 1)
+        self.assertEqual(formset.forms[19].cleaned_data['district'], self.district)
+        self.assertIn(str(self.district), html)
+
+    def test_add_update_delete_single_ak(self):
+        add_url = reverse('contracts:ak_add', args=[self.contract.pk])
+        data = {'number': 100, 'district': self.district.pk, 'address': 'ул. Новая, 1'}
+        ak_id = self.client.post(add_url, data).json()['ak']['id']
+
+        response = self.client.post(add_url, data)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('number', response.json()['errors'])
+
+        edit_url = reverse('contracts:ak_edit', args=[self.contract.pk, ak_id])
+        self.client.post(edit_url, {**data, 'address': 'ул. Новая, 2'})
+        self.assertEqual(AK.objects.get(pk=ak_id).address, 'ул. Новая, 2')
+
+        self.client.post(reverse('contracts:ak_delete', args=[self.contract.pk, ak_id]))
+        self.assertEqual(self.contract.aks.count(), 30)
+
+
+class ExportTests(ContractsTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.contracts = make_contracts(3, aks_per_contract=2)
+        Contract.objects.create(
+            customer_name="Без АК", customer_inn="5500000000", start_date=date(2020, 1, 1),
+            end_date=date(2020, 12, 31), implementator=Implementator.objects.get(),
+        )
+
+    def export(self, **params):
+        return self.client.get(reverse('contracts:contract_export'), params)
+
+    def test_csv_streams_one_row_per_ak(self):
+        response = self.export(format='csv')
+        self.assertTrue(response.streaming)
+        lines = b''.join(response.streaming_content).decode('utf-8-sig').splitlines()
+        self.assertEqual(len(lines), 1 + 3 * 2 + 1)
+        self.assertIn("Без АК", lines[-1])
+        self.assertIn("Завершён", lines[-1])
+
+    def test_csv_uses_list_filters(self):
+        response = self.export(format='csv', status='completed')
+        lines = b''.join(response.streaming_content).decode('utf-8-sig').splitlines()
+        self.assertEqual(len(lines), 2)
+
+    def test_xlsx(self):
+        response = self.export(format='xlsx', q='Заказчик')
+        self.assertTrue(response.streaming)
+        workbook = load_workbook(BytesIO(b''.join(response.streaming_content)), read_only=True)
+        rows = list(workbook.active.iter_rows(values_only=True))
+        self.assertEqual(len(rows), 1 + 3 * 2)
+        self.assertEqual(rows[0][:2], ("ID договора", "Заказчик"))
+        self.assertEqual(rows[1][0], self.contracts[0].pk)
+        self.assertEqual(rows[1][11:14], (1, "Тестовый район", "Тестовый регион"))
+
+    def test_xlsx_streams_before_all_rows_are_read(self):
+        read = []
+
+        def rows(queryset):
+            for i in range(20000):
+                read.append(i)
+                yield [i, f"Заказчик {i * 7919 % 100003}", "ул. Ленина\x01"]
+
+        with mock.patch.object(exports, 'iter_rows', rows):
+            stream = exports.stream_xlsx(Contract.objects.none())
+            first = next(stream)
+            self.assertLess(len(read), 20000)
+            content = first + b''.join(stream)
+        sheet = load_workbook(BytesIO(content)).active
+        self.assertEqual((sheet.title, sheet.max_row), ("Договоры", 1 + 20000))
+        self.assertEqual([cell.value for cell in sheet[20001][:3]], [19999, f"Заказчик {19999 * 7919 % 100003}", "ул. Ленина"])
+
+    def test_unknown_format(self):
+        self.assertEqual(self.export(format='pdf').status_code, 400)
+
+
+class AttachmentsZipTests(ContractsTestCase):
+    def setUp(self):
+        super().setUp()
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media)
+        self.enterContext(override_settings(MEDIA_ROOT=media))
+        self.contracts = make_contracts(2, aks_per_contract=0)
+        self.contracts[0].file1.save('scan.pdf', ContentFile(b'%PDF' * 50000))
+        self.contracts[0].file2.save('act.docx', ContentFile(b'docx'))
+        self.contracts[1].file1.save('scan.pdf', ContentFile(b'second'))
+        self.client.force_login(make_viewer())
+
+    def test_zip_requires_permission(self):
+        self.client.logout()
+        self.assertEqual(self.client.get(reverse('contracts:contract_files_zip')).status_code, 302)
+
+    def test_zip_streams_files_per_contract(self):
+        response = self.client.get(reverse('contracts:contract_files_zip'), {'q': 'Заказчик'})
+        self.assertTrue(response.streaming)
+        archive = zipfile.ZipFile(BytesIO(b''.join(response.streaming_content)))
+        self.assertIsNone(archive.testzip())
+        names = sorted(archive.namelist())
+        self.assertEqual(len(names), 3)
+        self.assertTrue(names[0].startswith(f"{self.contracts[0].pk}_Заказчик_0/file1_"))
+        first = [n for n in names if n.startswith(f"{self.contracts[0].pk}_") and '/file1_' in n][0]
+        self.assertEqual(archive.read(first), b'%PDF' * 50000)
+
+    def test_missing_file_is_skipped(self):
+        os.remove(self.contracts[1].file1.path)
+        response = self.client.get(reverse('contracts:contract_files_zip'))
+        archive = zipfile.ZipFile(BytesIO(b''.join(response.streaming_content)))
+        self.assertEqual(len(archive.namelist()), 2)
+
+
+class ProtectedDownloadTests(ContractsTestCase):
+    BODY = bytes(range(256)) * 400
+
+    def setUp(self):
+        super().setUp()
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media)
+        self.enterContext(override_settings(MEDIA_ROOT=media))
+        self.contract = make_contracts(1, aks_per_contract=0)[0]
+        self.contract.file2.save('scan.pdf', ContentFile(self.BODY))
+        self.url = reverse('contracts:contract_file', args=[self.contract.pk, 2])
+        self.client.force_login(make_viewer())
+
+    def test_media_url_is_not_public(self):
+        self.client.logout()
+        self.assertEqual(self.client.get('/media/' + self.contract.file2.name).status_code, 404)
+        response = self.client.get(self.url)
+        self.assertRedirects(response, f"{reverse('admin:login')}?next={self.url}", fetch_redirect_response=False)
+
+    def test_permission_required(self):
+        self.client.force_login(get_user_model().objects.create_user('guest'))
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+
+    def test_full_file(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.BODY)
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertIn(f"{self.contract.pk}_", response['Content-Disposition'])
+        self.assertEqual(int(response['Content-Length']), len(self.BODY))
+
+    def test_ranges(self):
+        size = len(self.BODY)
+        for header, start, end in (('bytes=100-199', 100, 199), ('bytes=1000-', 1000, size - 1),
+                                   ('bytes=-10', size - 10, size - 1), (f'bytes=5-{size * 2}', 5, size - 1)):
+            response = self.client.get(self.url, HTTP_RANGE=header)
+            self.assertEqual(response.status_code, 206, header)
+            self.assertEqual(response['Content-Range'], f'bytes {start}-{end}/{size}')
+            self.assertEqual(int(response['Content-Length']), end - start + 1)
+            self.assertEqual(b''.join(response.streaming_content), self.BODY[start:end + 1])
+        response = self.client.get(self.url, HTTP_RANGE=f'bytes={size}-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], f'bytes */{size}')
+        self.assertIsNone(parse_range('bytes=0-1,5-6', size))
+
+    def test_conditional_requests(self):
+        last_modified = self.client.get(self.url)['Last-Modified']
+        self.assertEqual(self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 304)
+        stale = self.client.get(self.url, HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='Mon, 01 Jan 2001 00:00:00 GMT')
+        self.assertEqual(stale.status_code, 200)
+        fresh = self.client.get(self.url, HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE=last_modified)
+        self.assertEqual(fresh.status_code, 206)
+
+    def test_offload_to_front_server(self):
+        with self.settings(PROTECTED_MEDIA_SERVER='nginx'):
+            response = self.client.get(self.url)
+        self.assertEqual(response['X-Accel-Redirect'], f'/protected-media/{self.contract.file2.name}')
+        self.assertEqual(response.content, b'')
+        with self.settings(PROTECTED_MEDIA_SERVER='sendfile'):
+            response = self.client.get(self.url)
+        self.assertEqual(response['X-Sendfile'], self.contract.file2.path)
+
+    def test_missing_file(self):
+        os.remove(self.contract.file2.path)
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+        self.assertEqual(self.client.get(reverse('contracts:contract_file', args=[self.contract.pk, 3])).status_code, 404)
+        self.assertEqual(self.client.get(reverse('contracts:contract_file', args=[self.contract.pk, 4])).status_code, 404)
+
+    def test_links_in_pages(self):
+        Contract.objects.filter(pk=self.contract.pk).update(file1='')
+        self.assertContains(self.client.get(reverse('contracts:contract_detail', args=[self.contract.pk])), self.url)
+        self.client.force_login(get_user_model().objects.create_superuser('admin', 'admin@example.com', 'pass'))
+        response = self.client.get(reverse('admin:contracts_app_contract_change', args=[self.contract.pk]))
+        self.assertContains(response, f'href="{self.url}"')
+
+
+class ContentAddressedStorageTests(ContractsTestCase):
+    def setUp(self):
+        super().setUp()
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media)
+        self.enterContext(override_settings(MEDIA_ROOT=media))
+        self.first, self.second = make_contracts(2, aks_per_contract=0)
+
+    def attach(self, contract, content, name='scan.pdf', field='file1'):
+        getattr(contract, field).save(name, ContentFile(content))
+        return getattr(contract, field).name
+
+    def test_identical_uploads_stored_once(self):
+        name1 = self.attach(self.first, b'one document')
+        name2 = self.attach(self.second, b'one document', name='copy.PDF')
+        self.assertEqual(name1, name2)
+        self.assertRegex(name1, r'^contracts/files/[0-9a-f]{2}/[0-9a-f]{64}\.pdf$')
+        self.assertEqual(StoredFile.objects.get(name=name1).ref_count, 2)
+
+    def test_file_removed_with_last_reference(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            name = self.attach(self.first, b'shared')
+            self.attach(self.second, b'shared')
+            self.first.delete()
+        self.assertTrue(contract_storage.exists(name))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.second.file1 = None
+            self.second.save()
+        self.assertFalse(contract_storage.exists(name))
+        self.assertFalse(StoredFile.objects.filter(name=name).exists())
+
+    def test_cleanup_rechecks_references(self):
+        name = self.attach(self.first, b'shared')
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.first.file1 = None
+            self.first.save()
+        # Та же загрузка ссылается на файл, пока очистка ждёт своей очереди
+        self.attach(self.second, b'shared')
+        for callback in callbacks:
+            callback()
+        self.assertTrue(contract_storage.exists(name))
+        self.assertEqual(StoredFile.objects.get(name=name).ref_count, 1)
+
+    def test_upload_restored_if_removed_concurrently(self):
+        save = contract_storage._save
+
+        def save_then_lose(name, content):
+            saved = save(name, content)
+            os.remove(contract_storage.path(saved))  # очистка удалила файл до учёта ссылки
+            return saved
+
+        with mock.patch.object(contract_storage, '_save', save_then_lose):
+            name = self.attach(self.first, b'restored')
+        with contract_storage.open(name) as f:
+            self.assertEqual(f.read(), b'restored')
+
+    def test_failed_save_releases_upload(self):
+        with mock.patch.object(Contract, '_do_update', side_effect=DatabaseError("сбой")):
+            with self.assertRaises(DatabaseError):
+                self.attach(self.first, b'never referenced')
+        self.assertEqual(contract_storage._saved(), {})
+
+    def test_large_upload_is_moved_not_buffered(self):
+        url = reverse('contracts:contract_edit', args=[self.first.pk])
+        payload = b'x' * (3 * 1024 * 1024)
+        data = {
+            'customer_name': self.first.customer_name, 'customer_inn': self.first.customer_inn,
+            'start_date': self.first.start_date, 'end_date': self.first.end_date,
+            'implementator': self.first.implementator_id,
+            'file1': SimpleUploadedFile('big.pdf', payload),
+            'aks-TOTAL_FORMS': 0, 'aks-INITIAL_FORMS': 0,
+        }
+        self.client.post(url, data)
+        self.first.refresh_from_db()
+        self.assertEqual(self.first.file1.name, self.attach(self.second, payload, name='big.pdf'))
+        with self.first.file1.open('rb') as f:
+            self.assertEqual(len(f.read()), len(payload))
+
+
+class ExpiryNotificationTests(ContractsTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        contracts = make_contracts(4, aks_per_contract=0)
+        Implementator.objects.update(email="impl@example.com")
+        second = Implementator.objects.create(name="ИП Второй", inn="123456789012", email="second@example.com")
+        silent = Implementator.objects.create(name="Без почты", inn="1111111111")
+        today = date.today()
+        for contract, days, implementator in zip(
+            contracts, (30, 5, 1, 60), (None, None, second, silent)
+        ):
+            contract.end_date = today + timedelta(days=days)
+            if implementator:
+                contract.implementator = implementator
+            contract.save()
+        cls.contracts = contracts
+
+    def test_one_digest_per_implementator(self):
+        self.assertEqual(send_expiry_notifications(), (2, 3))
+        self.assertEqual(sorted(m.to[0] for m in mail.outbox), ["impl@example.com", "second@example.com"])
+        digest = next(m for m in mail.outbox if m.to == ["impl@example.com"])
+        self.assertIn("Заказчик 0", digest.body)
+        self.assertIn("Заказчик 1", digest.body)
+        self.assertEqual(
+            sorted(ExpiryNotification.objects.values_list('lead_days', flat=True)), [1, 7, 30]
+        )
+
+    def test_rerun_is_idempotent(self):
+        send_expiry_notifications()
+        mail.outbox.clear()
+        self.assertEqual(send_expiry_notifications(), (0, 0))
+        self.assertEqual(mail.outbox, [])
+
+    def test_next_lead_and_prolongation_notify_again(self):
+        send_expiry_notifications()
+        later = date.today() + timedelta(days=25)
+        self.assertEqual(send_expiry_notifications(today=later), (1, 1))  # 30 дней -> окно 7 дней
+        contract = self.contracts[2]
+        contract.end_date += timedelta(days=1)
+        contract.save()
+        self.assertEqual(send_expiry_notifications(), (1, 1))
+
+    def test_dry_run_command(self):
+        out = StringIO()
+        call_command('send_expiry_notifications', '--dry-run', stdout=out)
+        self.assertIn("писем 2, договоров 3", out.getvalue())
+        self.assertEqual(mail.outbox, [])
+
+
+class SeedAndBenchmarkTests(ContractsTestCase):
+    def test_seed_data(self):
+        call_command('seed_data', '--regions', 2, '--districts-per-region', 3, '--implementators', 4,
+                     '--contracts', 50, '--aks-per-contract', 2, '--batch-size', 20, stdout=StringIO())
+        self.assertEqual(District.objects.count(), 6)
+        self.assertEqual(Contract.objects.count(), 50)
+        self.assertFalse(Contract.objects.filter(status='').exists())
+
+    def test_benchmark_against_baseline(self):
+        call_command('seed_data', '--regions', 1, '--districts-per-region', 2, '--implementators', 2,
+                     '--contracts', 20, stdout=StringIO())
+        contracts = Contract.objects.count()
+        baseline = os.path.join(tempfile.mkdtemp(), 'baseline.json')
+        self.addCleanup(shutil.rmtree, os.path.dirname(baseline))
+
+        call_command('benchmark', '--repeat', 1, '--formset-rows', 20, '--baseline', baseline, '--save-baseline',
+                     stdout=StringIO())
+        results = benchmarks.load_baseline(baseline)
+        self.assertEqual(set(results), {'list', 'search', 'status_filter', 'detail', 'contract_form_save', 'admin_changelist'})
+        self.assertEqual(Contract.objects.count(), contracts)
+        # Замер после прогрева идёт мимо кэша страниц: версии кэша, договоры, АК
+        self.assertGreaterEqual(results['list']['queries'], 3)
+        self.assertGreaterEqual(results['detail']['queries'], 3)
+
+        results['list']['queries'] += 1
+        self.assertEqual(benchmarks.compare(results, benchmarks.load_baseline(baseline)),
+                         [f"list.queries: {results['list']['queries'] - 1} -> {results['list']['queries']}"])
+
+
+class QueryPlanTests(ContractsTestCase):
+    """EXPLAIN QUERY PLAN горячих запросов: без полного сканирования таблиц."""
+
+    TABLES = (Contract._meta.db_table, AK._meta.db_table, District._meta.db_table)
+
+    def plan(self, queryset):
+        return [line.split(' ', 3)[-1] for line in queryset.explain().splitlines()]
+
+    def assertIndexedPlan(self, queryset, ordered_by=None, sorted_in_memory=False):
+        """
+        Сканирование таблицы допустимо только по индексу ordered_by (обход по
+        порядку сортировки с LIMIT); временная сортировка — только если разрешена.
+        """
+        plan = self.plan(queryset)
+        for line in plan:
+            words = line.split()
+            if words[0] == 'SCAN' and words[1] in self.TABLES:
+                if not (ordered_by and line.endswith(f'USING INDEX {ordered_by}')):
+                    self.fail(f"Сканирование таблицы {words[1]}:\n" + "\n".join(plan))
+            if 'TEMP B-TREE FOR ORDER BY' in line and not sorted_in_memory:
+                self.fail("Сортировка во временном B-дереве:\n" + "\n".join(plan))
+        return plan
+
+    def test_contract_list_page(self):
+        queryset = Contract.objects.with_counts().with_live_status().order_by('-start_date', 'id')
+        self.assertIndexedPlan(queryset[:11], ordered_by='contract_start_id_idx')
+
+    def test_contract_list_next_page(self):
+        after = Q(start_date__lt=date(2024, 1, 1)) | Q(start_date=date(2024, 1, 1), id__gt=100)
+        queryset = Contract.objects.with_counts().filter(after).order_by('-start_date', 'id')
+        self.assertIndexedPlan(queryset[:11], ordered_by='contract_start_id_idx')
+
+    def test_contract_list_status_filter(self):
+        queryset = Contract.objects.with_counts().filter_status('completed').order_by('-start_date', 'id')
+        self.assertIndexedPlan(queryset[:11], ordered_by='contract_start_id_idx')
+
+    def test_detail_aks(self):
+        self.assertIndexedPlan(AK.objects.select_related('district__region').filter(contract_id=1))
+
+    def test_search(self):
+        queryset = search_contracts(Contract.objects.with_counts().order_by('-start_date'), "ромашка")
+        self.assertIndexedPlan(queryset[:10], sorted_in_memory=True)
+
+    def test_api_incremental_sync(self):
+        queryset = Contract.objects.filter(updated_at__gt='2024-01-01').order_by('updated_at', 'id')
+        self.assertIndexedPlan(queryset.values('id', 'updated_at')[:101], ordered_by='contract_updated_id_idx')
+
+    def test_search_by_inn(self):
+        self.assertIndexedPlan(Contract.objects.filter(customer_inn='7700000000').order_by())
+
+    def test_admin_filters(self):
+        base = Contract.objects.with_counts().order_by('-start_date', '-id')
+        self.assertIndexedPlan(base.filter(status='active')[:100], ordered_by='contract_status_start_idx')
+        self.assertIndexedPlan(base.filter(implementator_id=1)[:100], ordered_by='contract_impl_start_idx')
+        self.assertIndexedPlan(
+            base.filter(end_date__gte=date(2025, 1, 1), end_date__lt=date(2025, 2, 1))[:100], sorted_in_memory=True
+        )
+
+    def test_status_refresh_and_notifications(self):
+        today = date.today()
+        self.assertIndexedPlan(Contract.objects.filter(status='active', end_date__lt=today).order_by().values('pk')[:5000])
+        self.assertIndexedPlan(due_contracts(7, today, today + timedelta(days=7)))
+
+    def test_aks_by_district(self):
+        self.assertIndexedPlan(AK.objects.filter(district_id=1).order_by())
+
+    def test_ak_search(self):
+        low, high = number_prefix_ranges('12')[3]
+        by_number = AK.objects.filter(number__range=(low, high)).order_by('number', 'id')
+        self.assertIndexedPlan(by_number[:51])
+        self.assertIndexedPlan(search_ak_addresses(AK.objects.order_by('id'), "ленина")[:51])
+
+
+class PageCacheTests(QueryBudgetMixin, ContractsTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        # Версии кэша меняются после коммита
+        with cls.captureOnCommitCallbacks(execute=True):
+            cls.contract = make_contracts(3, aks_per_contract=2)[0]
+
+    def test_list_served_from_cache_until_change(self):
+        url = reverse('contracts:contract_list')
+        self.client.get(url)
+        self.assertMaxQueries(1, self.client.get, url)  # только версии кэша
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.contract.customer_name = "ООО Новое имя"
+            self.contract.save()
+        self.assertContains(self.client.get(url), "ООО Новое имя")
+
+    def test_version_shared_between_processes(self):
+        # Запись из другого процесса (воркер, management-команда) видна через базу, не через локальный кэш
+        url = reverse('contracts:contract_list')
+        etag = self.client.get(url)['ETag']
+        cache.clear()
+        self.assertEqual(self.client.get(url, headers={'If-None-Match': etag}).status_code, 304)
+        with self.captureOnCommitCallbacks(execute=True):
+            Contract.objects.filter(pk=self.contract.pk).update(end_date=date.today() - timedelta(days=1))
+            call_command('refresh_contract_statuses', stdout=StringIO())
+        self.assertEqual(self.client.get(url, headers={'If-None-Match': etag}).status_code, 200)
+
+    def test_ak_change_invalidates_list_and_detail(self):
+        list_url = reverse('contracts:contract_list')
+        detail_url = reverse('contracts:contract_detail', args=[self.contract.pk])
+        self.client.get(list_url)
+        self.client.get(detail_url)
+        with self.captureOnCommitCallbacks(execute=True):
+            AK.objects.create(contract=self.contract, number=99, district=District.objects.get(), address="ул. Новая")
+        self.assertContains(self.client.get(list_url), "3 АК")
+        self.assertContains(self.client.get(detail_url), "Абонентские комплекты (3)")
+
+    def test_formset_save_invalidates_once(self):
+        self.client.force_login(get_user_model().objects.create_user('editor'))
+        contract, district = self.contract, District.objects.get()
+        data = {
+            'customer_name': contract.customer_name, 'customer_inn': contract.customer_inn,
+            'start_date': contract.start_date, 'end_date': contract.end_date,
+            'implementator': contract.implementator_id, 'file1': SimpleUploadedFile('scan.pdf', b'%PDF-1.4'),
+            'aks-TOTAL_FORMS': 20, 'aks-INITIAL_FORMS': 0, 'aks-MIN_NUM_FORMS': 0, 'aks-MAX_NUM_FORMS': 500,
+        }
+        for i in range(20):
+            data.update({f'aks-{i}-number': 100 + i, f'aks-{i}-district': district.pk, f'aks-{i}-address': "ул. Новая"})
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media, ignore_errors=True)
+        with self.settings(MEDIA_ROOT=media), CaptureQueriesContext(connection) as ctx, \
+                self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('contracts:contract_edit', args=[contract.pk]), data)
+        self.assertEqual(response.status_code, 302)
+        sql = [q['sql'] for q in ctx.captured_queries]
+        self.assertEqual(sum(q.startswith('UPDATE "contracts_app_contract" SET "updated_at"') for q in sql), 1)
+        self.assertEqual(sum(q.startswith('INSERT INTO "contracts_app_cacheversion"') for q in sql), 1)
+        self.assertContains(self.client.get(reverse('contracts:contract_list')), "22 АК")
+
+    def test_detail_aks_fragment_cached(self):
+        url = reverse('contracts:contract_detail', args=[self.contract.pk])
+        self.client.get(url)
+        response = self.assertMaxQueries(2, self.client.get, url)  # updated_at + договор
+        self.assertContains(response, "Абонентские комплекты (2)")
+
+    def test_conditional_get(self):
+        for url in (reverse('contracts:contract_list'),
+                    reverse('contracts:contract_detail', args=[self.contract.pk])):
+            response = self.client.get(url)
+            self.assertTrue(response.has_header('Last-Modified'))
+            cached = self.client.get(url, headers={'If-None-Match': response['ETag']})
+            self.assertEqual(cached.status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Implementator.objects.get().save()  # справочник изменился — ETag тоже
+        self.assertEqual(self.client.get(url, headers={'If-None-Match': response['ETag']}).status_code, 200)
+
+
+class ChecklistBatchTests(QueryBudgetMixin, ContractsTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.contracts = make_contracts(20, aks_per_contract=0)
+
+    def post(self, payload):
+        return self.client.post(reverse('contracts:update_checklists'), json.dumps(payload),
+                                content_type='application/json')
+
+    def test_batch_update_is_set_based(self):
+        payload = {str(c.pk): {'oko': True, 'spolokh': i % 2 == 0} for i, c in enumerate(self.contracts)}
+        # SELECT + UPDATE на каждую пару (поле, значение) + savepoint-ы клиента
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.post(payload)
+        updates = [q['sql'] for q in ctx.captured_queries if q['sql'].startswith('UPDATE')]
+        self.assertEqual(len(updates), 2)  # oko=True; spolokh=True (spolokh=False ничего не меняет)
+        for sql in updates:
+            self.assertNotIn('"customer_name"', sql)
+            self.assertNotIn('"status"', sql)
+
+        data = response.json()
+        self.assertTrue(data['success'])
+        self.assertEqual(set(data['results'].values()), {'updated'})
+        self.assertEqual(Contract.objects.filter(oko=True).count(), 20)
+        self.assertEqual(Contract.objects.filter(spolokh=True).count(), 10)
+
+        data = self.post(payload).json()
+        self.assertEqual(set(data['results'].values()), {'unchanged'})
+
+    def test_per_id_results(self):
+        pk = self.contracts[0].pk
+        data = self.post({
+            str(pk): {'gos_services': True},
+            '999999': {'oko': True},
+            'abc': {'oko': True},
+            str(self.contracts[1].pk): {'oko': 'yes'},
+            str(self.contracts[2].pk): {'status': True},
+        }).json()
+        self.assertFalse(data['success'])
+        self.assertEqual(data['results'], {
+            str(pk): 'updated', '999999': 'not_found', 'abc': 'invalid',
+            str(self.contracts[1].pk): 'invalid', str(self.contracts[2].pk): 'invalid',
+        })
+        self.assertTrue(Contract.objects.get(pk=pk).gos_services)
+
+    def test_bad_payload(self):
+        url = reverse('contracts:update_checklists')
+        self.assertEqual(self.client.post(url, 'not json', content_type='application/json').status_code, 400)
+        self.assertEqual(self.post([1, 2]).status_code, 400)
+
+    def test_list_cache_invalidated(self):
+        contract = self.contracts[0]
+        url = reverse('contracts:contract_list')
+        self.client.get(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.post({str(contract.pk): {'oko': True}})
+        html = self.client.get(url).content.decode()
+        card = html[html.index(f'data-contract-id="{contract.pk}"'):]
+        self.assertIn('name="oko" checked', card[:card.index('</form>')])
+
+    def test_single_checklist_unchecks(self):
+        contract = self.contracts[0]
+        Contract.objects.filter(pk=contract.pk).update(oko=True, spolokh=True)
+        url = reverse('contracts:update_checklist', args=[contract.pk])
+        self.client.post(url, {'oko': 'false', 'spolokh': 'on'})
+        contract.refresh_from_db()
+        self.assertEqual((contract.gos_services, contract.oko, contract.spolokh), (False, False, True))
+
+
+class AsyncViewsLoadTests(TransactionTestCase):
+    """Точки входа WSGI и ASGI обслуживают асинхронные представления без ошибок."""
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        cache.clear()
+        self.contract = make_contracts(3)[0]
+
+    def test_wsgi_and_asgi_entry_points(self):
+        urls = [
+            reverse('contracts:contract_list'),
+            reverse('contracts:contract_list') + '?' + urlencode({'q': 'Заказчик'}),
+            reverse('contracts:contract_detail', args=[self.contract.pk]),
+        ]
+        results = loadtest.run(urls=urls, requests=12, threads=2, clients=4, client_delay=0.01)
+        self.assertEqual(set(results), {'wsgi', 'asgi'})
+        for metrics in results.values():
+            self.assertEqual(metrics['requests'], 12)
+            self.assertEqual(metrics['errors'], 0)
+
+    def test_async_pages_read_from_replica(self):
+        aliases = []
+
+        def record(alias):
+            def wrapper(execute, sql, params, many, context):
+                aliases.append((alias, sql))
+                return execute(sql, params, many, context)
+            return wrapper
+
+        async def get_pages():
+            client = AsyncClient()
+            for url, params in ((reverse('contracts:contract_list'), {}),
+                                (reverse('contracts:contract_list'), {'status': 'active'}),
+                                (reverse('contracts:contract_list'), {'q': 'Заказчик'}),
+                                (reverse('contracts:contract_detail', args=[self.contract.pk]), {})):
+                self.assertEqual((await client.get(url, params)).status_code, 200)
+
+        self.assertIsNot(connections[REPLICA_ALIAS], connections[DEFAULT_DB_ALIAS])
+        with connections[DEFAULT_DB_ALIAS].execute_wrapper(record(DEFAULT_DB_ALIAS)), \
+                connections[REPLICA_ALIAS].execute_wrapper(record(REPLICA_ALIAS)):
+            async_to_sync(get_pages)()
+        self.assertTrue(aliases)
+        self.assertEqual([sql for alias, sql in aliases if alias != REPLICA_ALIAS], [])
+
+    def test_asgi_checklist(self):
+        async def post():
+            client = AsyncClient()
+            return await client.post(reverse('contracts:update_checklists'),
+                                     json.dumps({str(self.contract.pk): {'oko': True}}),
+                                     content_type='application/json')
+        response = async_to_sync(post)()
+        self.assertEqual(response.json()['results'], {str(self.contract.pk): 'updated'})
+        self.assertTrue(Contract.objects.get(pk=self.contract.pk).oko)
+
+
+class APITests(QueryBudgetMixin, ContractsTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.contracts = make_contracts(5, aks_per_contract=2)
+
+    def get(self, resource, **params):
+        return self.client.get(reverse('contracts:api_list', args=[resource]), params)
+
+    def test_sparse_fieldset_fetches_only_requested_columns(self):
+        with CaptureQueriesContext(connection) as ctx:
+            data = self.get('contracts', fields='id,customer_name', limit=2).json()
+        self.assertEqual(len(ctx), 1)
+        sql = ctx.captured_queries[0]['sql']
+        self.assertNotIn('customer_inn', sql)
+        self.assertNotIn('file1', sql)
+        self.assertEqual([set(row) for row in data['results']], [{'id', 'customer_name'}] * 2)
+
+    def test_cursor_pagination_walks_all_rows(self):
+        seen, cursor = [], None
+        while True:
+            params = {'limit': 2, 'fields': 'id'}
+            if cursor:
+                params['cursor'] = cursor
+            data = self.get('contracts', **params).json()
+            seen += [row['id'] for row in data['results']]
+            cursor = data['next_cursor']
+            if not cursor:
+                break
+        self.assertEqual(sorted(seen), sorted(c.pk for c in self.contracts))
+        self.assertEqual(len(seen), len(set(seen)))
+
+    def test_updated_at_filter(self):
+        contract = self.contracts[2]
+        since = Contract.objects.order_by('-updated_at').values_list('updated_at', flat=True).first()
+        self.assertEqual(self.get('contracts', updated_at__gt=since.isoformat()).json()['results'], [])
+        AK.objects.create(contract=contract, number=50, district=District.objects.get(), address="ул. Новая")
+        results = self.get('contracts', updated_at__gt=since.isoformat(), fields='id,status').json()['results']
+        self.assertEqual(results, [{'id': contract.pk, 'status': 'active'}])
+        aks = self.get('aks', updated_at__gt=since.isoformat(), fields='number').json()['results']
+        self.assertEqual(sorted(row['number'] for row in aks), [1, 2, 50])
+
+    def test_ndjson_stream(self):
+        response = self.get('aks', format='ndjson', fields='contract,number,address')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson; charset=utf-8')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 10)
+        self.assertEqual(json.loads(lines[0]), {'contract': self.contracts[0].pk, 'number': 1, 'address': "ул. Ленина, 1"})
+
+    def test_reference_resources(self):
+        district = self.get('districts').json()['results'][0]
+        self.assertEqual(district['region_name'], "Тестовый регион")
+        implementator = self.get('implementators', fields='inn').json()['results']
+        self.assertEqual(implementator, [{'inn': '1234567890'}])
+
+    def test_errors(self):
+        self.assertEqual(self.get('contracts', fields='id,secret').status_code, 400)
+        self.assertEqual(self.get('contracts', updated_at__gt='вчера').status_code, 400)
+        self.assertEqual(self.get('contracts', limit=0).status_code, 400)
+        self.assertEqual(self.get('contracts', cursor='мусор').status_code, 400)
+        self.assertEqual(self.get('contracts', format='ndjson', fields='nope').status_code, 400)
+        self.assertEqual(self.get('users').status_code, 404)
+
+
+class DatabaseRoutingTests(ContractsTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.contract = make_contracts(1, aks_per_contract=1)[0]
+
+    def test_read_only_routes_reads_to_replica(self):
+        router = ReadReplicaRouter()
+
+        @read_only
+        def view():
+            return Contract.objects.all().db, router.db_for_write(Contract, instance=Contract.objects.first())
+
+        self.assertEqual(view(), (REPLICA_ALIAS, DEFAULT_DB_ALIAS))
+        self.assertEqual(Contract.objects.all().db, DEFAULT_DB_ALIAS)
+        self.assertFalse(router.allow_migrate(REPLICA_ALIAS, 'contracts_app'))
+
+    def test_streaming_response_reads_from_replica(self):
+        @read_only
+        def view():
+            return StreamingHttpResponse(Contract.objects.all().db for _ in range(2))
+
+        response = view()
+        self.assertEqual(Contract.objects.all().db, DEFAULT_DB_ALIAS)  # флаг снят после представления
+        self.assertEqual(b''.join(response.streaming_content), b'replicareplica')
+
+    def test_sqlite_pragmas(self):
+        with connection.cursor() as cursor:
+            cursor.execute("PRAGMA busy_timeout")
+            self.assertEqual(cursor.fetchone()[0], 5000)
+            cursor.execute("PRAGMA synchronous")
+            self.assertEqual(cursor.fetchone()[0], 1)  # NORMAL
+        self.assertEqual(connection.transaction_mode, 'IMMEDIATE')
+
+    def test_health(self):
+        response = self.client.get(reverse('contracts:health'))
+        self.assertEqual(response.json(), {'status': 'ok', 'databases': {'default': 'ok', 'replica': 'ok'}})
+
+
+@override_settings(METRICS_TOKEN='metrics-secret')
+class MetricsTests(ContractsTestCase):
+    AUTH = {'Authorization': 'Bearer metrics-secret'}
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.contract = make_contracts(1)[0]
+        Contract.objects.filter(pk=cls.contract.pk).update(file1='')
+
+    def sample(self, series):
+        """Значение строки series из /metrics (0, если её ещё нет)."""
+        for line in self.client.get(reverse('contracts:metrics'), headers=self.AUTH).content.decode().splitlines():
+            if line.startswith(series + ' '):
+                return float(line.rsplit(' ', 1)[1])
+        return 0
+
+    def test_request_db_and_template_metrics(self):
+        requests = 'contracts_http_requests_total{view="contracts:dashboard",method="GET",status="2xx"}'
+        queries = 'contracts_db_queries_per_request_sum{view="contracts:dashboard"}'
+        template = 'contracts_template_render_seconds_count{template="contracts/dashboard.html"}'
+        before = [self.sample(series) for series in (requests, queries, template)]
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get(reverse('contracts:dashboard'))
+        executed = len(ctx)  # следующий запрос к /metrics очистит журнал соединения
+        after = [self.sample(series) for series in (requests, queries, template)]
+        self.assertEqual([b - a for a, b in zip(before, after)], [1, executed, 1])
+
+    def test_nested_templates_are_timed_separately(self):
+        self.client.get(reverse('contracts:contract_edit', args=[self.contract.pk]))
+        self.assertGreater(self.sample('contracts_template_render_seconds_count{template="bootstrap5/field.html"}'), 0)
+
+    def test_server_timing_header(self):
+        url = reverse('contracts:contract_detail', args=[self.contract.pk])
+        self.assertNotIn('Server-Timing', self.client.get(url))
+        with self.settings(SERVER_TIMING=True):
+            cache.clear()
+            header = self.client.get(url)['Server-Timing']
+        self.assertRegex(header, r'^db;dur=[\d.]+;desc="\d+ SQL", tpl;dur=[\d.]+, total;dur=[\d.]+$')
+
+    def test_slow_query_log_has_call_site(self):
+        with self.settings(SLOW_QUERY_MS=0), self.assertLogs('contracts_app.metrics', 'WARNING') as logs:
+            self.client.get(reverse('contracts:dashboard'))
+        self.assertIn(os.path.join('contracts_app', 'views.py'), logs.output[0])
+        self.assertIn('SELECT', logs.output[0])
+
+    def test_metrics_endpoint_is_restricted(self):
+        url = reverse('contracts:metrics')
+        response = self.client.get(url, headers=self.AUTH)
+        self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+        self.assertContains(response, '# TYPE contracts_http_request_duration_seconds histogram')
+        # За обратным прокси все запросы идут с 127.0.0.1 — адрес сам по себе доступа не даёт
+        self.assertEqual(self.client.get(url, REMOTE_ADDR='127.0.0.1').status_code, 403)
+        self.assertEqual(self.client.get(url, headers={'Authorization': 'Bearer wrong'}).status_code, 403)
+        self.client.force_login(make_viewer())
+        self.assertEqual(self.client.get(url).status_code, 403)
+        self.client.force_login(get_user_model().objects.create_user('staff', is_staff=True))
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+
+class DashboardSummaryTests(QueryBudgetMixin, ContractsTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.contracts = make_contracts(3, aks_per_contract=2)
+        cls.district = District.objects.get()
+        cls.other = District.objects.create(name="Северный", region=Region.objects.create(name="Другой регион"))
+
+    def setUp(self):
+        super().setUp()
+        summary.rebuild()  # make_contracts пишет bulk_create-ом, мимо сигналов
+
+    def summaries(self):
+        return {
+            model.__name__: sorted(model.objects.filter(Q(contracts__gt=0) | Q(aks__gt=0))
+                                   .values_list('pk', 'contracts', 'aks'))
+            for model in summary.SUMMARY_MODELS
+        }
+
+    def assertMatchesRebuild(self):
+        incremental = self.summaries()
+        summary.rebuild()
+        self.assertEqual(incremental, self.summaries())
+
+    def test_incremental_updates_match_full_rebuild(self):
+        contract = self.contracts[0]
+        # Новый договор формой с АК в двух регионах
+        today = date.today()
+        data = {
+            'customer_name': "ООО Сводка", 'customer_inn': '7711111111',
+            'start_date': today.isoformat(), 'end_date': (today + timedelta(days=40)).isoformat(),
+            'implementator': contract.implementator_id, 'file1': SimpleUploadedFile('scan.pdf', b'%PDF-1.4'),
+            'aks-TOTAL_FORMS': 3, 'aks-INITIAL_FORMS': 0, 'aks-MIN_NUM_FORMS': 0, 'aks-MAX_NUM_FORMS': 500,
+        }
+        for i, district in enumerate((self.district, self.other, self.other)):
+            data.update({f'aks-{i}-number': i + 1, f'aks-{i}-district': district.pk, f'aks-{i}-address': "ул. Тихая"})
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media, ignore_errors=True)
+        with self.settings(MEDIA_ROOT=media):
+            self.assertEqual(self.client.post(reverse('contracts:contract_add'), data).status_code, 302)
+        self.assertMatchesRebuild()
+
+        # Один АК: добавить, перенести в другой район, удалить
+        ak_id = self.client.post(reverse('contracts:ak_add', args=[contract.pk]),
+                                 {'number': 77, 'district': self.district.pk, 'address': "ул. Новая"}).json()['ak']['id']
+        self.assertMatchesRebuild()
+        self.client.post(reverse('contracts:ak_edit', args=[contract.pk, ak_id]),
+                         {'number': 77, 'district': self.other.pk, 'address': "ул. Новая"})
+        self.assertMatchesRebuild()
+        self.client.post(reverse('contracts:ak_delete', args=[contract.pk, ak_id]))
+        self.assertMatchesRebuild()
+
+        # Импорт пачкой
+        rows = [['number', 'district', 'region', 'address'], ['500', 'Северный', 'Другой регион', "ул. Импортная"]]
+        import_aks(contract, rows)
+        self.assertMatchesRebuild()
+
+        # Смена исполнителя и срока, истечение договора, удаление
+        other_implementator = Implementator.objects.create(name="ООО Другой", inn="1111111111")
+        contract.implementator = other_implementator
+        contract.end_date = today + timedelta(days=400)
+        contract.save()
+        self.assertMatchesRebuild()
+        refresh_statuses(today=self.contracts[1].end_date + timedelta(days=1))  # срок части договоров истёк
+        self.assertMatchesRebuild()
+        self.contracts[2].delete()
+        self.assertMatchesRebuild()
+
+    def test_region_change_rebuilds(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.district.region = self.other.region
+            self.district.save()
+        self.assertEqual(RegionSummary.objects.get(pk=self.other.region_id).aks, 6)
+
+    def test_dashboard(self):
+        response = self.assertMaxQueries(5, self.client.get, reverse('contracts:dashboard'))
+        self.assertEqual(response.context['totals'], {'contracts': 3, 'aks': 6})
+        self.assertContains(response, "Тестовый регион")
+        expiry = dict(response.context['expiry'])
+        self.assertEqual(len(expiry), 12)
+
+    def test_rebuild_command(self):
+        out = StringIO()
+        call_command('rebuild_summaries', stdout=out)
+        self.assertIn("Сводки пересчитаны", out.getvalue())
+
+
+class ChangeHistoryTests(ContractsTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.contract = make_contracts(1, aks_per_contract=2)[0]
+        cls.district = District.objects.get()
+
+    def test_update_records_only_changed_fields(self):
+        contract = Contract.objects.get(pk=self.contract.pk)
+        self.assertFalse(hasattr(contract, '_history_before'))  # вне пишущего пути «до» читается в pre_save
+        with self.captureOnCommitCallbacks(execute=True):
+            contract.customer_name = "ООО Новое имя"
+            contract.oko = True
+            contract.save()
+            contract.save()  # без изменений — записи нет
+        change = history.for_object(Contract, contract.pk).get()
+        self.assertEqual(change.action, ChangeRecord.UPDATED)
+        self.assertEqual(change.changes, {'customer_name': ["Заказчик 0", "ООО Новое имя"], 'oko': [False, True]})
+
+    def test_snapshot_taken_only_on_write_paths(self):
+        with mock.patch.object(history, 'snapshot', wraps=history.snapshot) as snapshot:
+            self.client.get(reverse('contracts:contract_export'), {'format': 'csv'}).getvalue()
+            self.client.get(reverse('contracts:api_list', args=['contracts']))
+        snapshot.assert_not_called()
+
+        with history.batch():
+            contract = Contract.objects.get(pk=self.contract.pk)
+            self.assertEqual(set(contract._history_before), set(history.TRACKED[Contract][1]))
+            contract.customer_name = "ООО Пакет"
+            with CaptureQueriesContext(connection) as ctx, self.captureOnCommitCallbacks(execute=True):
+                contract.save()
+        # «до» уже есть — отдельного SELECT отслеживаемых полей нет
+        self.assertFalse(any('"gos_services"' in q['sql'] for q in ctx.captured_queries if q['sql'].startswith('SELECT')))
+        self.assertEqual(history.for_object(Contract, contract.pk).get().changes['customer_name'],
+                         ["Заказчик 0", "ООО Пакет"])
+
+    def test_create_and_delete_ak(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            ak = AK.objects.create(contract=self.contract, number=50, district=self.district, address="ул. Новая")
+            AK.objects.filter(pk=ak.pk).delete()
+        created, deleted = history.for_object(AK, ak.pk).order_by('id')
+        self.assertEqual(created.changes['address'], [None, "ул. Новая"])
+        self.assertEqual(deleted.action, ChangeRecord.DELETED)
+        self.assertEqual(deleted.changes['number'], [50, None])
+
+    def test_rolled_back_changes_are_not_recorded(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            try:
+                with transaction.atomic():
+                    AK.objects.create(contract=self.contract, number=60, district=self.district, address="x")
+                    self.contract.delete()
+                    raise DatabaseError
+            except DatabaseError:
+                pass
+        self.assertFalse(ChangeRecord.objects.exists())
+
+    def test_checklist_and_import_are_recorded(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('contracts:update_checklists'),
+                             json.dumps({str(self.contract.pk): {'oko': True, 'spolokh': False}}),
+                             content_type='application/json')
+            import_aks(self.contract, [['number', 'district', 'region', 'address'],
+                                       ['70', 'Тестовый район', 'Тестовый регион', "ул. Импортная"]])
+        self.assertEqual(history.for_object(Contract, self.contract.pk).get().changes, {'oko': [False, True]})
+        imported = ChangeRecord.objects.get(object_type=ChangeRecord.AK)
+        self.assertEqual(imported.changes['number'], [None, 70])
+
+    def test_api_changes_since(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.contract.end_date += timedelta(days=1)
+            self.contract.save()
+        change = ChangeRecord.objects.get()
+        url = reverse('contracts:api_list', args=['history'])
+        data = self.client.get(url, {'changed_at__gt': (change.changed_at - timedelta(seconds=1)).isoformat(),
+                                     'object_type': ChangeRecord.CONTRACT, 'object_id': self.contract.pk}).json()
+        self.assertEqual([row['id'] for row in data['results']], [change.pk])
+        data = self.client.get(url, {'changed_at__gt': change.changed_at.isoformat()}).json()
+        self.assertEqual(data['results'], [])
+
+
+class ChangeHistoryRequestTests(TransactionTestCase):
+    """В запросе история пишется одной вставкой после коммита, автор — пользователь запроса."""
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        cache.clear()
+        self.contract = make_contracts(1, aks_per_contract=3)[0]
+        ChangeRecord.objects.all().delete()  # запись о создании договора
+        self.user = get_user_model().objects.create_user('editor')
+        self.client.force_login(self.user)
+
+    def test_formset_save_is_one_insert(self):
+        contract, district = self.contract, District.objects.get()
+        data = {
+            'customer_name': "ООО Правка", 'customer_inn': contract.customer_inn,
+            'start_date': contract.start_date, 'end_date': contract.end_date,
+            'implementator': contract.implementator_id, 'file1': SimpleUploadedFile('scan.pdf', b'%PDF-1.4'),
+            'aks-TOTAL_FORMS': 3, 'aks-INITIAL_FORMS': 3, 'aks-MIN_NUM_FORMS': 0, 'aks-MAX_NUM_FORMS': 500,
+        }
+        for i, ak in enumerate(contract.aks.order_by('number')):
+            data.update({f'aks-{i}-id': ak.pk, f'aks-{i}-contract': contract.pk, f'aks-{i}-number': ak.number,
+                         f'aks-{i}-district': district.pk, f'aks-{i}-address': f"ул. Мира, {i}"})
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media, ignore_errors=True)
+        with self.settings(MEDIA_ROOT=media), CaptureQueriesContext(connection) as ctx:
+            response = self.client.post(reverse('contracts:contract_edit', args=[contract.pk]), data)
+        self.assertEqual(response.status_code, 302)
+        inserts = [q['sql'] for q in ctx.captured_queries if 'INSERT INTO "contracts_app_changerecord"' in q['sql']]
+        self.assertEqual(len(inserts), 1)
+        self.assertEqual(ChangeRecord.objects.count(), 4)  # договор и три АК
+        self.assertEqual(set(ChangeRecord.objects.values_list('user_id', flat=True)), {self.user.pk})
+        changes = history.for_object(Contract, contract.pk).get().changes
+        self.assertEqual(changes['customer_name'], ["Заказчик 0", "ООО Правка"])
+        self.assertEqual(set(changes), {'customer_name', 'file1'})
+
+    def test_admin_inline_save_is_deferred(self):
+        contract, district = self.contract, District.objects.get()
+        Contract.objects.filter(pk=contract.pk).update(file1='')
+        data = {
+            'customer_name': contract.customer_name, 'customer_inn': contract.customer_inn,
+            'start_date': contract.start_date, 'end_date': contract.end_date,
+            'implementator': contract.implementator_id,
+            'aks-TOTAL_FORMS': 20, 'aks-INITIAL_FORMS': 3, 'aks-MIN_NUM_FORMS': 0, 'aks-MAX_NUM_FORMS': 500,
+        }
+        aks = list(contract.aks.order_by('number'))
+        for i in range(20):
+            data.update({f'aks-{i}-contract': contract.pk, f'aks-{i}-number': 100 + i,
+                         f'aks-{i}-district': district.pk, f'aks-{i}-address': "ул. Новая"})
+            if i < len(aks):
+                data[f'aks-{i}-id'] = aks[i].pk
+        self.client.force_login(get_user_model().objects.create_superuser('admin', 'admin@example.com', 'pass'))
+        url = reverse('admin:contracts_app_contract_change', args=[contract.pk])
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post(url, data)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(contract.aks.count(), 20)
+        sql = [q['sql'] for q in ctx.captured_queries]
+        # Снимки сводок — до и после, а не по паре на каждую строку инлайна
+        self.assertEqual(sum('"contracts_app_district"."region_id", COUNT(' in q for q in sql), 2)
+        self.assertEqual(sum(q.startswith('UPDATE "contracts_app_contract" SET "updated_at"') for q in sql), 1)
+        self.assertEqual(sum(q.startswith('INSERT INTO "contracts_app_cacheversion"') for q in sql), 1)
+        self.assertEqual(sum(q.startswith('INSERT INTO "contracts_app_changerecord"') for q in sql), 1)
+        self.assertEqual(summary.snapshots([contract.pk])[contract.pk].districts[(district.pk, district.region_id)], 20)
+
+    def test_async_checklist_toggle(self):
+        async def post():
+            client = AsyncClient()
+            await client.aforce_login(self.user)
+            return await client.post(reverse('contracts:update_checklist', args=[self.contract.pk]),
+                                     {'gos_services': 'true'})
+        self.assertTrue(async_to_sync(post)().json()['success'])
+        change = ChangeRecord.objects.get()
+        self.assertEqual((change.user_id, change.changes), (self.user.pk, {'gos_services': [False, True]}))
 
-# Create your tests here.
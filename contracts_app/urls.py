@@ -6,9 +6,23 @@ app_name = 'contracts'
 
 urlpatterns = [
     path('', views.ContractListView.as_view(), name='contract_list'),
+    path('dashboard/', views.dashboard, name='dashboard'),
+    path('export/', views.contract_export, name='contract_export'),
+    path('export/files/', views.contract_files_zip, name='contract_files_zip'),
     path('contract/<int:pk>/', views.ContractDetailView.as_view(), name='contract_detail'),
+    path('contract/<int:pk>/files/<int:number>/', views.contract_file, name='contract_file'),
     path('contract/add/', views.ContractCreateView.as_view(), name='contract_add'),
     path('contract/<int:pk>/edit/', views.ContractUpdateView.as_view(), name='contract_edit'),
+    path('contract/<int:pk>/import-aks/', views.AKImportView.as_view(), name='ak_import'),
+    path('contract/<int:pk>/aks/', views.ak_save, name='ak_add'),
+    path('contract/<int:pk>/aks/<int:ak_pk>/', views.ak_save, name='ak_edit'),
+    path('contract/<int:pk>/aks/<int:ak_pk>/delete/', views.ak_delete, name='ak_delete'),
+    path('aks/search/', views.ak_search, name='ak_search'),
+    path('api/<slug:resource>/', views.api_list, name='api_list'),
+    path('health/', views.health, name='health'),
+    path('metrics', views.metrics_view, name='metrics'),
+    path('districts/autocomplete/', views.district_autocomplete, name='district_autocomplete'),
+    path('checklists/', views.update_checklists, name='update_checklists'),
     path('contract/<int:pk>/update-checklist/', views.update_checklist, name='update_checklist'),
     path('contract/<int:pk>/delete/', views.ContractDeleteView.as_view(), name='contract_delete'),
 ]
\ No newline at end of file
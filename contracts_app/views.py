@@ -1,52 +1,143 @@
 # contracts_app/views.py
-from django.views.generic import ListView, DetailView, CreateView, UpdateView, DeleteView
-from django.shortcuts import get_object_or_404, redirect
-from django.urls import reverse_lazy
+import json
+import os
+from datetime import date
+
+from django.views.generic import ListView, DetailView, CreateView, UpdateView, DeleteView, FormView
+from django.shortcuts import get_object_or_404, redirect, render
+from django.urls import reverse, reverse_lazy
 from django.contrib.messages.views import SuccessMessageMixin
 from django.contrib import messages
-from django.db.models import Q
-from .models import Contract
-from .forms import ContractForm, AKFormSet
-from django.http import JsonResponse
-from django.views.decorators.http import require_POST
+from django.contrib.auth.decorators import login_required, permission_required
+from django.db import DatabaseError, connections
+from django.db.models import Prefetch, Sum
+from .models import Contract, AK, District, Region, RegionSummary, DistrictSummary, ImplementatorSummary, ExpirySummary
+from .routers import read_only
+from .search import Casefold, filter_contracts, has_trigram, number_prefix_ranges, search_ak_addresses
+from .pagination import InvalidCursor, apaginate_by_cursor_or_404, paginate_chain_by_cursor
+from .forms import ContractForm, AKForm, AKFormSet, AKImportForm
+from .importers import import_aks, iter_rows, ImportFormatError
+from . import api, exports, archives, caching, checklist, downloads, metrics, summary
+from django.core.cache.utils import make_template_fragment_key
+from django.core.paginator import InvalidPage
+from django.http import (
+    Http404, HttpResponse, JsonResponse, StreamingHttpResponse, HttpResponseBadRequest, HttpResponseForbidden,
+)
+from django.views.decorators.http import require_GET, require_POST
+from django.views.decorators.cache import cache_page
+from django.utils import timezone
+from django.utils.decorators import method_decorator
+from django.utils.safestring import mark_safe
+from django.template.loader import render_to_string
+from django.core.cache import cache
+
+
+def ak_queryset():
+    # район и регион нужны для {{ ak.district }} — подтягиваем их одним запросом
+    return AK.objects.select_related('district__region')
 
 
+def aks_prefetch():
+    return Prefetch('aks', queryset=ak_queryset())
 
+
+@method_decorator(read_only, name='dispatch')
+@method_decorator(caching.list_condition, name='dispatch')
 class ContractListView(ListView):
     model = Contract
     template_name = 'contracts/contract_list.html'
+    items_template_name = 'contracts/_contract_list_items.html'
     context_object_name = 'contracts'
     paginate_by = 10
     ordering = ['-start_date']
 
+    async def dispatch(self, request, *args, **kwargs):
+        # Асинхронный dispatch нужен, чтобы list_condition обернул корутину
+        return await super().dispatch(request, *args, **kwargs)
+
+    async def get(self, request, *args, **kwargs):
+        # Список договоров рендерится отдельно и кэшируется по параметрам фильтра;
+        # CSRF-токен и прочее пользовательское остаётся в обёртке страницы.
+        key = caching.list_cache_key(request)
+        list_html = await cache.aget(key)
+        if list_html is None:
+            self.object_list = self.get_queryset()
+            self.page_result = await self.apaginate_queryset(self.object_list, self.paginate_by)
+            list_html = render_to_string(self.items_template_name, self.get_context_data(), request)
+            await cache.aset(key, list_html, caching.LIST_CACHE_TIMEOUT)
+        return render(request, self.template_name, {
+            'list_html': mark_safe(list_html),
+            'search_query': request.GET.get('q', ''),
+            'selected_status': request.GET.get('status', ''),
+        })
+
     def get_queryset(self):
-        queryset = super().get_queryset()
-        query = self.request.GET.get('q')
-        status = self.request.GET.get('status')
-
-        if query:
-            queryset = queryset.filter(
-                Q(customer_name__icontains=query) |
-                Q(customer_inn__icontains=query) |
-                Q(implementator__name__icontains=query)
-            )
-        if status:
-            queryset = queryset.filter(status=status)
+        queryset = super().get_queryset().with_counts().with_live_status().prefetch_related(aks_prefetch())
+        return filter_contracts(queryset, self.request.GET)
+
+    async def apaginate_queryset(self, queryset, page_size):
+        # Результаты поиска упорядочены по релевантности — для них обычная пагинация,
+        # для остального списка курсор по (-start_date, id) без COUNT(*) и OFFSET.
+        if self.request.GET.get('q'):
+            paginator = self.get_paginator(queryset, page_size)
+            paginator.count = await queryset.acount()
+            try:
+                page = paginator.page(self.request.GET.get(self.page_kwarg) or 1)
+            except InvalidPage as exc:
+                raise Http404(str(exc))
+            page.object_list = [contract async for contract in page.object_list]
+            return paginator, page, page.object_list, page.has_other_pages()
+        page = await apaginate_by_cursor_or_404(queryset, self.request.GET.get('cursor'), page_size)
+        return None, page, page.object_list, page.has_other_pages()
 
-        return queryset
+    def paginate_queryset(self, queryset, page_size):
+        # Страница уже прочитана в apaginate_queryset (шаблон не должен ходить в базу)
+        return self.page_result
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['search_query'] = self.request.GET.get('q', '')
         context['selected_status'] = self.request.GET.get('status', '')
+        context['fragment_timeout'] = caching.FRAGMENT_CACHE_TIMEOUT
+        context['reference_version'] = caching.reference_version(self.request)
         return context
 
 
+@method_decorator(read_only, name='dispatch')
+@method_decorator(caching.detail_condition, name='dispatch')
 class ContractDetailView(DetailView):
     model = Contract
     template_name = 'contracts/contract_detail.html'
     context_object_name = 'contract'
 
+    async def dispatch(self, request, *args, **kwargs):
+        return await super().dispatch(request, *args, **kwargs)
+
+    async def get(self, request, *args, **kwargs):
+        try:
+            self.object = await self.get_queryset().aget(pk=kwargs['pk'])
+        except Contract.DoesNotExist:
+            raise Http404("Договор не найден")
+        context = self.get_context_data(object=self.object)
+        # АК читаем, только если таблицы нет в кэше фрагментов
+        key = make_template_fragment_key('contract_aks', [
+            self.object.pk, self.object.updated_at.timestamp(), context['reference_version'],
+        ])
+        if not await cache.ahas_key(key):
+            context['aks'] = [ak async for ak in context['aks']]
+        return self.render_to_response(context)
+
+    def get_queryset(self):
+        return super().get_queryset().select_related('implementator').with_live_status()
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['aks'] = ak_queryset().filter(contract=self.object)
+        context['fragment_timeout'] = caching.FRAGMENT_CACHE_TIMEOUT
+        context['reference_version'] = caching.reference_version(self.request)
+        return context
+
+
 class ContractCreateView(SuccessMessageMixin, CreateView):
     model = Contract
     form_class = ContractForm
@@ -66,18 +157,21 @@ class ContractCreateView(SuccessMessageMixin, CreateView):
         context = self.get_context_data()
         ak_formset = context['ak_formset']
 
-        # Сохраняем контракт
-        self.object = form.save()
+        # Сводки дашборда и сброс кэша — один раз на договор, а не на каждый АК
+        with summary.deferred(), caching.deferred():
+            # Сохраняем контракт
+            self.object = form.save()
 
-        # Привязываем формсет к сохранённому объекту
-        ak_formset.instance = self.object
-        if ak_formset.is_valid():
-            ak_formset.save()
-        else:
-            # Если АК невалидны — возвращаем форму с ошибками
-            return self.form_invalid(form)
+            # Привязываем формсет к сохранённому объекту
+            ak_formset.instance = self.object
+            if ak_formset.is_valid():
+                ak_formset.save()
+            else:
+                # Если АК невалидны — возвращаем форму с ошибками
+                return self.form_invalid(form)
 
-        return super().form_valid(form)
+            # ModelFormMixin.form_valid сохраняет договор ещё раз — тоже внутри deferred()
+            return super().form_valid(form)
 
     def form_invalid(self, form):
         # Добавляем формсет в контекст, чтобы ошибки отобразились
@@ -96,25 +190,30 @@ class ContractUpdateView(SuccessMessageMixin, UpdateView):
     def get_context_data(self, **kwargs):
         data = super().get_context_data(**kwargs)
         if self.request.POST:
-            data['ak_formset'] = AKFormSet(self.request.POST, self.request.FILES, instance=self.object)
+            data['ak_formset'] = AKFormSet(
+                self.request.POST, self.request.FILES, instance=self.object, queryset=ak_queryset()
+            )
         else:
-            data['ak_formset'] = AKFormSet(instance=self.object)
+            data['ak_formset'] = AKFormSet(instance=self.object, queryset=ak_queryset())
         return data
 
     def form_valid(self, form):
         context = self.get_context_data()
         ak_formset = context['ak_formset']
-        self.object = form.save()
-        ak_formset.instance = self.object
-        if ak_formset.is_valid():
-            ak_formset.save()
-        else:
-            return self.form_invalid(form)
-        return super().form_valid(form)
+        with summary.deferred(), caching.deferred():
+            self.object = form.save()
+            ak_formset.instance = self.object
+            if ak_formset.is_valid():
+                ak_formset.save()
+            else:
+                return self.form_invalid(form)
+            return super().form_valid(form)
 
     def form_invalid(self, form):
         context = self.get_context_data()
-        context['ak_formset'] = AKFormSet(self.request.POST, self.request.FILES, instance=self.object)
+        context['ak_formset'] = AKFormSet(
+            self.request.POST, self.request.FILES, instance=self.object, queryset=ak_queryset()
+        )
         return self.render_to_response(context)
 
 class ContractDeleteView(SuccessMessageMixin, DeleteView):
@@ -127,11 +226,294 @@ class ContractDeleteView(SuccessMessageMixin, DeleteView):
         return super().form_valid(form)
 
 
+class AKImportView(FormView):
+    form_class = AKImportForm
+    template_name = 'contracts/ak_import.html'
+
+    def dispatch(self, request, *args, **kwargs):
+        self.contract = get_object_or_404(Contract, pk=kwargs['pk'])
+        return super().dispatch(request, *args, **kwargs)
+
+    def get_context_data(self, **kwargs):
+        kwargs.setdefault('contract', self.contract)
+        return super().get_context_data(**kwargs)
+
+    def form_valid(self, form):
+        upload = form.cleaned_data['file']
+        try:
+            result = import_aks(self.contract, iter_rows(upload, upload.name), strict=form.cleaned_data['strict'])
+        except ImportFormatError as exc:
+            form.add_error('file', str(exc))
+            return self.form_invalid(form)
+        if result.created:
+            messages.success(self.request, f"Добавлено АК: {result.created}")
+        return self.render_to_response(self.get_context_data(form=form, result=result))
+
+
+EXPORT_FORMATS = {
+    'csv': (exports.stream_csv, 'text/csv; charset=utf-8'),
+    'xlsx': (exports.stream_xlsx, 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+}
+
+
+@require_GET
+@read_only
+def contract_export(request):
+    """Потоковая выгрузка реестра (CSV или XLSX) с теми же фильтрами ?q=&status=, что и у списка."""
+    queryset = filter_contracts(Contract.objects.order_by('-start_date', 'id'), request.GET)
+    export_format = request.GET.get('format', 'csv')
+    if export_format not in EXPORT_FORMATS:
+        return HttpResponseBadRequest("Неизвестный формат экспорта")
+    stream, content_type = EXPORT_FORMATS[export_format]
+    response = StreamingHttpResponse(stream(queryset), content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="contracts.{export_format}"'
+    return response
+
+
+def can_download(view):
+    """Вложения — только вошедшим пользователям с правом просмотра договоров."""
+    return login_required(permission_required('contracts_app.view_contract', raise_exception=True)(view))
+
+
+@require_GET
+@can_download
+@read_only
+def contract_file(request, pk, number):
+    """Вложение договора; байты отдаёт фронт-сервер или FileResponse с Range (downloads.py)."""
+    field = f'file{number}'
+    if field not in archives.FILE_FIELDS:
+        raise Http404("Нет такого вложения")
+    contract = get_object_or_404(Contract.objects.only('pk', 'customer_name', field), pk=pk)
+    field_file = getattr(contract, field)
+    if not field_file:
+        raise Http404("Файл не прикреплён")
+    filename = f"{archives.contract_folder(contract)}_{field}{os.path.splitext(field_file.name)[1]}"
+    try:
+        return downloads.serve(request, field_file.storage, field_file.name, filename)
+    except FileNotFoundError:
+        raise Http404("Файл не найден в хранилище")
+
+
+@require_GET
+@can_download
+@read_only
+def contract_files_zip(request):
+    """Все прикреплённые файлы отфильтрованных договоров одним ZIP-архивом."""
+    queryset = filter_contracts(Contract.objects.order_by('-start_date', 'id'), request.GET)
+    response = StreamingHttpResponse(archives.stream_zip(queryset), content_type='application/zip')
+    response['Content-Disposition'] = 'attachment; filename="contracts_files.zip"'
+    return response
+
+
+@require_GET
+@read_only
+def api_list(request, resource):
+    """JSON API: страница по курсору или, с ?format=ndjson, поток всех строк."""
+    resource = api.get_resource(resource)
+    try:
+        if request.GET.get('format') == 'ndjson':
+            return StreamingHttpResponse(api.iter_ndjson(resource, request.GET),
+                                         content_type='application/x-ndjson; charset=utf-8')
+        return JsonResponse(api.page(resource, request.GET), json_dumps_params={'ensure_ascii': False})
+    except api.APIError as exc:
+        return JsonResponse({'error': str(exc)}, status=400, json_dumps_params={'ensure_ascii': False})
+
+
+@require_POST
+async def update_checklist(request, pk):
+    if not await Contract.objects.filter(pk=pk).aexists():
+        raise Http404("Договор не найден")
+    # JS присылает изменённый чекбокс как "true"/"false", остальные отмеченные — как "on"
+    values = {name: request.POST.get(name, 'false') != 'false' for name in checklist.CHECKLIST_FIELDS}
+    await checklist.aapply_changes({pk: values})
+    return JsonResponse({'success': True, 'message': 'Чек-лист обновлён'})
+
+
+@require_POST
+async def update_checklists(request):
+    """Чек-листы многих договоров за один запрос: JSON {id: {поле: true/false}}."""
+    try:
+        changes, results = checklist.parse_changes(json.loads(request.body))
+    except ValueError as exc:  # в т.ч. ошибка JSON и ChecklistError
+        return JsonResponse({'success': False, 'message': str(exc)}, status=400)
+    results.update({str(pk): result for pk, result in (await checklist.aapply_changes(changes)).items()})
+    updated = sum(result == checklist.UPDATED for result in results.values())
+    return JsonResponse({
+        'success': not any(r in (checklist.NOT_FOUND, checklist.INVALID) for r in results.values()),
+        'message': f'Обновлено чек-листов: {updated}',
+        'results': results,
+    })
+
+
+DISTRICT_AUTOCOMPLETE_LIMIT = 20
+
+
+DASHBOARD_TOP = 20
+DASHBOARD_MONTHS = 12
+
+
+@require_GET
+@read_only
+def dashboard(request):
+    """Дашборд: только готовые сводки (summary.py), без GROUP BY по договорам и АК."""
+    first = timezone.now().date().replace(day=1)
+    months = [date(first.year + (first.month - 1 + i) // 12, (first.month - 1 + i) % 12 + 1, 1)
+              for i in range(DASHBOARD_MONTHS)]
+    expiry = {row.month: row for row in ExpirySummary.objects.filter(month__in=months)}
+    return render(request, 'contracts/dashboard.html', {
+        'totals': ImplementatorSummary.objects.aggregate(contracts=Sum('contracts'), aks=Sum('aks')),
+        'regions': RegionSummary.objects.select_related('region').filter(contracts__gt=0).order_by('-aks'),
+        'districts': DistrictSummary.objects.select_related('district__region')
+                     .filter(contracts__gt=0).order_by('-aks')[:DASHBOARD_TOP],
+        'implementators': ImplementatorSummary.objects.select_related('implementator')
+                          .filter(contracts__gt=0).order_by('-contracts')[:DASHBOARD_TOP],
+        'expiry': [(month, expiry.get(month)) for month in months],
+    })
+
+
+AK_SEARCH_PER_PAGE = 50
+AK_SEARCH_NUMBER_KEY = ('number', 'id')  # обход ak_number_idx по порядку
+AK_SEARCH_ADDRESS_KEY = ('id',)          # по rowid из индекса адресов — без сортировки совпадений
+
+
+def _ak_search_json(ak):
+    return {
+        **_ak_json(ak),
+        'district_name': ak.district.name, 'region': ak.district.region_id, 'region_name': ak.district.region.name,
+        'contract': ak.contract_id, 'customer_name': ak.contract.customer_name,
+        'contract_url': reverse('contracts:contract_detail', args=[ak.contract_id]),
+    }
+
+
+@require_GET
+@read_only
+def ak_search(request):
+    """
+    Поиск АК по всем договорам: начало номера (индекс ak_number_idx) и (или)
+    слова адреса (индекс trigram), с фильтром по району и региону.
+    С номером результаты идут по номеру, только по адресу — в порядке ввода АК;
+    страницы по курсору, ?format=json — для виджетов.
+    """
+    params = request.GET
+    number = params.get('number', '').strip()
+    address = params.get('address', '').strip()
+    region = params.get('region', '')
+    district = params.get('district', '')
+    error = None
+    page = None
+
+    ranges = number_prefix_ranges(number) if number else [None]
+    if ranges is None:
+        error = "Номер АК — до 8 цифр, без ведущих нулей."
+    elif address and not has_trigram(address) and not number:
+        error = "Укажите номер АК или хотя бы одно слово адреса от трёх букв."
+    elif number or address:
+        queryset = AK.objects.select_related('district__region', 'contract').only(
+            'number', 'address', 'contract_id', 'contract__customer_name',
+            'district__name', 'district__region__name',
+        )
+        if address:
+            queryset = search_ak_addresses(queryset, address)
+        if district.isdigit():
+            queryset = queryset.filter(district_id=district)
+        elif region.isdigit():
+            queryset = queryset.filter(district__region_id=region)
+        parts = [queryset.filter(number__range=bounds) if bounds else queryset for bounds in ranges]
+        key = AK_SEARCH_NUMBER_KEY if number else AK_SEARCH_ADDRESS_KEY
+        try:
+            page = paginate_chain_by_cursor(parts, params.get('cursor'), AK_SEARCH_PER_PAGE, key)
+        except InvalidCursor as exc:
+            error = str(exc)
+
+    if params.get('format') == 'json':
+        if error:
+            return JsonResponse({'error': error}, status=400, json_dumps_params={'ensure_ascii': False})
+        return JsonResponse({
+            'results': [_ak_search_json(ak) for ak in page or []],
+            'next_cursor': page.next_cursor if page else None,
+            'previous_cursor': page.previous_cursor if page else None,
+        }, json_dumps_params={'ensure_ascii': False})
+
+    selected_district = District.objects.select_related('region').filter(pk=district).first() if district.isdigit() else None
+    return render(request, 'contracts/ak_search.html', {
+        'page': page,
+        'error': error,
+        'number': number,
+        'address': address,
+        'regions': Region.objects.order_by('name').only('name'),
+        'selected_region': int(region) if region.isdigit() else None,
+        'selected_district': selected_district,
+        'query_string': _without_cursor(params),
+    })
+
+
+def _without_cursor(params):
+    params = params.copy()
+    params.pop('cursor', None)
+    return params.urlencode()
+
+
+@require_GET
+def metrics_view(request):
+    """Метрики процесса в текстовом формате Prometheus (доступ — metrics.allowed)."""
+    if not metrics.allowed(request):
+        return HttpResponseForbidden()
+    return HttpResponse(metrics.registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@require_GET
+def health(request):
+    """Проверка для балансировщика: каждое соединение с базой отвечает на SELECT 1."""
+    status = {}
+    for alias in connections:
+        try:
+            with connections[alias].cursor() as cursor:
+                cursor.execute("SELECT 1")
+            status[alias] = 'ok'
+        except DatabaseError as exc:
+            status[alias] = f'error: {exc}'
+    healthy = all(value == 'ok' for value in status.values())
+    return JsonResponse({'status': 'ok' if healthy else 'error', 'databases': status}, status=200 if healthy else 503)
+
+
+@require_GET
+@cache_page(60 * 5)
+@read_only
+def district_autocomplete(request):
+    """Районы по началу названия (и региону) для виджета выбора района."""
+    districts = District.objects.select_related('region')
+    query = request.GET.get('q', '').strip()
+    region = request.GET.get('region')
+    if query:
+        # LIKE в SQLite не учитывает регистр только для латиницы — сравниваем свёрнутые строки
+        districts = districts.alias(name_folded=Casefold('name')).filter(name_folded__startswith=query.casefold())
+    if region and region.isdigit():
+        districts = districts.filter(region_id=region)
+    results = [{'id': d.pk, 'text': str(d)} for d in districts[:DISTRICT_AUTOCOMPLETE_LIMIT]]
+    return JsonResponse({'results': results})
+
+
+def _ak_json(ak):
+    return {'id': ak.pk, 'number': ak.number, 'district': ak.district_id, 'address': ak.address}
+
+
+@require_POST
+def ak_save(request, pk, ak_pk=None):
+    """Добавляет или изменяет один АК договора, не трогая остальные."""
+    contract = get_object_or_404(Contract.objects.only('pk'), pk=pk)
+    instance = get_object_or_404(AK, pk=ak_pk, contract=contract) if ak_pk else AK(contract=contract)
+    form = AKForm(request.POST, instance=instance)
+    if form.is_valid():
+        form.validate_contract_unique(contract)
+    if form.errors:
+        return JsonResponse({'success': False, 'errors': form.errors}, status=400)
+    ak = form.save()
+    return JsonResponse({'success': True, 'message': 'АК сохранён', 'ak': _ak_json(ak)})
+
+
 @require_POST
-def update_checklist(request, pk):
-    contract = get_object_or_404(Contract, pk=pk)
-    contract.gos_services = 'gos_services' in request.POST
-    contract.oko = 'oko' in request.POST
-    contract.spolokh = 'spolokh' in request.POST
-    contract.save()
-    return JsonResponse({'success': True, 'message': 'Чек-лист обновлён'})
\ No newline at end of file
+def ak_delete(request, pk, ak_pk):
+    deleted, _ = AK.objects.filter(pk=ak_pk, contract_id=pk).delete()
+    if not deleted:
+        return JsonResponse({'success': False, 'message': 'АК не найден'}, status=404)
+    return JsonResponse({'success': True, 'message': 'АК удалён'})